@@ -0,0 +1,165 @@
+import itertools
+import math
+import os
+import threading
+import time
+
+# Przybliżone zużycie pamięci przez jedno zadanie transkrypcji dla modeli whispera (MB)
+WHISPER_JOB_MEMORY_MB = {"tiny": 1024, "base": 1024, "small": 2048, "medium": 5120, "large": 10240}
+
+ADMISSION_PER_USER_JOBS = int(os.getenv("ADMISSION_PER_USER_JOBS", 1))
+ADMISSION_WAIT_SECONDS = int(os.getenv("ADMISSION_WAIT_SECONDS", 30 * 60))
+ADMISSION_AGING_SECONDS = int(os.getenv("ADMISSION_AGING_SECONDS", 300))  # Co tyle czekania zadanie awansuje o jeden poziom
+ADMISSION_DEFAULT_JOB_SECONDS = 300  # Szacowany czas zadania, zanim zmierzymy prawdziwe
+
+# Priorytet wg największego kupionego pakietu (mniejsza liczba = wcześniej w kolejce)
+PACKAGE_PRIORITIES = ((3000, 0), (300, 1), (30, 2))
+FREE_PRIORITY = 3
+
+class AdmissionRejected(Exception):
+    pass
+
+def package_priority(largest_package_credits):
+    for credits, priority in PACKAGE_PRIORITIES:
+        if largest_package_credits and largest_package_credits >= credits:
+            return priority
+    return FREE_PRIORITY
+
+def _total_memory_mb():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def default_slots(model_name):
+    """Liczba równoległych zadań, na które starczy pamięci i rdzeni"""
+    if os.getenv("ADMISSION_SLOTS"):
+        return max(1, int(os.getenv("ADMISSION_SLOTS")))
+    job_memory = int(os.getenv("ADMISSION_JOB_MEMORY_MB", 0)) or WHISPER_JOB_MEMORY_MB.get(model_name.split(".")[0].split("-")[0], 10240)
+    total_memory = _total_memory_mb()
+    slots = os.cpu_count() or 1
+    if total_memory:
+        slots = min(slots, total_memory // job_memory)
+    return max(1, slots)
+
+class AdmissionTicket:
+    """Miejsce zadania w kolejce / w puli slotów"""
+
+    def __init__(self, controller, ticket_id, user_id, priority):
+        self.controller = controller
+        self.id = ticket_id
+        self.user_id = user_id
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.admitted_at = None
+
+    def effective_priority(self, now):
+        # Starzenie: długo czekające zadania z niższym priorytetem też w końcu dostaną slot
+        return self.priority - (now - self.enqueued_at) / ADMISSION_AGING_SECONDS
+
+    def release(self):
+        self.controller.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class AdmissionController:
+    """Kontrola dostępu do ciężkich etapów: globalna liczba slotów, limit na użytkownika i kolejka priorytetowa"""
+
+    def __init__(self, slots, per_user_limit=ADMISSION_PER_USER_JOBS):
+        self.slots = slots
+        self.per_user_limit = per_user_limit
+        self._condition = threading.Condition()
+        self._sequence = itertools.count(1)
+        self._waiting = []
+        self._running = {}
+        self._avg_job_seconds = ADMISSION_DEFAULT_JOB_SECONDS
+        self.metrics = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected_user_limit": 0,
+            "rejected_timeout": 0,
+            "total_wait_seconds": 0.0,
+        }
+
+    def _user_jobs(self, user_id):
+        return sum(1 for ticket in itertools.chain(self._waiting, self._running.values()) if ticket.user_id == user_id)
+
+    def _queue_order(self):
+        now = time.monotonic()
+        return sorted(self._waiting, key=lambda ticket: (ticket.effective_priority(now), ticket.id))
+
+    def _eta_seconds(self, position):
+        # Przed nami `position` zadań w kolejce, a wszystkie sloty są zajęte
+        return math.ceil((position + 1) / self.slots) * self._avg_job_seconds
+
+    def acquire(self, user_id, priority=FREE_PRIORITY, timeout=ADMISSION_WAIT_SECONDS, on_wait=None):
+        """Czeka na wolny slot. on_wait(pozycja, szacowany_czas_s) jest wołane co kilka sekund podczas czekania."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            if self._user_jobs(user_id) >= self.per_user_limit:
+                self.metrics["rejected_user_limit"] += 1
+                raise AdmissionRejected(f"Limit of {self.per_user_limit} concurrent job(s) per user reached")
+
+            ticket = AdmissionTicket(self, next(self._sequence), user_id, priority)
+            self._waiting.append(ticket)
+            try:
+                while True:
+                    position = self._queue_order().index(ticket)
+                    if position < self.slots - len(self._running):
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.metrics["rejected_timeout"] += 1
+                        raise AdmissionRejected("Timed out waiting for a free processing slot")
+                    if on_wait:
+                        # on_wait aktualizuje UI (może być wolne albo przerwane rerunem) - nie blokujemy
+                        # przy tym kolejki innych sesji
+                        eta_seconds = self._eta_seconds(position)
+                        self._condition.release()
+                        try:
+                            on_wait(position + 1, eta_seconds)
+                        finally:
+                            self._condition.acquire()
+                        # W trakcie on_wait mógł zwolnić się slot
+                        position = self._queue_order().index(ticket)
+                        if position < self.slots - len(self._running):
+                            break
+                    self._condition.wait(min(remaining, 5))
+            except BaseException:
+                self._waiting.remove(ticket)
+                self._condition.notify_all()
+                raise
+
+            self._waiting.remove(ticket)
+            ticket.admitted_at = time.monotonic()
+            self._running[ticket.id] = ticket
+            waited = ticket.admitted_at - ticket.enqueued_at
+            self.metrics["admitted"] += 1
+            self.metrics["total_wait_seconds"] += waited
+            if waited > 0.1:
+                self.metrics["queued"] += 1
+        return ticket
+
+    def release(self, ticket):
+        with self._condition:
+            if self._running.pop(ticket.id, None) is None:
+                return
+            duration = time.monotonic() - ticket.admitted_at
+            # Średnia krocząca czasu zadania do szacowania czasu oczekiwania
+            self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * duration
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {
+                "slots": self.slots,
+                "per_user_limit": self.per_user_limit,
+                "running": len(self._running),
+                "waiting": len(self._waiting),
+                "avg_job_seconds": round(self._avg_job_seconds, 1),
+                **self.metrics,
+            }
@@ -1,33 +1,60 @@
 import os
 import whisper
 import requests
-from pydub import AudioSegment
-from moviepy.video.io.VideoFileClip import VideoFileClip
-from moviepy.video.io.ffmpeg_tools import ffmpeg_extract_audio
 import warnings
-import subprocess
 import torch
 import streamlit as st
 import tempfile
+import shutil
 import time
 from datetime import datetime, timedelta
 import yt_dlp
 import openai
 from dotenv import load_dotenv
 import stripe
-from database import init_db, register_user, verify_user, save_transcription, get_user_transcriptions, get_transcription, get_user_credits, use_credit, add_credits, get_db_connection, get_user_premium_tokens
+from payments import confirm_payment, start_reconciler
+from scratch import scratch_manager, ScratchQuotaExceeded
+from profiling import start_job_profile, current_profile, is_enabled as profiling_enabled, set_enabled as set_profiling_enabled, list_profiles, profile_archive, function_stats
+from dbstats import db_path, path_stats, query_stats, export_stats
+from admission import AdmissionController, AdmissionRejected, default_slots, package_priority
+from audio import convert_to_pcm, load_pcm, pcm_duration, probe_duration, PCM_SAMPLE_RATE, PCM_SUFFIX
+from estimates import estimate_job, RTF_HISTORY_JOBS
+from retrieval import relevant_context, index_transcription
+from exports import EXPORT_FORMATS, write_export
+from history_io import HISTORY_FORMATS, HISTORY_IMPORT_TYPES, HistoryReader, write_history
+from tokens import PROMPT_TOKEN_BUDGET, compact_whitespace, count_message_tokens, count_tokens, fit_transcript
+from diarization import diarize_async
+from model_server import MODEL_SERVER_SOCKET, ModelClient, ModelServerError
+from streaming import LiveTranscriber, open_stream, STREAM_URL_SCHEMES, STREAM_MAX_SECONDS
+from segments import SegmentTable, SEGMENT_EXPORTS, assign_speakers, write_segments, low_confidence_windows, splice_segments
+from database import init_db, register_user, verify_user, save_transcription, get_user_transcriptions, get_transcription, get_user_credits, use_credit, add_credits, get_db_connection, get_user_premium_tokens, reserve_credit, commit_reservation, release_reservation, release_expired_reservations, search_transcriptions, save_transcription_segments, get_transcription_segments, update_transcription_text, get_user_largest_package, update_transcription_notes, record_token_usage, get_top_token_users, get_user_id, iter_user_transcriptions, import_transcriptions, record_job_stats, get_job_rtfs
 import json
+import math
+import io
+import urllib.parse
+import uuid
+import numpy as np
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 import gc
-import torch
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import contextvars
+from collections import OrderedDict
 
 # Konfiguracja JWT
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-keep-it-secret")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 godziny
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Cache zweryfikowanych tokenów - kolejne reruny nie odpytują bazy o użytkownika
+TOKEN_CACHE_TTL_SECONDS = int(os.getenv("TOKEN_CACHE_TTL_SECONDS", 300))
+TOKEN_CACHE_MAX_SIZE = 10000
+
+@st.cache_resource
+def _token_cache():
+    # Streamlit wykonuje skrypt od nowa przy każdym rerunie - cache musi żyć w cache_resource
+    return OrderedDict(), threading.Lock()
 
 # Funkcje autoryzacji przeniesione z auth.py
 def create_access_token(data: dict):
@@ -48,18 +75,25 @@ def decode_token(token: str):
         return None
 
 # Funkcje API przeniesione z api.py
+@db_path("auth.login")
 def handle_login(username: str, password: str):
     user = verify_user(username, password)
     if not user:
         return None
     
+    credits = user[2]
+    # Zwracamy kredyty z rezerwacji zadań, które przekroczyły limit czasu
+    if release_expired_reservations(user[0]):
+        credits = get_user_credits(user[0])
+
     access_token = create_access_token(data={"sub": username})
+    _cache_token(access_token, {"user_id": user[0], "username": user[1], "credits": credits})
     return {
         "access_token": access_token,
         "token_type": "bearer",
         "user_id": user[0],
         "username": user[1],
-        "credits": user[2]
+        "credits": credits
     }
 
 def handle_register(username: str, password: str, email: str, terms_accepted: bool = False):
@@ -71,27 +105,59 @@ def handle_register(username: str, password: str, email: str, terms_accepted: bo
     except Exception as e:
         return False
 
+@db_path("auth.verify_token")
 def handle_verify_token(token: str):
+    now = time.monotonic()
+    cache, lock = _token_cache()
+    with lock:
+        cached = cache.get(token)
+        if cached and cached[1] > now:
+            cache.move_to_end(token)
+            return dict(cached[0])
+
     username = decode_token(token)
     if username is None:
         return None
     user = verify_user(username, None)
     if not user:
         return None
-    return {
+    user_data = {
         "user_id": user[0],
         "username": user[1],
         "credits": user[2]
     }
-
-# Inicjalizacja bazy danych
-init_db()
+    _cache_token(token, user_data)
+    return dict(user_data)
+
+def _cache_token(token: str, user_data: dict):
+    cache, lock = _token_cache()
+    with lock:
+        cache[token] = (dict(user_data), time.monotonic() + TOKEN_CACHE_TTL_SECONDS)
+        cache.move_to_end(token)
+        while len(cache) > TOKEN_CACHE_MAX_SIZE:
+            cache.popitem(last=False)
+
+def invalidate_token(token: str):
+    cache, lock = _token_cache()
+    with lock:
+        cache.pop(token, None)
+
+# Inicjalizacja bazy danych - raz na proces, a nie przy każdym rerunie skryptu
+@st.cache_resource
+def _init_database():
+    init_db()
+    return True
+
+_init_database()
 
 # Wczytaj zmienne z pliku .env
 load_dotenv()
 
 # Konfiguracja Stripe
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+if os.getenv("STRIPE_API_BASE"):
+    # Lokalny stub Stripe (np. stripe-mock) do testów
+    stripe.api_base = os.getenv("STRIPE_API_BASE")
 STRIPE_PUBLISHABLE_KEY = os.getenv("STRIPE_PUBLISHABLE_KEY")
 
 # Konfiguracja API
@@ -104,21 +170,16 @@ openai.api_key = os.getenv("OPENAI_API_KEY")
 warnings.filterwarnings("ignore", category=FutureWarning, module="torch")
 warnings.filterwarnings("ignore", category=UserWarning, module="whisper.transcribe")
 
+# Użytkownicy z dostępem do panelu administracyjnego (metryki serwera)
+ADMIN_USERNAMES = {name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()}
+
 SUPPORTED_AUDIO = (".wav", ".mp3", ".m4a", ".flac")
 SUPPORTED_VIDEO = (".mp4", ".mov", ".avi", ".mkv")
 MAX_FILE_SIZE_MB = 500  # Maksymalny rozmiar pliku w MB
 
-def is_valid_file(file_path):
-    try:
-        command = ["ffmpeg", "-v", "error", "-i", file_path, "-f", "null", "-"]
-        subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-        return True
-    except subprocess.CalledProcessError:
-        return False
-
-def download_video(url):
+def download_video(url, output_dir=None):
     print(f"Downloading from URL: {url}")
-    with tempfile.NamedTemporaryFile(suffix='.%(ext)s', delete=False) as temp_video:
+    with tempfile.NamedTemporaryFile(suffix='.%(ext)s', dir=output_dir, delete=False) as temp_video:
         output_template = temp_video.name
         
     ydl_opts = {
@@ -132,10 +193,7 @@ def download_video(url):
         'socket_timeout': 30,
         'retries': 3,
         'verbose': True,  # Włączamy tryb verbose dla debugowania
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'wav',
-        }],
+        # Bez konwersji do WAV - oryginalny plik dekodujemy jednym przebiegiem do PCM
         'http_headers': {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
@@ -153,7 +211,6 @@ def download_video(url):
             
             # Pobierz faktyczną ścieżkę pliku
             output_path = ydl.prepare_filename(info)
-            output_path = output_path.rsplit('.', 1)[0] + '.wav'
             
             if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
                 raise ValueError("Download failed - empty or missing file")
@@ -167,33 +224,33 @@ def download_video(url):
             os.unlink(output_template)
         raise ValueError(f"Failed to download video: {str(e)}")
 
-def convert_to_wav(file_path):
-    print(f"Converting file: {file_path}")
-    file_ext = os.path.splitext(file_path)[1].lower()
-    
-    if not os.path.isfile(file_path):
-        raise FileNotFoundError(f"File {file_path} does not exist.")
-    
-    if not is_valid_file(file_path):
-        raise ValueError(f"File {file_path} is corrupted or unsupported.")
-    
-    # Używamy NamedTemporaryFile do utworzenia unikalnej nazwy pliku
-    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_wav:
-        output_path = temp_wav.name
-    
+def resolve_stream_url(url):
+    """Adres strumienia dla ffmpeg; dla stron z transmisjami (np. YouTube live) bezpośredni adres audio z yt-dlp"""
+    scheme = urllib.parse.urlparse(url).scheme.lower()
+    if scheme not in STREAM_URL_SCHEMES:
+        raise ValueError("Unsupported stream link. Use an http(s), RTMP, RTSP or SRT address.")
+    if scheme not in ("http", "https"):
+        return url
     try:
-        if file_ext in SUPPORTED_AUDIO:
-            audio = AudioSegment.from_file(file_path, parameters=["-ac", "1", "-ar", "16000"])
-            audio.export(output_path, format="wav")
-        elif file_ext in SUPPORTED_VIDEO:
-            ffmpeg_extract_audio(file_path, output_path)
-        else:
-            raise ValueError(f"Unsupported file format: {file_ext}")
-        return output_path
+        with yt_dlp.YoutubeDL({'format': 'bestaudio/best', 'quiet': True, 'noplaylist': True, 'socket_timeout': 30}) as ydl:
+            info = ydl.extract_info(url, download=False)
+        return (info or {}).get('url') or url
     except Exception as e:
-        if os.path.exists(output_path):
-            os.unlink(output_path)
-        raise ValueError(f"Failed to convert file: {str(e)}")
+        # Bezpośrednie adresy HLS/Icecast yt-dlp nie zawsze rozpoznaje - ffmpeg czyta je sam
+        print(f"Could not resolve stream with yt-dlp, using the link directly: {e}")
+        return url
+
+def probe_url_duration(url):
+    """Długość nagrania z metadanych yt-dlp (bez pobierania). None gdy nieznana, np. dla transmisji."""
+    try:
+        with yt_dlp.YoutubeDL({'quiet': True, 'noplaylist': True, 'socket_timeout': 30}) as ydl:
+            info = ydl.extract_info(url, download=False)
+        duration = (info or {}).get('duration')
+        return float(duration) if duration else None
+    except Exception as e:
+        # Błędny link zgłosi pobieranie - tu tylko nie znamy długości
+        print(f"Could not read media duration for {url}: {e}")
+        return None
 
 def cleanup_memory():
     """Czyści pamięć po przetwarzaniu"""
@@ -207,12 +264,99 @@ if torch.cuda.is_available():
 else:
     device = "cpu"
 
-def transcribe_audio(audio_path, language):
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "large")
+
+# Szybkie wykrywanie języka małym modelem na pierwszych 30 s nagrania
+LANGUAGE_DETECT_MODEL = os.getenv("LANGUAGE_DETECT_MODEL", "tiny")
+LANGUAGE_DETECT_SECONDS = 30
+LANGUAGE_DETECT_MIN_PROBABILITY = float(os.getenv("LANGUAGE_DETECT_MIN_PROBABILITY", 0.5))
+# Opcjonalne kierowanie języków do innych modeli, np. "en:medium.en,de:medium"
+WHISPER_LANGUAGE_MODELS = dict(
+    item.split(":", 1) for item in os.getenv("WHISPER_LANGUAGE_MODELS", "").split(",") if ":" in item
+)
+OUTPUT_LANGUAGES = ["pl", "en", "de", "fr", "es"]
+# Każdy dodatkowy wynik (notatki w kolejnym języku, dodatkowe polecenie) to osobne wywołanie LLM
+EXTRA_OUTPUT_CREDITS = 1
+MAX_EXTRA_PROMPTS = 10
+
+# Ponowne dekodowanie fragmentów o niskiej pewności
+RETRANSCRIBE_MODEL = os.getenv("RETRANSCRIBE_MODEL", WHISPER_MODEL)
+RETRANSCRIBE_TEMPERATURES = (0.0, 0.2, 0.4, 0.6)
+RETRANSCRIBE_PADDING_SECONDS = 1.0  # Kontekst dokładany z obu stron okna
+RETRANSCRIBE_SECONDS_PER_CREDIT = 600  # Koszt: jeden kredyt za każde rozpoczęte 10 minut poprawianego audio
+
+@st.cache_resource(max_entries=3)
+def load_whisper_model(model_name):
+    """Ładuje model whisper raz na proces i trzyma go w pamięci między zadaniami"""
+    print(f"Loading Whisper model {model_name} on {device}...")
+    return whisper.load_model(model_name, device=device)
+
+@st.cache_resource
+def model_client():
+    return ModelClient(MODEL_SERVER_SOCKET)
+
+def run_whisper(model_name, audio, interactive=False, **options):
+    """model.transcribe przez serwer modeli (MODEL_SERVER_SOCKET) albo modelem załadowanym w tym procesie.
+    audio: ścieżka pliku (PCM jest mapowany w pamięć) albo tablica próbek."""
+    if MODEL_SERVER_SOCKET:
+        return model_client().transcribe(model_name, audio, interactive=interactive, **options)
+    if isinstance(audio, str) and audio.endswith(PCM_SUFFIX):
+        audio = load_pcm(audio)
+    return load_whisper_model(model_name).transcribe(audio, fp16=torch.cuda.is_available(), **options)
+
+def whisper_language_probabilities(model_name, window):
+    """Prawdopodobieństwa języków dla okna 30 s"""
+    if MODEL_SERVER_SOCKET:
+        return model_client().detect_language(model_name, window)
+    model = load_whisper_model(model_name)
+    mel = whisper.log_mel_spectrogram(window, n_mels=model.dims.n_mels).to(model.device)
+    _, probabilities = model.detect_language(mel)
+    return probabilities
+
+@st.cache_resource
+def admission_controller():
+    # Jeden kontroler na proces - sloty liczone z pamięci RAM i liczby rdzeni
+    return AdmissionController(default_slots(WHISPER_MODEL))
+
+def admit_job(placeholder):
+    """Czeka na slot przetwarzania, pokazując pozycję w kolejce. Zwraca bilet albo None (komunikat już wyświetlony)."""
+    def on_wait(position, eta_seconds):
+        placeholder.info(f"⏳ The server is busy. You are number {position} in the queue, "
+                         f"estimated wait: about {max(1, round(eta_seconds / 60))} min. Don't close this window.")
+    try:
+        priority = package_priority(get_user_largest_package(st.session_state.user_id))
+        ticket = admission_controller().acquire(st.session_state.user_id, priority, on_wait=on_wait)
+    except AdmissionRejected as e:
+        placeholder.error(f"Cannot start processing now: {e}. Please try again later.")
+        return None
+    placeholder.empty()
+    return ticket
+
+def model_for_language(language):
+    return WHISPER_LANGUAGE_MODELS.get(language, WHISPER_MODEL)
+
+def detect_audio_language(audio_path):
+    """Wykrywa język z pierwszych 30 s nagrania małym modelem. Zwraca kod języka albo None, gdy wynik jest niepewny."""
+    try:
+        audio = load_pcm(audio_path) if audio_path.endswith(PCM_SUFFIX) else whisper.load_audio(audio_path)
+        # Z mapy w pamięci czytamy tylko strony z pierwszego okna
+        window = whisper.pad_or_trim(np.array(audio[:LANGUAGE_DETECT_SECONDS * PCM_SAMPLE_RATE]))
+        probabilities = whisper_language_probabilities(LANGUAGE_DETECT_MODEL, window)
+        language = max(probabilities, key=probabilities.get)
+        print(f"Detected language: {language} ({probabilities[language]:.2f})")
+        if probabilities[language] < LANGUAGE_DETECT_MIN_PROBABILITY:
+            return None
+        return language
+    except Exception as e:
+        print(f"Error detecting language: {e}")
+        return None
+
+def transcribe_audio(audio_path, language, return_segments=False, model_name=None):
+    """Transkrybuje plik audio. Z return_segments=True zwraca (tekst, binarna tabela segmentów).
+    model_name zastępuje model wybrany dla języka (np. szybszy model dla długich nagrań)."""
     print("Transcribing audio...")
     try:
-        print(f"Loading Whisper model on {device}...")
-        model = whisper.load_model("large", device=device)  # Użyj GPU
-        print(f"Model loaded successfully. Starting transcription of file: {audio_path}")
+        print(f"Starting transcription of file: {audio_path}")
         
         # Sprawdzamy czy plik istnieje i ma odpowiedni rozmiar
         if not os.path.exists(audio_path):
@@ -220,97 +364,230 @@ def transcribe_audio(audio_path, language):
         
         file_size = os.path.getsize(audio_path)
         print(f"Audio file size: {file_size / (1024*1024):.2f} MB")
-        
-        # Dodajemy parametry dla whisper, aby lepiej kontrolować proces
-        result = model.transcribe(
-            audio_path,
-            language=language if language != "auto" else None,
-            fp16=torch.cuda.is_available(),  # Włączamy fp16 tylko na GPU
-            verbose=True  # Włączamy szczegółowe logi
-        )
+
+        # Plik PCM jest mapowany w pamięć (tu albo w serwerze modeli) - whisper nie uruchamia ponownie ffmpeg
+        with current_profile().torch_trace("transcribe"):
+            result = run_whisper(
+                model_name or model_for_language(language),
+                audio_path,
+                language=language if language != "auto" else None,
+                verbose=True  # Włączamy szczegółowe logi
+            )
         
         if not result or 'text' not in result:
             raise ValueError("Transcription result is empty or invalid")
             
         print("Transcription completed successfully")
+        if return_segments:
+            # Segmenty trzymamy w zwartej postaci kolumnowej zamiast pełnych słowników whisper
+            return result['text'], SegmentTable.from_whisper(result.get('segments', [])).to_bytes()
         return result['text']
     except Exception as e:
         print(f"Error during transcription: {str(e)}")
         import traceback
         traceback.print_exc()
+        if return_segments:
+            return f"Transcription error: {str(e)}", None
         return f"Transcription error: {str(e)}"
 
-def analyze_transcription(transcription, language):
+def job_device():
+    # Przy serwerze modeli czasy zależą od jego urządzenia, a nie od tego procesu
+    return "server" if MODEL_SERVER_SOCKET else device
+
+def estimate_media(media_seconds, language, extra_outputs=0):
+    """Plan zadania (model, szacowany czas, cena) dla nagrania o danej długości - patrz estimates.estimate_job.
+    Cena obejmuje dodatkowe wyniki zamówione razem z zadaniem."""
+    estimate = estimate_job(media_seconds, model_for_language(language), job_device(),
+                            lambda model, dev: get_job_rtfs(model, dev, RTF_HISTORY_JOBS))
+    estimate["credits"] += extra_outputs * EXTRA_OUTPUT_CREDITS
+    return estimate
+
+def accept_estimate(estimate):
+    """Pokazuje długość, szacowany czas i cenę zadania. Zwraca False (z komunikatem), gdy zadanie nie może ruszyć."""
+    if estimate["rejected"]:
+        st.error(estimate["rejected"])
+        return False
+    if st.session_state.credits < estimate["credits"]:
+        st.error(f"⚠️ This recording costs {estimate['credits']} credits and you have {st.session_state.credits}. "
+                 "Please refill your credits with button on the left sidebar.")
+        return False
+    if estimate["seconds"] is not None:
+        st.info(f"Recording length: {estimate['media_seconds'] / 60:.0f} min. "
+                f"Estimated processing time: about {max(1, round(estimate['seconds'] / 60))} min. "
+                f"Cost: {estimate['credits']} credit(s).")
+    elif estimate["credits"] > 1:
+        st.info(f"Cost: {estimate['credits']} credit(s).")
+    return True
+
+def add_speakers(transcription, segments_data, diarization):
+    """Czeka na wynik diaryzacji i przypisuje mówców segmentom. Zwraca (tekst z turami mówców, segmenty)."""
+    try:
+        turns = diarization.result()
+    except Exception as e:
+        print(f"Error during diarization: {e}")
+        return transcription, segments_data
+    # Przy jednym mówcy etykiety nic nie wnoszą - zostawiamy zwykły tekst
+    if not segments_data or len({speaker for _, _, speaker in turns}) < 2:
+        return transcription, segments_data
+    table = assign_speakers(SegmentTable.from_bytes(segments_data), turns)
+    return table.full_text(), table.to_bytes()
+
+def live_window_transcriber(language):
+    """Funkcja transkrybująca okna strumienia ciepłym modelem (ten sam cache co przy zwykłych zadaniach)"""
+    model_name = model_for_language(language)
+
+    def transcribe_window(audio, prompt, language):
+        result = run_whisper(
+            model_name,
+            audio,
+            interactive=True,  # Serwer modeli obsługuje okna przed długimi zadaniami
+            language=language,
+            initial_prompt=prompt,
+            condition_on_previous_text=False,  # Kontekst daje prompt z końcówki tekstu
+        )
+        return result.get("segments", []), result.get("language")
+    return transcribe_window
+
+def plan_retranscription(segments_data):
+    """Zwraca okna o niskiej pewności, ich łączny czas w sekundach i koszt w kredytach"""
+    table = SegmentTable.from_bytes(segments_data)
+    windows = low_confidence_windows(table)
+    seconds = sum(end - start for start, end in windows)
+    credits = math.ceil(seconds / RETRANSCRIBE_SECONDS_PER_CREDIT) if windows else 0
+    return windows, seconds, credits
+
+def retranscribe_low_confidence(audio_path, segments_data, language):
+    """Dekoduje ponownie tylko okna o niskiej pewności i wstawia wyniki do transkrypcji. Zwraca (tekst, segmenty)."""
+    table = SegmentTable.from_bytes(segments_data)
+    windows = low_confidence_windows(table)
+    if not windows:
+        return table.full_text(), segments_data
+
+    # Z pliku zmapowanego w pamięć czytane są tylko strony z poprawianych okien
+    audio = load_pcm(audio_path)
+    sample_rate = PCM_SAMPLE_RATE
+    replacements = []
+    for start, end in windows:
+        clip_start = max(0.0, start - RETRANSCRIBE_PADDING_SECONDS)
+        clip_end = end + RETRANSCRIBE_PADDING_SECONDS
+        clip = audio[int(clip_start * sample_rate):int(clip_end * sample_rate)]
+        print(f"Re-transcribing {start:.1f}s - {end:.1f}s")
+        result = run_whisper(
+            RETRANSCRIBE_MODEL,
+            clip,
+            language=language if language != "auto" else None,
+            temperature=RETRANSCRIBE_TEMPERATURES,
+            beam_size=5,
+            best_of=5,
+        )
+        for segment in result.get("segments", []):
+            segment["start"] += clip_start
+            segment["end"] += clip_start
+        replacements.append(result.get("segments", []))
+
+    spliced = splice_segments(table, windows, replacements)
+    return spliced.full_text(), spliced.to_bytes()
+
+NOTES_MODEL = "gpt-4o-mini"
+PROMPT_TEMPLATE_RESERVE_TOKENS = 500  # Miejsce w budżecie na instrukcje szablonu
+
+def chat_completion(messages, purpose, user_id=None, transcription_id=None, truncated=False):
+    """Wysyła prompt do modelu: kompaktuje szablon, liczy tokeny przed i po wywołaniu i zapisuje zużycie"""
+    messages = [{"role": message["role"], "content": compact_whitespace(message["content"])} for message in messages]
+    estimated_tokens = count_message_tokens(messages, NOTES_MODEL)
+    if estimated_tokens > PROMPT_TOKEN_BUDGET:
+        raise ValueError(f"Prompt too large: {estimated_tokens} tokens (budget {PROMPT_TOKEN_BUDGET})")
+
+    client = openai.OpenAI()
+    response = client.chat.completions.create(
+        model=NOTES_MODEL,
+        messages=messages,
+        temperature=0.7
+    )
+    usage = getattr(response, "usage", None)
+    prompt_tokens = usage.prompt_tokens if usage else None
+    completion_tokens = usage.completion_tokens if usage else None
+    print(f"LLM call '{purpose}': estimated {estimated_tokens} prompt tokens, "
+          f"actual {prompt_tokens} prompt + {completion_tokens} completion")
+    if user_id:
+        record_token_usage(user_id, purpose, NOTES_MODEL, estimated_tokens, prompt_tokens, completion_tokens,
+                           transcription_id=transcription_id, truncated=truncated)
+    return response.choices[0].message.content.strip()
+
+def _notes_messages(transcription, instruction):
+    # Transkrypcja idzie na początek jako identyczny prefiks - przy kilku wywołaniach dla tej samej
+    # transkrypcji (różne języki notatek) OpenAI może użyć cache promptu zamiast liczyć go od nowa
+    return [
+        {"role": "system", "content": f"Transcription:\n{transcription}"},
+        {"role": "user", "content": instruction},
+    ]
+
+def analyze_transcription(transcription, language, user_id=None, transcription_id=None):
     print("Analyzing key conversation points...")
     prompts = {
-        "pl": f"""
+        "pl": """
         Działaj jako ekspert ds. komunikacji i robienia notatek. Stwórz notatki z treści Transkrypcji w następującym formacie:
         1. **Najważniejsze ustalenia**
         2. **Zadania do wykonania**
         3. **Dodatkowe notatki**
-        
-        Treść Transkrypcji:
-        {transcription}
         """,
-        "en": f"""
+        "en": """
         Act as an expert in communication and note-taking. Create notes from the Transcription content in the following format:
         1. **Key Decisions**
         2. **Tasks to Complete**
         3. **Additional Notes**
-        
-        Transcription content:
-        {transcription}
         """,
-        "de": f"""
+        "de": """
         Agiere als Experte für Kommunikation und Notizenmachen. Erstelle Notizen aus dem Inhalt der Transkription im folgenden Format:
         1. **Wichtige Entscheidungen**
         2. **Zu erledigende Aufgaben**
         3. **Zusätzliche Notizen**
-        
-        Inhalt der Transkription:
-        {transcription}
         """,
-        "fr": f"""
+        "fr": """
         Agis en tant qu'expert en communication et en prise de notes. Crée des notes à partir du contenu de la Transcription au format suivant :
         1. **Décisions importantes**
         2. **Tâches à accomplir**
         3. **Notes supplémentaires**
-        
-        Contenu de la transcription :
-        {transcription}
         """,
-        "es": f"""
+        "es": """
         Actúa como un experto en comunicación y toma de notas. Crea notas del contenido de la Transcripción en el siguiente formato:
         1. **Decisiones Clave**
         2. **Tareas a Completar**
         3. **Notas Adicionales**
-        
-        Contenido de la transcripción:
-        {transcription}
         """
     }
 
     prompt = prompts.get(language, prompts["en"])
+    # Stały budżet - wszystkie języki dostają identycznie przycięty tekst (wspólny prefiks)
+    transcription, truncated = fit_transcript(transcription, PROMPT_TOKEN_BUDGET - PROMPT_TEMPLATE_RESERVE_TOKENS)
 
     try:
-        client = openai.OpenAI()
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7
-        )
-        return response.choices[0].message.content.strip()
+        return chat_completion(_notes_messages(transcription, prompt), f"notes:{language}",
+                               user_id=user_id, transcription_id=transcription_id, truncated=truncated)
     except Exception as e:
         return f"OpenAI API error: {e}"
 
-def analyze_with_custom_prompt(transcription, original_notes, custom_prompt, include_previous_notes=False):
+@db_path("analysis.custom")
+def analyze_with_custom_prompt(transcription, original_notes, custom_prompt, include_previous_notes=False, transcription_id=None, user_id=None):
     print("Analyzing with a custom prompt...")
+
+    # Dla długich transkrypcji wysyłamy tylko fragmenty istotne dla pytania
+    try:
+        context = relevant_context(transcription, custom_prompt, trans_id=transcription_id, user_id=user_id)
+    except Exception as e:
+        print(f"Retrieval error, sending full transcription: {e}")
+        context = transcription
+
+    budget = PROMPT_TOKEN_BUDGET - PROMPT_TEMPLATE_RESERVE_TOKENS - count_tokens(custom_prompt)
+    if include_previous_notes:
+        budget -= count_tokens(original_notes)
+    context, truncated = fit_transcript(context, budget)
     
     combined_prompt = f"""
     Perform the following task: "{custom_prompt}" based on the transcription. Write in language that the task is written in.
 
     **Transkrypcja:**
-    {transcription}
+    {context}
     """
 
     if include_previous_notes:
@@ -321,37 +598,96 @@ def analyze_with_custom_prompt(transcription, original_notes, custom_prompt, inc
     """
 
     try:
-        client = openai.OpenAI()
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": combined_prompt}],
-            temperature=0.7
-        )
-        return response.choices[0].message.content.strip()
+        return chat_completion([{"role": "user", "content": combined_prompt}], "custom_prompt",
+                               user_id=user_id, transcription_id=transcription_id, truncated=truncated)
     except Exception as e:
         return f"OpenAI API error: {e}"
 
-def save_transcription_and_notes(transcription, notes):
-    # Tworzymy folder dla plików tymczasowych aplikacji, jeśli nie istnieje
-    app_temp_dir = os.path.join(tempfile.gettempdir(), "transcription_app")
-    os.makedirs(app_temp_dir, exist_ok=True)
-    
-    filename = f"meeting_summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-    file_path = os.path.join(app_temp_dir, filename)
-    
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write("📌 **Transcription:**\n")
-        f.write(transcription + "\n\n")
-        f.write("📝 **Notes:**\n")
-        f.write(notes)
-    
-    return file_path
+NOTES_MAX_WORKERS = int(os.getenv("NOTES_MAX_WORKERS", 4))
+
+def generate_notes_bundle(transcription, languages, custom_prompts=(), transcription_id=None, user_id=None):
+    """Generuje równolegle notatki w kilku językach i odpowiedzi na dodatkowe polecenia dla jednej transkrypcji"""
+    # Wątki puli dostają kopię kontekstu, żeby zapytania do bazy trafiały pod ścieżkę wywołującego
+    with ThreadPoolExecutor(max_workers=NOTES_MAX_WORKERS) as executor:
+        notes = {
+            language: executor.submit(contextvars.copy_context().run, analyze_transcription, transcription, language,
+                                      user_id=user_id, transcription_id=transcription_id)
+            for language in languages
+        }
+        custom = [
+            (prompt, executor.submit(contextvars.copy_context().run, analyze_with_custom_prompt, transcription, None, prompt,
+                                     transcription_id=transcription_id, user_id=user_id))
+            for prompt in custom_prompts
+        ]
+        return {
+            "notes": {language: future.result() for language, future in notes.items()},
+            "custom": [{"prompt": prompt, "result": future.result()} for prompt, future in custom],
+        }
+
+def merge_notes_bundle(bundle, update):
+    """Dokłada nowe wyniki do pakietu notatek (nowsze notatki w danym języku zastępują starsze)"""
+    bundle = bundle or {"notes": {}, "custom": []}
+    return {
+        "notes": {**bundle["notes"], **update["notes"]},
+        "custom": bundle["custom"] + update["custom"],
+    }
+
+def add_to_notes_bundle(update):
+    """Dokłada wyniki do pakietu notatek bieżącej transkrypcji i zapisuje go w bazie"""
+    record = current_transcript()
+    bundle = merge_notes_bundle(record["notes_bundle"], update)
+    update_current_transcript(notes_bundle=bundle)
+    if st.session_state.transcription_id:
+        update_transcription_notes(
+            st.session_state.transcription_id, st.session_state.user_id, record["notes"], json.dumps(bundle)
+        )
+
+@db_path("analysis.bundle")
+def show_notes_bundle(extra_languages, extra_prompts):
+    bundle = current_transcript()["notes_bundle"]
+    if bundle:
+        for language, notes in bundle["notes"].items():
+            with st.expander(f"📝 Notes ({language})"):
+                st.markdown(notes)
+        for item in bundle["custom"]:
+            with st.expander(f"🔎 {item['prompt'][:80]}"):
+                st.markdown(item["result"])
+
+    # Pomijamy wyniki, które już są w pakiecie
+    if bundle:
+        extra_languages = [language for language in extra_languages if language not in bundle["notes"]]
+        extra_prompts = [prompt for prompt in extra_prompts if prompt not in {item["prompt"] for item in bundle["custom"]}]
+    if not (extra_languages or extra_prompts):
+        return
+    # Kolejne języki / polecenia dla gotowej transkrypcji - bez ponownej transkrypcji pliku
+    credits = (len(extra_languages) + len(extra_prompts)) * EXTRA_OUTPUT_CREDITS
+    if not st.button(f"Generate selected extra outputs ({credits} credit(s))"):
+        return
+    reservation_id = reserve_credit(st.session_state.user_id, amount=credits)
+    if reservation_id is None:
+        st.error(f"⚠️ These outputs cost {credits} credit(s). Please refill your credits with button on the left sidebar.")
+        return
+    st.session_state.credits -= credits
+    try:
+        with st.spinner("Generating extra outputs..."):
+            add_to_notes_bundle(generate_notes_bundle(
+                current_transcript()["transcription"], extra_languages, extra_prompts,
+                transcription_id=st.session_state.transcription_id, user_id=st.session_state.user_id
+            ))
+        commit_reservation(reservation_id)
+    except Exception as e:
+        release_reservation(reservation_id)
+        st.session_state.credits += credits
+        st.error(f"Error generating extra outputs: {str(e)}")
+        return
+    st.session_state.prepared_download = None
+    st.rerun()
 
 def generate_title_from_transcription(transcription, max_words=3):
     """Generuje tytuł z pierwszych słów transkrypcji i aktualnej daty"""
-    words = transcription.split()
-    title_words = words[:max_words]
-    title = " ".join(title_words)
+    # Dzielimy tylko początek tekstu - ostatni element to reszta transkrypcji (jeśli jest)
+    words = transcription.split(None, max_words)
+    title = " ".join(words[:max_words])
     if len(words) > max_words:
         title += "..."
     
@@ -359,6 +695,7 @@ def generate_title_from_transcription(transcription, max_words=3):
     current_date = datetime.now().strftime("%d.%m.%Y %H:%M")
     return f"{title} | {current_date}"
 
+@db_path("sidebar.history")
 def show_user_transcriptions():
 
     st.sidebar.divider()  # Dodajemy linię oddzielającą
@@ -366,12 +703,10 @@ def show_user_transcriptions():
     # Dodajemy przycisk "Rozpocznij od nowa" na górze sidebara
     if st.sidebar.button("Start New Transcription", key="reset_app"):
         # Resetujemy wszystkie potrzebne zmienne sesji
-        st.session_state.transcription = None
-        st.session_state.notes = None
-        st.session_state.custom_notes = None
-        st.session_state.custom_prompt = None
-        st.session_state.summary_file = None
+        set_current_transcript(None, None)
+        st.session_state.prepared_download = None
         st.session_state.processing_completed = False
+        release_session_job()
         # Resetujemy wartość inputa z linkiem
         if 'video_url' in st.session_state:
             del st.session_state.video_url
@@ -380,20 +715,465 @@ def show_user_transcriptions():
 
     st.sidebar.title("Your Transcriptions")
 
+    with st.sidebar.expander("Export / import history"):
+        show_history_transfer(st.session_state.user_id, "history")
+
+    search_query = st.sidebar.text_input("Search transcriptions", key="transcription_search")
+    if search_query.strip():
+        show_search_results(search_query)
+        return
+
     transcriptions = get_user_transcriptions(st.session_state.user_id)
     
     if transcriptions:
         for trans_id, title, created_at in transcriptions:
             button_label = title
             if st.sidebar.button(button_label, key=f"trans_{trans_id}"):
-                trans_data = get_transcription(trans_id, st.session_state.user_id)
-                if trans_data:
-                    st.session_state.transcription = trans_data[1]
-                    st.session_state.notes = trans_data[2]
-                    st.session_state.custom_notes = trans_data[3]
-                    st.session_state.custom_prompt = trans_data[4]
-                    st.session_state.processing_completed = True
-                    st.rerun()
+                load_transcription(trans_id)
+
+# Pełne teksty wczytanych transkrypcji trzymamy raz na proces, we wspólnym cache z limitem rozmiaru.
+# W sesji zostaje tylko identyfikator i krótki opis (tytuł, długość tekstu), więc pamięć
+# serwera nie rośnie z liczbą sesji razy długość transkrypcji.
+TRANSCRIPT_CACHE_MAX_CHARS = int(os.getenv("TRANSCRIPT_CACHE_MAX_CHARS", 20_000_000))
+TRANSCRIPT_PAGE_CHARS = 20000  # Długie transkrypcje wyświetlamy stronami
+TRANSCRIPT_FIELDS = ("transcription", "notes", "custom_notes", "custom_prompt", "notes_bundle")
+
+@st.cache_resource
+def _transcript_cache():
+    # (user_id, trans_id) -> (rekord, liczba znaków)
+    return OrderedDict(), threading.Lock()
+
+def _record_chars(record):
+    return sum(len(value) if isinstance(value, str) else len(json.dumps(value)) for value in record.values() if value)
+
+def _cache_transcript(user_id, trans_id, record):
+    cache, lock = _transcript_cache()
+    key = (user_id, trans_id)
+    with lock:
+        cache[key] = (record, _record_chars(record))
+        cache.move_to_end(key)
+        total = sum(chars for _, chars in cache.values())
+        while total > TRANSCRIPT_CACHE_MAX_CHARS and len(cache) > 1:
+            _, (_, chars) = cache.popitem(last=False)
+            total -= chars
+
+def transcript_record(trans_data):
+    """Rekord transkrypcji z wiersza get_transcription"""
+    record = dict(zip(TRANSCRIPT_FIELDS, trans_data[1:6]))
+    record["notes_bundle"] = json.loads(record["notes_bundle"]) if record["notes_bundle"] else None
+    return record
+
+def current_transcript():
+    """Pola bieżącej transkrypcji (tylko do odczytu) - z cache procesu, a gdy ich tam nie ma, z bazy"""
+    trans_id = st.session_state.get("transcription_id")
+    if not trans_id:
+        return st.session_state.get("unsaved_transcript") or dict.fromkeys(TRANSCRIPT_FIELDS)
+    cache, lock = _transcript_cache()
+    key = (st.session_state.user_id, trans_id)
+    with lock:
+        entry = cache.get(key)
+        if entry:
+            cache.move_to_end(key)
+            return entry[0]
+    trans_data = get_transcription(trans_id, st.session_state.user_id)
+    if not trans_data:
+        return dict.fromkeys(TRANSCRIPT_FIELDS)
+    record = transcript_record(trans_data)
+    _cache_transcript(st.session_state.user_id, trans_id, record)
+    return record
+
+def set_current_transcript(trans_id, record):
+    """Ustawia bieżącą transkrypcję. Wynik bez identyfikatora (nieudany zapis) zostaje w sesji."""
+    record = {**dict.fromkeys(TRANSCRIPT_FIELDS), **(record or {})}
+    st.session_state.transcription_id = trans_id
+    st.session_state.unsaved_transcript = None if trans_id else record
+    # Wynik pytania własnego z tej sesji (przed zapisem) należy do poprzedniej transkrypcji
+    st.session_state.custom_analysis_id = None
+    st.session_state.live_notes_pending = None
+    st.session_state.pop("transcript_page", None)
+    if trans_id:
+        _cache_transcript(st.session_state.user_id, trans_id, record)
+    # Tytuł liczymy raz, a nie przy każdym rerunie
+    text = record["transcription"]
+    st.session_state.transcript_meta = {"chars": len(text), "title": generate_title_from_transcription(text)} if text else None
+
+def update_current_transcript(**fields):
+    record = {**current_transcript(), **fields}
+    if st.session_state.transcription_id:
+        _cache_transcript(st.session_state.user_id, st.session_state.transcription_id, record)
+    else:
+        st.session_state.unsaved_transcript = record
+    if "transcription" in fields:
+        meta = st.session_state.transcript_meta or {"title": generate_title_from_transcription(record["transcription"])}
+        st.session_state.transcript_meta = {**meta, "chars": len(record["transcription"])}
+
+def set_custom_analysis(custom_prompt, custom_notes):
+    """Wynik pytania własnego trafia do cache transkrypcji - w sesji zostaje tylko klucz"""
+    analysis_id = f"custom:{uuid.uuid4().hex}"
+    _cache_transcript(st.session_state.user_id, analysis_id, {"custom_prompt": custom_prompt, "custom_notes": custom_notes})
+    st.session_state.custom_analysis_id = analysis_id
+
+def current_custom_analysis():
+    """(polecenie, wynik) pytania własnego: wynik z tej sesji albo zapisany z transkrypcją"""
+    analysis_id = st.session_state.get("custom_analysis_id")
+    if analysis_id:
+        cache, lock = _transcript_cache()
+        key = (st.session_state.user_id, analysis_id)
+        with lock:
+            entry = cache.get(key)
+            if entry:
+                cache.move_to_end(key)
+                return entry[0]["custom_prompt"], entry[0]["custom_notes"]
+    record = current_transcript()
+    return record["custom_prompt"], record["custom_notes"]
+
+def show_transcript():
+    """Transkrypcja w polu tekstowym; długie teksty stronami, żeby nie wysyłać całości przy każdym rerunie"""
+    meta = st.session_state.transcript_meta or {"chars": 0}
+    pages = max(1, math.ceil(meta["chars"] / TRANSCRIPT_PAGE_CHARS))
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"Transcription part (of {pages})", min_value=1, max_value=pages, value=1, key="transcript_page")
+    start = (page - 1) * TRANSCRIPT_PAGE_CHARS
+    st.text_area("Transcription", (current_transcript()["transcription"] or "")[start:start + TRANSCRIPT_PAGE_CHARS], height=300)
+
+@db_path("sidebar.open")
+def load_transcription(trans_id):
+    trans_data = get_transcription(trans_id, st.session_state.user_id)
+    if trans_data:
+        set_current_transcript(trans_data[0], transcript_record(trans_data))
+        st.session_state.prepared_download = None
+        st.session_state.processing_completed = True
+        st.rerun()
+
+def release_history_export():
+    prepared = st.session_state.get("history_export")
+    st.session_state.history_export = None
+    job = scratch_manager.get_job(prepared["job_id"]) if prepared else None
+    if job:
+        job.release()
+
+def prepare_history_export(user_id, fmt):
+    """Zapisuje całą historię do pliku w katalogu roboczym - w sesji zostaje tylko ścieżka"""
+    release_history_export()
+    try:
+        job = scratch_manager.create_job(timeout=0)
+    except ScratchQuotaExceeded:
+        st.error("The server is busy right now. Please try again in a few minutes.")
+        return
+    path = os.path.join(job.dir, f"history.{fmt}")
+    try:
+        with open(path, "wb") as f:
+            count = write_history(f, fmt, iter_user_transcriptions(user_id))
+    except Exception as e:
+        job.release()
+        st.error(f"Error exporting history: {e}")
+        return
+    st.session_state.history_export = {"job_id": job.id, "path": path, "user_id": user_id, "format": fmt, "count": count}
+
+@db_path("sidebar.history_transfer")
+def show_history_transfer(user_id, key):
+    """Eksport całej historii użytkownika do pliku i import z takiego pliku"""
+    fmt = st.selectbox("Format", list(HISTORY_FORMATS), format_func=lambda fmt: HISTORY_FORMATS[fmt][0], key=f"{key}_format")
+    if st.button("Prepare export", key=f"{key}_prepare"):
+        prepare_history_export(user_id, fmt)
+    prepared = st.session_state.get("history_export")
+    job = scratch_manager.get_job(prepared["job_id"]) if prepared else None
+    if job and prepared["user_id"] == user_id and prepared["format"] == fmt:
+        job.touch()
+        with open(prepared["path"], "rb") as f:
+            st.download_button(
+                f"📥 Download {prepared['count']} transcriptions",
+                data=f,
+                file_name=f"transcriptions_{user_id}_{datetime.now().strftime('%Y%m%d')}.{fmt}",
+                mime=HISTORY_FORMATS[fmt][1],
+                key=f"{key}_download"
+            )
+
+    uploaded = st.file_uploader("Import from an export file", type=HISTORY_IMPORT_TYPES, key=f"{key}_upload")
+    if uploaded and st.button("Import", key=f"{key}_import"):
+        reader = HistoryReader(uploaded, uploaded.name)
+        with st.spinner("Importing..."):
+            imported = import_transcriptions(user_id, reader)
+        if imported is False:
+            st.error(reader.error or "Import failed. Please try again.")
+        else:
+            st.success(f"Imported {imported} transcriptions.")
+
+SEARCH_PAGE_SIZE = 20
+
+@db_path("sidebar.search")
+def show_search_results(search_query):
+    # Nowe zapytanie zaczyna od pierwszej strony wyników
+    if st.session_state.get("search_query") != search_query:
+        st.session_state.search_query = search_query
+        st.session_state.search_page = 0
+    page = st.session_state.get("search_page", 0)
+
+    # Pobieramy jeden wynik więcej, aby wiedzieć czy istnieje następna strona
+    results = search_transcriptions(
+        st.session_state.user_id, search_query, limit=SEARCH_PAGE_SIZE + 1, offset=page * SEARCH_PAGE_SIZE
+    )
+    has_next = len(results) > SEARCH_PAGE_SIZE
+
+    if not results:
+        st.sidebar.info("No matching transcriptions.")
+    for trans_id, title, created_at, rank in results[:SEARCH_PAGE_SIZE]:
+        if st.sidebar.button(title, key=f"search_{trans_id}"):
+            load_transcription(trans_id)
+
+    col_prev, col_next = st.sidebar.columns(2)
+    if page > 0 and col_prev.button("← Previous", key="search_prev"):
+        st.session_state.search_page = page - 1
+        st.rerun()
+    if has_next and col_next.button("Next →", key="search_next"):
+        st.session_state.search_page = page + 1
+        st.rerun()
+
+# Formaty do pobrania: (etykieta, rozszerzenie pliku, czy wymaga segmentów z czasami)
+DOWNLOAD_FORMATS = {
+    **{fmt: (label, fmt, False) for fmt, (label, _) in EXPORT_FORMATS.items()},
+    **{f"segments_{fmt}": (f"Timestamps ({fmt.upper()})", fmt, True) for fmt in SEGMENT_EXPORTS},
+}
+
+def write_download(output, fmt):
+    """Zapisuje plik do pobrania z bieżącej transkrypcji do obiektu plikowego. Zwraca typ MIME albo None."""
+    label, extension, timestamped = DOWNLOAD_FORMATS[fmt]
+    if timestamped:
+        if not st.session_state.transcription_id:
+            return None
+        data = get_transcription_segments(st.session_state.transcription_id, st.session_state.user_id)
+        return write_segments(output, data, extension) if data else None
+    record = current_transcript()
+    custom_prompt, custom_notes = current_custom_analysis()
+    return write_export(
+        output,
+        extension,
+        record["transcription"],
+        record["notes"],
+        custom_notes,
+        custom_prompt,
+        record["notes_bundle"],
+    )
+
+def show_downloads():
+    # Plik generujemy dopiero przy wyświetlaniu przycisku, tylko w wybranym formacie - w sesji zostaje id i format.
+    # Streamlit i tak trzyma całą zawartość w swoim menedżerze plików, więc budujemy ją w pamięci.
+    formats = [fmt for fmt, (_, _, timestamped) in DOWNLOAD_FORMATS.items()
+               if not timestamped or st.session_state.transcription_id]
+    col_format, col_prepare = st.columns([1, 2])
+    with col_format:
+        download_format = st.selectbox("Download format", formats, format_func=lambda fmt: DOWNLOAD_FORMATS[fmt][0], key="download_format")
+    with col_prepare:
+        if st.button("Prepare download"):
+            st.session_state.prepared_download = (st.session_state.transcription_id, download_format)
+
+    if st.session_state.get("prepared_download") != (st.session_state.transcription_id, download_format):
+        return
+    output = io.BytesIO()
+    mime = write_download(output, download_format)
+    if not mime:
+        st.session_state.prepared_download = None
+        st.warning("No timestamps are stored for this transcription.")
+        return
+    name = f"transcription_{st.session_state.transcription_id}" if st.session_state.transcription_id else f"meeting_summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    st.download_button(
+        f"📥 Download {DOWNLOAD_FORMATS[download_format][0]}",
+        data=output.getvalue(),
+        file_name=f"{name}.{DOWNLOAD_FORMATS[download_format][1]}",
+        mime=mime
+    )
+
+def keep_session_job(job):
+    release_session_job()
+    st.session_state.scratch_job_id = job.id
+
+def release_session_job():
+    st.session_state.job_audio = None
+    job = scratch_manager.get_job(st.session_state.get("scratch_job_id"))
+    st.session_state.scratch_job_id = None
+    if job:
+        job.release()
+
+def keep_job_audio(audio_path, language, segments_data):
+    windows, seconds, credits = plan_retranscription(segments_data)
+    st.session_state.job_audio = {
+        "path": audio_path,
+        "language": language,
+        "transcription_id": st.session_state.transcription_id,
+        "windows": len(windows),
+        "seconds": seconds,
+        "credits": credits,
+    }
+
+@db_path("processing.retranscribe")
+def show_retranscription():
+    job_audio = st.session_state.get("job_audio")
+    if not job_audio or job_audio["transcription_id"] != st.session_state.transcription_id:
+        return
+    if not job_audio["windows"] or not os.path.exists(job_audio["path"]):
+        return
+    # Użytkownik wciąż korzysta z wyniku - janitor nie powinien usunąć katalogu zadania
+    job = scratch_manager.get_job(st.session_state.get("scratch_job_id"))
+    if job:
+        job.touch()
+
+    st.info(
+        f"{job_audio['windows']} low-confidence region(s) found "
+        f"({job_audio['seconds']:.0f} s of audio). Re-transcribing only these regions costs "
+        f"{job_audio['credits']} credit(s)."
+    )
+    if not st.button("Improve low-confidence regions"):
+        return
+
+    ticket = admit_job(st.empty())
+    if ticket is None:
+        return
+    with ticket:
+        reservation_id = reserve_credit(st.session_state.user_id, amount=job_audio["credits"])
+        if reservation_id is None:
+            st.error("⚠️ You don't have enough credits for this operation.")
+            return
+        st.session_state.credits -= job_audio["credits"]
+
+        try:
+            with st.spinner("Re-transcribing low-confidence regions..."):
+                segments_data = get_transcription_segments(st.session_state.transcription_id, st.session_state.user_id)
+                transcription, segments_data = retranscribe_low_confidence(
+                    job_audio["path"], segments_data, job_audio["language"]
+                )
+                update_transcription_text(st.session_state.transcription_id, st.session_state.user_id, transcription)
+                save_transcription_segments(st.session_state.transcription_id, segments_data)
+            # Poprawiona transkrypcja jest już zapisana - błąd indeksu nie zwraca kredytu
+            commit_reservation(reservation_id)
+        except Exception as e:
+            release_reservation(reservation_id)
+            st.session_state.credits += job_audio["credits"]
+            st.error(f"Error during re-transcription: {str(e)}")
+            return
+        try:
+            index_transcription(st.session_state.transcription_id, transcription)
+        except Exception as e:
+            print(f"Error indexing transcription: {e}")
+
+    update_current_transcript(transcription=transcription)
+    # Po poprawce nie proponujemy ponownie tych samych okien
+    job_audio.update(windows=0, seconds=0, credits=0)
+    st.rerun()
+
+LIVE_PREVIEW_CHARS = 4000  # Podgląd na żywo pokazuje końcówkę tekstu
+
+def finish_live_transcription(transcriber, reservation_id, user_id, notes_language):
+    """Zapisuje tekst sesji na żywo (także przerwanej przyciskiem Stop) i rozlicza kredyt. Bez wywołań st.* -
+    działa również w trakcie przerywania skryptu. Notatki (wywołanie LLM) generuje kolejny rerun,
+    żeby Stop nie czekał na odpowiedź modelu - patrz finish_live_notes."""
+    text = transcriber.text.strip()
+    if not text:
+        release_reservation(reservation_id)
+        st.session_state.credits += 1
+        return False
+    try:
+        trans_id = save_transcription(user_id, generate_title_from_transcription(text), text, None) or None
+        if trans_id and transcriber.segments:
+            save_transcription_segments(trans_id, SegmentTable.from_whisper(transcriber.segments).to_bytes())
+    except Exception as e:
+        # Przy przerwaniu skryptu komunikat pokaże dopiero kolejny rerun
+        print(f"Error saving live transcription: {e}")
+        release_reservation(reservation_id)
+        st.session_state.credits += 1
+        st.session_state.live_error = str(e)
+        return False
+    commit_reservation(reservation_id)
+    release_session_job()
+    set_current_transcript(trans_id, {"transcription": text})
+    st.session_state.live_notes_pending = notes_language
+    st.session_state.prepared_download = None
+    st.session_state.processing_completed = True
+    return True
+
+def finish_live_notes():
+    """Notatki i indeks dla transkrypcji zapisanej po sesji na żywo (kredyt rozliczony przy zapisie)"""
+    notes_language = st.session_state.get("live_notes_pending")
+    if not notes_language:
+        return
+    st.session_state.live_notes_pending = None
+    record = current_transcript()
+    trans_id = st.session_state.transcription_id
+    try:
+        with st.spinner("Generating notes..."):
+            notes = analyze_transcription(record["transcription"], notes_language, user_id=st.session_state.user_id)
+            update_current_transcript(notes=notes)
+            if trans_id:
+                update_transcription_notes(trans_id, st.session_state.user_id, notes)
+    except Exception as e:
+        st.error(f"Error generating notes: {str(e)}")
+    if trans_id:
+        try:
+            index_transcription(trans_id, record["transcription"])
+        except Exception as e:
+            print(f"Error indexing transcription: {e}")
+
+@db_path("processing.live")
+def run_live_transcription(url, transcription_language, output_language):
+    """Transkrypcja strumienia na żywo: tekst i notatki z kolejnych odcinków pojawiają się w trakcie"""
+    try:
+        source = resolve_stream_url(url)
+    except ValueError as e:
+        st.error(str(e))
+        return
+    ticket = admit_job(st.empty())
+    if ticket is None:
+        return
+    with ticket:
+        reservation_id = reserve_credit(st.session_state.user_id)
+        if reservation_id is None:
+            st.error("⚠️ You have no credits remaining. Please refill your credits with button on the left sidebar.")
+            return
+        st.session_state.credits -= 1
+        user_id = st.session_state.user_id
+        language = transcription_language if transcription_language != "auto" else None
+
+        def notes_language():
+            # "auto" - język wykryty w pierwszym oknie z mową
+            if output_language != "auto":
+                return output_language
+            return transcriber.language if transcriber.language in OUTPUT_LANGUAGES else "en"
+
+        transcriber = LiveTranscriber(
+            live_window_transcriber(language),
+            summarize_section=lambda text: analyze_transcription(text, notes_language(), user_id=user_id),
+            language=language,
+        )
+
+        # Kliknięcie Stop przerywa skrypt - zebrany tekst zapisujemy w finally
+        st.button("⏹ Stop and save", key="stop_live")
+        st.caption(f"Live sessions are limited to {STREAM_MAX_SECONDS / 60:.0f} minutes per credit.")
+        status = st.empty()
+        preview = st.empty()
+        sections = st.container()
+        saved = False
+        events = transcriber.run(open_stream(source))
+        try:
+            for event in events:
+                if event["type"] == "partial":
+                    skipped = f" · skipped {event['dropped_seconds']:.0f}s to keep up" if event["dropped_seconds"] else ""
+                    status.caption(f"⏺ {event['audio_seconds'] / 60:.1f} min transcribed · "
+                                   f"delay {event['lag_seconds']:.1f}s{skipped}")
+                    preview.markdown(event["text"][-LIVE_PREVIEW_CHARS:])
+                elif event["type"] == "section":
+                    with sections.expander(f"📝 Notes, part {event['index']}"):
+                        st.markdown(event["notes"])
+        except Exception as e:
+            st.error(f"Error during live transcription: {str(e)}")
+        finally:
+            events.close()  # Zatrzymuje ffmpeg także przy przerwaniu skryptu
+            saved = finish_live_transcription(transcriber, reservation_id, user_id, notes_language())
+    if saved:
+        st.rerun()
+    if st.session_state.get("live_error"):
+        st.error(f"Error saving live transcription: {st.session_state.pop('live_error')}")
+        return
+    st.error("No speech was transcribed. Please check that the stream is live and has audio.")
 
 def create_checkout_session(user_id, package="basic"):
     try:
@@ -458,27 +1238,96 @@ def create_checkout_session(user_id, package="basic"):
 
 def handle_successful_payment(session_id, user_id):
     try:
-        # Weryfikacja sesji płatności
-        session = stripe.checkout.Session.retrieve(session_id)
-        if session.payment_status == "paid" and session.client_reference_id == str(user_id):
-            # Pobierz liczbę kredytów z metadanych
-            credits_to_add = int(session.metadata.get('credits', 30))  # Domyślnie 30 jeśli nie znaleziono
-            
-            # Dodaj kredyty używając funkcji z database.py
-            if add_credits(user_id, credits_to_add):
-                # Aktualizuj dane użytkownika w sesji
-                user = verify_user(st.session_state.username, None)
-                if user:
-                    st.session_state.credits = user[2]
-                return True
-            else:
-                print(f"Database error: Failed to add credits")
-                return False
+        # Weryfikacja sesji płatności - każda sesja jest księgowana tylko raz
+        if confirm_payment(session_id, user_id):
+            # Aktualizuj dane użytkownika w sesji
+            st.session_state.credits = get_user_credits(user_id)
+            return True
         return False
     except Exception as e:
         st.error(f"Error processing payment: {str(e)}")
         return False
 
+@db_path("sidebar.admin")
+def show_admin_panel():
+    if st.session_state.username not in ADMIN_USERNAMES:
+        return
+    with st.sidebar.expander("Server metrics"):
+        st.caption("Scratch disk")
+        st.json(scratch_manager.stats())
+        st.caption("Processing slots")
+        st.json(admission_controller().stats())
+        if MODEL_SERVER_SOCKET:
+            st.caption("Model server")
+            try:
+                st.json(model_client().stats())
+            except ModelServerError as e:
+                st.warning(str(e))
+        show_profiling_controls()
+        show_query_stats()
+        st.caption("Top LLM token usage (30 days)")
+        st.table([
+            {"user": username, "calls": calls, "prompt tokens": prompt_tokens, "completion tokens": completion_tokens}
+            for username, calls, prompt_tokens, completion_tokens in get_top_token_users()
+        ])
+    with st.sidebar.expander("User history"):
+        username = st.text_input("Username", key="admin_history_user")
+        user_id = get_user_id(username.strip()) if username.strip() else None
+        if user_id:
+            show_history_transfer(user_id, "admin_history")
+        elif username.strip():
+            st.warning("User not found.")
+
+def show_profiling_controls():
+    st.caption("Profiling")
+    enabled = st.checkbox("Profile processing jobs", value=profiling_enabled(), key="profiling_enabled")
+    if enabled != profiling_enabled():
+        set_profiling_enabled(enabled)
+    if enabled and function_stats():
+        st.table(function_stats()[:15])
+
+    profiles = dict(list_profiles()[:20])
+    if not profiles:
+        return
+    job_id = st.selectbox(
+        "Job profile", list(profiles),
+        format_func=lambda job_id: f"{profiles[job_id]['started']} - "
+                                   + ", ".join(f"{name} {seconds:.1f}s" for name, seconds in profiles[job_id]["stages"].items()),
+        key="profile_job"
+    )
+    # Archiwum (ślady torch bywają duże) budujemy dopiero na żądanie
+    if st.button("Prepare profile download", key="prepare_profile"):
+        st.session_state.profile_download = (job_id, profile_archive(job_id))
+    prepared = st.session_state.get("profile_download")
+    if prepared and prepared[0] == job_id:
+        st.download_button("📥 Download profile", data=prepared[1], file_name=f"profile_{job_id}.zip",
+                           mime="application/zip", key="download_profile")
+
+def show_query_stats():
+    st.caption("Database time by path")
+    paths = path_stats()
+    if not paths:
+        return
+    st.table([
+        {"path": item["path"], "queries": item["queries"], "query ms": item["query_ms"],
+         "connections": item["connections"], "connect ms": item["connect_ms"], "share": f"{item['share']:.0%}"}
+        for item in paths
+    ])
+    st.caption("Slowest queries (total time)")
+    st.table([
+        {"query": item["query"][:80], "calls": item["calls"], "total ms": item["total_ms"],
+         "p50 ms": item["p50_ms"], "p95 ms": item["p95_ms"], "errors": item["errors"]}
+        for item in query_stats(limit=10)
+    ])
+    st.download_button("📥 Download query stats", data=export_stats(), file_name="db_query_stats.json",
+                       mime="application/json", key="download_query_stats")
+
+@contextmanager
+def job_stage(profile, name):
+    """Etap zadania: profil cProfile (gdy włączony) i ścieżka processing.<etap> w statystykach zapytań"""
+    with profile.stage(name), db_path(f"processing.{name}"):
+        yield
+
 def update_credits_display():
     if st.session_state.authenticated:
         st.sidebar.markdown(f"### Credits remaining: {st.session_state.credits}")
@@ -492,6 +1341,11 @@ def main():
     
 
     st.title("Audio/Video Transcription & Notes Generator & Information Extraction")
+
+    # Sprzątanie porzuconych katalogów zadań (wątek uruchamiany raz na proces)
+    scratch_manager.start_janitor()
+    # Opłacone sesje bez powrotu do aplikacji (zamknięta karta) księguje wątek uzgadniający
+    start_reconciler()
     
     # Inicjalizacja zmiennych sesyjnych
     if "authenticated" not in st.session_state:
@@ -504,22 +1358,22 @@ def main():
         st.session_state.credits = 0
     if "token" not in st.session_state:
         st.session_state.token = None
-    if "transcription" not in st.session_state:
-        st.session_state.transcription = None
-    if "notes" not in st.session_state:
-        st.session_state.notes = None
-    if "custom_notes" not in st.session_state:
-        st.session_state.custom_notes = None
-    if "custom_prompt" not in st.session_state:
-        st.session_state.custom_prompt = None
-    if "summary_file" not in st.session_state:
-        st.session_state.summary_file = None
+    if "transcription_id" not in st.session_state:
+        st.session_state.transcription_id = None
+    if "transcript_meta" not in st.session_state:
+        st.session_state.transcript_meta = None
+    if "unsaved_transcript" not in st.session_state:
+        st.session_state.unsaved_transcript = None
+    if "custom_analysis_id" not in st.session_state:
+        st.session_state.custom_analysis_id = None
     if "processing_completed" not in st.session_state:
         st.session_state.processing_completed = False
     if "credits_container" not in st.session_state:
         st.session_state.credits_container = None
     if "show_package_dialog" not in st.session_state:
         st.session_state.show_package_dialog = False
+    if "scratch_job_id" not in st.session_state:
+        st.session_state.scratch_job_id = None
 
     # Próba odzyskania tokena z query params
     if not st.session_state.authenticated:
@@ -531,7 +1385,8 @@ def main():
                 st.session_state.authenticated = True
                 st.session_state.user_id = user_data["user_id"]
                 st.session_state.username = user_data["username"]
-                st.session_state.credits = user_data["credits"]
+                # Nowa sesja - kredyty z cache tokena mogą być nieaktualne
+                st.session_state.credits = get_user_credits(user_data["user_id"])
                 st.query_params["token"] = st.session_state.token
             else:
                 for key in list(st.session_state.keys()):
@@ -543,10 +1398,10 @@ def main():
     if st.session_state.token:
         user_data = handle_verify_token(st.session_state.token)
         if user_data:
+            # Kredyty w sesji są aktualizowane przy każdej operacji, nie nadpisujemy ich przy rerunie
             st.session_state.authenticated = True
             st.session_state.user_id = user_data["user_id"]
             st.session_state.username = user_data["username"]
-            st.session_state.credits = user_data["credits"]
             st.query_params["token"] = st.session_state.token
         else:
             for key in list(st.session_state.keys()):
@@ -692,6 +1547,7 @@ def main():
                     st.rerun()
 
             if st.button("Sign Out"):
+                invalidate_token(st.session_state.token)
                 for key in list(st.session_state.keys()):
                     del st.session_state[key]
                 st.query_params.clear()
@@ -706,6 +1562,8 @@ def main():
             # Pokaż historię transkrypcji
             show_user_transcriptions()
 
+            show_admin_panel()
+
     # Główny interfejs aplikacji
     if not st.session_state.authenticated:
         st.warning("🔒 Please log in to use the application")
@@ -752,26 +1610,53 @@ def main():
     with col2:
         output_language = st.selectbox(
             "Select output language (notes)",
-            ["pl", "en", "de", "fr", "es"],
-            help="Language of the generated notes",
-            index=0  # Domyślnie wybieramy "en"
+            ["auto"] + OUTPUT_LANGUAGES,
+            help="Language of the generated notes. \"auto\" uses the language of the audio",
+            index=0  # Domyślnie notatki w języku nagrania
         )
 
+    identify_speakers = st.checkbox(
+        "Identify speakers",
+        help="Label who is speaking in the transcription and notes (works best for meetings and interviews)",
+        key="identify_speakers"
+    )
+
+    # Dodatkowe wyniki z tej samej transkrypcji - bez ponownego przetwarzania pliku, po EXTRA_OUTPUT_CREDITS za każdy
+    with st.expander("More outputs from the same transcription"):
+        extra_languages = st.multiselect("Also generate notes in", OUTPUT_LANGUAGES, key="extra_languages")
+        extra_prompts_text = st.text_area(f"Additional custom prompts (one per line, up to {MAX_EXTRA_PROMPTS})", key="extra_prompts")
+        st.caption(f"Each extra language or prompt costs {EXTRA_OUTPUT_CREDITS} credit.")
+    extra_prompts = [line.strip() for line in extra_prompts_text.splitlines() if line.strip()]
+    if len(extra_prompts) > MAX_EXTRA_PROMPTS:
+        st.warning(f"Only the first {MAX_EXTRA_PROMPTS} additional prompts will be used.")
+        extra_prompts = extra_prompts[:MAX_EXTRA_PROMPTS]
+
     # Modyfikujemy input z linkiem, aby używał session_state
     video_url = st.text_input("Paste YouTube or Instagram link", key="video_url")
     uploaded_file = st.file_uploader("Select an audio or video file", type=list(SUPPORTED_AUDIO) + list(SUPPORTED_VIDEO))
+    with st.expander("Live transcription (beta)"):
+        live_url = st.text_input("Live stream link (YouTube live, HLS, RTMP, Icecast)", key="live_url")
+        start_live = st.button("Start Live Transcription", disabled=not live_url.strip())
+
+    if st.session_state.get("live_error"):
+        # Zapis po kliknięciu Stop nie mógł pokazać błędu - skrypt był wtedy przerywany
+        st.error(f"Error saving live transcription: {st.session_state.pop('live_error')}")
 
     if st.session_state.processing_completed:
-        st.text_area("Transcription", st.session_state.transcription, height=300)
-        st.text_area("Notes", st.session_state.notes, height=300)
+        finish_live_notes()
+        show_transcript()
+        st.text_area("Notes", current_transcript()["notes"], height=300)
+        show_notes_bundle(extra_languages, extra_prompts)
         
-        # Automatycznie generuj tytuł z pierwszych słów transkrypcji i daty
-        default_title = generate_title_from_transcription(st.session_state.transcription)
+        # Tytuł z pierwszych słów transkrypcji i daty - wyliczony raz przy wczytaniu transkrypcji
+        default_title = (st.session_state.transcript_meta or {}).get("title", "")
         title = st.text_input("Transcription Title", value=default_title)
         
         if st.button("Save Transcription with New Title"):
             if title.strip():
-                if save_transcription(st.session_state.user_id, title, st.session_state.transcription, st.session_state.notes):
+                record = current_transcript()
+                if save_transcription(st.session_state.user_id, title, record["transcription"], record["notes"],
+                                      notes_bundle=record["notes_bundle"]):
                     st.success("Transcription has been saved!")
                     st.rerun()  # Odświeżamy stronę, aby zaktualizować historię
                 else:
@@ -779,14 +1664,10 @@ def main():
             else:
                 st.warning("Please enter a title for the transcription.")
         
-        if st.session_state.summary_file:
-            with open(st.session_state.summary_file, "rb") as file:
-                st.download_button(
-                    "📥 Download Transcription and Notes",
-                    data=file,
-                    file_name=os.path.basename(st.session_state.summary_file),
-                    mime="text/plain"
-                )
+        show_downloads()
+
+        if st.session_state.transcription_id:
+            show_retranscription()
 
         # Custom prompt section
         st.header("Extract Custom Information from Transcription")
@@ -800,8 +1681,9 @@ def main():
                 return
 
             if custom_prompt.strip():
-                # Używamy kredytu przed rozpoczęciem analizy
-                if not use_credit(st.session_state.user_id):
+                # Rezerwujemy kredyt przed rozpoczęciem analizy
+                reservation_id = reserve_credit(st.session_state.user_id)
+                if reservation_id is None:
                     st.error("⚠️ You have no credits remaining. Please contact support to get more credits.")
                     return
                 
@@ -816,19 +1698,25 @@ def main():
                     status_placeholder.text("Analyzing transcription with your instructions...")
                     progress.progress(85)
                     
-                    st.session_state.custom_prompt = custom_prompt  # Zapisujemy prompt w sesji
-                    st.session_state.custom_notes = analyze_with_custom_prompt(
-                        st.session_state.transcription,
-                        st.session_state.notes,
+                    st.session_state.prepared_download = None
+                    record = current_transcript()
+                    custom_notes = analyze_with_custom_prompt(
+                        record["transcription"],
+                        record["notes"],
                         custom_prompt,
-                        include_previous_notes=use_previous_notes
+                        include_previous_notes=use_previous_notes,
+                        transcription_id=st.session_state.transcription_id,
+                        user_id=st.session_state.user_id
                     )
+                    set_custom_analysis(custom_prompt, custom_notes)
 
                     progress.progress(100)
+                    commit_reservation(reservation_id)
                     status_placeholder.success("Analysis completed! ✅")
                     progress.empty()
                 except Exception as e:
                     # W przypadku błędu zwracamy kredyt
+                    release_reservation(reservation_id)
                     st.session_state.credits += 1
                     if st.session_state.credits_container:
                         st.session_state.credits_container.markdown(f"### Credits remaining: {st.session_state.credits}")
@@ -836,9 +1724,10 @@ def main():
             else:
                 st.error("Please enter your question or instruction!")
 
-        if st.session_state.custom_notes:
+        custom_prompt, custom_notes = current_custom_analysis()
+        if custom_notes:
             st.header("Extracted Information")
-            st.text_area("Analysis Results", st.session_state.custom_notes, height=300)
+            st.text_area("Analysis Results", custom_notes, height=300)
             
             # Sekcja zapisywania analizy
             st.subheader("Save Analysis")
@@ -852,13 +1741,14 @@ def main():
                 if not custom_title.strip():
                     st.error("Please enter a title for your analysis.")
                 else:
+                    record = current_transcript()
                     if save_transcription(
                         st.session_state.user_id,
                         custom_title,
-                        st.session_state.transcription,
-                        st.session_state.notes,
-                        st.session_state.custom_notes,
-                        st.session_state.custom_prompt
+                        record["transcription"],
+                        record["notes"],
+                        custom_notes,
+                        custom_prompt
                     ):
                         st.success("Custom analysis has been saved!")
                         st.rerun()  # Odświeżamy stronę, aby zaktualizować historię
@@ -867,6 +1757,10 @@ def main():
 
         return
 
+    if start_live:
+        run_live_transcription(live_url.strip(), transcription_language, output_language)
+        return
+
     if not video_url and not uploaded_file:
         return
 
@@ -877,12 +1771,34 @@ def main():
         temp_files = []  # Lista plików do wyczyszczenia
         progress = None
         status_placeholder = None
+
+        # Każde zadanie dostaje własny katalog roboczy; przy zapełnionym dysku czekamy na miejsce
+        try:
+            job = scratch_manager.create_job(on_wait=lambda: st.info("Server is busy, waiting for free disk space..."))
+        except ScratchQuotaExceeded:
+            st.error("The server is busy right now. Please try again in a few minutes.")
+            return
+        job_kept = False
+        ticket = None
+        # Przy włączonym profilowaniu etapy zadania są zapisywane do pobrania w panelu admina
+        profile = start_job_profile(job.id, st.session_state.user_id)
         
         try:
+            estimate = None
+            # Dodatkowe języki i polecenia są płatne razem z zadaniem (cena w szacunku)
+            extra_outputs = len([language for language in extra_languages if language != output_language]) + len(extra_prompts)
             if video_url:
+                # Długość z metadanych - zbyt długie nagrania odrzucamy jeszcze przed pobraniem
+                with job_stage(profile, "probe"):
+                    media_seconds = probe_url_duration(video_url)
+                if media_seconds is not None:
+                    estimate = estimate_media(media_seconds, transcription_language, extra_outputs)
+                    if not accept_estimate(estimate):
+                        return
                 st.info("Processing video...")
                 try:
-                    file_path = download_video(video_url)
+                    with job_stage(profile, "download"):
+                        file_path = download_video(video_url, output_dir=job.dir)
                     if not file_path or not os.path.exists(file_path):
                         st.error("Failed to download the video. Please check the URL and try again.")
                         return
@@ -892,8 +1808,8 @@ def main():
                     return
             elif uploaded_file:
                 try:
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(uploaded_file.name)[1]) as temp_file:
-                        temp_file.write(uploaded_file.read())
+                    with tempfile.NamedTemporaryFile(delete=False, dir=job.dir, suffix=os.path.splitext(uploaded_file.name)[1]) as temp_file:
+                        shutil.copyfileobj(uploaded_file, temp_file)
                         file_path = temp_file.name
                         temp_files.append(file_path)
                 except Exception as e:
@@ -907,46 +1823,127 @@ def main():
             if os.path.getsize(file_path) > MAX_FILE_SIZE_MB * 1024 * 1024:
                 st.error(f"The file is too large! The maximum size is {MAX_FILE_SIZE_MB} MB.")
                 return
+
+            # Długość z nagłówka pliku (bez dekodowania) - przed slotem i przed pobraniem kredytów
+            if estimate is None:
+                with job_stage(profile, "probe"):
+                    estimate = estimate_media(probe_duration(file_path), transcription_language, extra_outputs)
+                if not accept_estimate(estimate):
+                    return
+
+            # Ciężkie etapy (dekodowanie, whisper, analiza) startują dopiero po przydzieleniu slotu
+            ticket = admit_job(st.empty())
+            if ticket is None:
+                return
             
-            # Używamy kredytu przed rozpoczęciem przetwarzania
-            if not use_credit(st.session_state.user_id):
+            # Rezerwujemy kredyty przed rozpoczęciem przetwarzania
+            reservation_id = reserve_credit(st.session_state.user_id, amount=estimate["credits"])
+            if reservation_id is None:
                 st.error("⚠️ You have no credits remaining. Please contact support to get more credits.")
                 return
             
             # Aktualizujemy liczbę kredytów w sesji
-            st.session_state.credits -= 1
+            st.session_state.credits -= estimate["credits"]
             if st.session_state.credits_container:
                 st.session_state.credits_container.markdown(f"### Credits remaining: {st.session_state.credits}")
             
             progress = st.progress(0)
             status_placeholder = st.empty()
             
+            job_start = time.perf_counter()
             try:
-                status_placeholder.text("Converting file to WAV format...")
+                status_placeholder.text("Decoding audio...")
                 progress.progress(25)
-                audio_path = convert_to_wav(file_path)
+                with job_stage(profile, "convert"):
+                    audio_path = convert_to_pcm(file_path, output_dir=job.dir)
                 temp_files.append(audio_path)
+                media_seconds = pcm_duration(audio_path)
+                if estimate["media_seconds"] is None:
+                    # Nagłówek bez długości - limity sprawdzamy dopiero po dekodowaniu
+                    estimate = {**estimate_media(media_seconds, transcription_language), "credits": estimate["credits"]}
+                    if estimate["rejected"]:
+                        raise ValueError(estimate["rejected"])
+
+                # Język wykrywamy tanio z początku nagrania - pełny przebieg dostaje gotowy język
+                # i może trafić do modelu przypisanego temu językowi
+                if transcription_language == "auto":
+                    status_placeholder.text("Detecting language...")
+                    with job_stage(profile, "detect_language"):
+                        transcription_language = detect_audio_language(audio_path) or "auto"
+                if output_language == "auto":
+                    output_language = transcription_language if transcription_language in OUTPUT_LANGUAGES else "en"
                 
                 status_placeholder.text("Transcribing audio... it can take a few minutes. Processing a 20-minute video can take up to 10 minutes. Don't close this window")
                 progress.progress(50)
-                st.session_state.transcription = transcribe_audio(audio_path, transcription_language)
+                # Długie nagrania mogły zostać skierowane do szybszego modelu
+                model_name = estimate["model"] if estimate["routed"] else model_for_language(transcription_language)
+                transcribe_start = time.perf_counter()
+                with job_stage(profile, "transcribe"):
+                    # Diaryzacja liczy się w tle na tym samym pliku PCM, równolegle z whisperem
+                    diarization = diarize_async(audio_path) if identify_speakers else None
+                    transcription, segments_data = transcribe_audio(
+                        audio_path, transcription_language, return_segments=True, model_name=model_name
+                    )
+                transcribe_seconds = time.perf_counter() - transcribe_start
+                if diarization:
+                    status_placeholder.text("Identifying speakers...")
+                    with job_stage(profile, "diarize"):
+                        transcription, segments_data = add_speakers(transcription, segments_data, diarization)
                 
                 status_placeholder.text("Analyzing key conversation points...")
                 progress.progress(75)
-                st.session_state.notes = analyze_transcription(st.session_state.transcription, output_language)
+                # Notatki we wszystkich wybranych językach generujemy równolegle z jednej transkrypcji
+                languages = [output_language] + [language for language in extra_languages if language != output_language]
+                with job_stage(profile, "analyze"):
+                    bundle = generate_notes_bundle(transcription, languages, user_id=st.session_state.user_id)
+                notes = bundle["notes"].pop(output_language)
+                notes_bundle = bundle if bundle["notes"] else None
                 
                 status_placeholder.text("Saving transcription and notes...")
                 progress.progress(100)
 
-                # Nie dodajemy pliku podsumowania do temp_files
-                st.session_state.summary_file = save_transcription_and_notes(
-                    st.session_state.transcription, st.session_state.notes
-                )
-                
                 # Automatycznie zapisujemy transkrypcję z wygenerowanym tytułem
-                auto_title = generate_title_from_transcription(st.session_state.transcription)
-                save_transcription(st.session_state.user_id, auto_title, st.session_state.transcription, st.session_state.notes)
+                auto_title = generate_title_from_transcription(transcription)
+                with job_stage(profile, "save"):
+                    trans_id = save_transcription(
+                        st.session_state.user_id, auto_title, transcription, notes,
+                        notes_bundle=json.dumps(notes_bundle) if notes_bundle else None
+                    ) or None
+                    if trans_id and segments_data:
+                        save_transcription_segments(trans_id, segments_data)
+
+                    # Indeks fragmentów budujemy raz, przy zapisie - pytania własne wyszukują w nim fragmenty
+                    if trans_id:
+                        try:
+                            index_transcription(trans_id, transcription)
+                        except Exception as e:
+                            print(f"Error indexing transcription: {e}")
+                set_current_transcript(trans_id, {"transcription": transcription, "notes": notes, "notes_bundle": notes_bundle})
+
+                # Dodatkowe polecenia korzystają z zapisanego indeksu, więc uruchamiamy je po zapisie
+                if extra_prompts:
+                    status_placeholder.text("Running additional prompts...")
+                    add_to_notes_bundle(generate_notes_bundle(
+                        transcription, [], extra_prompts,
+                        transcription_id=trans_id, user_id=st.session_state.user_id
+                    ))
                 
+                # Katalog zadania (znormalizowane audio do poprawiania fragmentów o niskiej
+                # pewności) zostaje w sesji do rozpoczęcia nowego zadania. Pliki do pobrania
+                # generujemy na żądanie z sesji/bazy, więc bez segmentów nic nie trzymamy na dysku.
+                if st.session_state.transcription_id and segments_data:
+                    keep_session_job(job)
+                    job_kept = True
+                    temp_files.remove(audio_path)
+                    keep_job_audio(audio_path, transcription_language, segments_data)
+                else:
+                    release_session_job()
+
+                commit_reservation(reservation_id)
+                # Czasy zadania poprawiają kolejne szacunki dla tego modelu
+                record_job_stats(st.session_state.user_id, model_name, job_device(), media_seconds,
+                                 transcribe_seconds, time.perf_counter() - job_start)
+                st.session_state.prepared_download = None
                 st.session_state.processing_completed = True
                 status_placeholder.success("Task successfully completed! ✅")
                 
@@ -956,8 +1953,9 @@ def main():
                     status_placeholder.error(f"Error during processing: {str(e)}")
                 else:
                     st.error(f"Error during processing: {str(e)}")
-                # Zwracamy kredyt w przypadku błędu
-                st.session_state.credits += 1
+                # Zwracamy kredyty w przypadku błędu
+                release_reservation(reservation_id)
+                st.session_state.credits += estimate["credits"]
                 if st.session_state.credits_container:
                     st.session_state.credits_container.markdown(f"### Credits remaining: {st.session_state.credits}")
             finally:
@@ -972,6 +1970,12 @@ def main():
                 progress.empty()
         except Exception as e:
             st.error(f"Unexpected error: {str(e)}")
+        finally:
+            profile.finish()
+            if ticket:
+                ticket.release()
+            if not job_kept:
+                job.release()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,79 @@
+import os
+import re
+import subprocess
+import tempfile
+import numpy as np
+
+# Surowe PCM: mono, 16 kHz, float32 little-endian - dokładnie to, czego oczekuje whisper.
+# Plik jest mapowany w pamięć, więc kolejne etapy (i inne procesy) czytają te same
+# strony z page cache zamiast dekodować plik ponownie przez ffmpeg.
+PCM_SAMPLE_RATE = 16000
+PCM_DTYPE = np.float32
+PCM_SUFFIX = ".pcm"
+
+def convert_to_pcm(file_path, output_dir=None):
+    """Dekoduje plik audio/wideo jednym wywołaniem ffmpeg do surowego PCM float32 16 kHz mono"""
+    print(f"Converting file: {file_path}")
+    if not os.path.isfile(file_path):
+        raise FileNotFoundError(f"File {file_path} does not exist.")
+
+    with tempfile.NamedTemporaryFile(suffix=PCM_SUFFIX, dir=output_dir, delete=False) as temp_pcm:
+        output_path = temp_pcm.name
+
+    command = [
+        "ffmpeg", "-nostdin", "-v", "error", "-xerror", "-y",
+        "-i", file_path,
+        "-vn", "-ac", "1", "-ar", str(PCM_SAMPLE_RATE),
+        "-f", "f32le", output_path,
+    ]
+    try:
+        subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        if os.path.getsize(output_path) == 0:
+            raise ValueError("No audio stream found")
+        return output_path
+    except subprocess.CalledProcessError as e:
+        os.unlink(output_path)
+        raise ValueError(f"File {file_path} is corrupted or unsupported: {e.stderr.decode(errors='ignore').strip()}")
+    except Exception:
+        if os.path.exists(output_path):
+            os.unlink(output_path)
+        raise
+
+PROBE_TIMEOUT_SECONDS = 30
+_FFMPEG_DURATION = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+
+def probe_duration(file_path):
+    """Długość nagrania w sekundach z nagłówka kontenera (ffprobe, bez dekodowania). None gdy nieznana."""
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", file_path],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=PROBE_TIMEOUT_SECONDS, text=True,
+        )
+        return float(result.stdout.strip())
+    except ValueError:
+        return None  # "N/A" - kontener bez długości w nagłówku
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Error probing {file_path}: {e}")
+        return None
+    # Bez ffprobe: ffmpeg bez pliku wyjściowego wypisuje nagłówek (z długością) i kończy z błędem
+    try:
+        result = subprocess.run(["ffmpeg", "-nostdin", "-hide_banner", "-i", file_path], stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, timeout=PROBE_TIMEOUT_SECONDS, text=True, errors="ignore")
+        match = _FFMPEG_DURATION.search(result.stderr)
+        if not match:
+            return None
+        hours, minutes, seconds = match.groups()
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except Exception as e:
+        print(f"Error probing {file_path}: {e}")
+        return None
+
+def load_pcm(pcm_path):
+    """Mapuje plik PCM w pamięć jako tablicę float32 (kopiowanie przy zapisie, bez wczytywania całości)"""
+    return np.memmap(pcm_path, dtype=PCM_DTYPE, mode="c")
+
+def pcm_duration(pcm_path):
+    """Długość nagrania PCM w sekundach"""
+    return os.path.getsize(pcm_path) / np.dtype(PCM_DTYPE).itemsize / PCM_SAMPLE_RATE
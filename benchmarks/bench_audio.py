@@ -0,0 +1,94 @@
+"""Porównanie przekazywania audio między etapami: WAV + dekodowanie whispera vs PCM mapowane w pamięć.
+
+    python benchmarks/bench_audio.py --minutes 10
+
+Każdy wariant działa w osobnym procesie, aby szczytowe RSS było mierzone niezależnie:
+- wav:  ffmpeg -> plik WAV, potem ponowne dekodowanie przez ffmpeg do pamięci
+        (odpowiednik whisper.load_audio) i konwersja int16 -> float32
+- pcm:  jedno dekodowanie convert_to_pcm, potem load_pcm (np.memmap) i odczyt okna 30 s
+        oraz przejście po całej tablicy (jak przy liczeniu spektrogramu)
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_wav(source):
+    import numpy as np
+
+    start = time.perf_counter()
+    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_wav:
+        wav_path = temp_wav.name
+    subprocess.run(["ffmpeg", "-nostdin", "-v", "error", "-y", "-i", source, "-ac", "1", "-ar", "16000", wav_path], check=True)
+    convert = time.perf_counter() - start
+
+    start = time.perf_counter()
+    out = subprocess.run(["ffmpeg", "-nostdin", "-v", "error", "-i", wav_path, "-f", "s16le", "-ac", "1",
+                          "-ar", "16000", "-"], capture_output=True, check=True).stdout
+    audio = np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+    float(audio.sum())
+    decode = time.perf_counter() - start
+    os.unlink(wav_path)
+    return {"convert_s": convert, "decode_s": decode, "peak_rss_mb": peak_rss_mb()}
+
+
+def run_pcm(source):
+    from audio import convert_to_pcm, load_pcm, PCM_SAMPLE_RATE
+
+    start = time.perf_counter()
+    pcm_path = convert_to_pcm(source)
+    convert = time.perf_counter() - start
+
+    start = time.perf_counter()
+    audio = load_pcm(pcm_path)
+    float(audio[:30 * PCM_SAMPLE_RATE].sum())
+    float(audio.sum())
+    decode = time.perf_counter() - start
+    del audio
+    os.unlink(pcm_path)
+    return {"convert_s": convert, "decode_s": decode, "peak_rss_mb": peak_rss_mb()}
+
+
+def make_fixture(minutes, directory):
+    path = os.path.join(directory, f"tone_{minutes}m.mp3")
+    subprocess.run(["ffmpeg", "-nostdin", "-v", "error", "-y", "-f", "lavfi",
+                    "-i", f"sine=frequency=440:sample_rate=44100:duration={minutes * 60}",
+                    "-ac", "2", "-b:a", "128k", path], check=True)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Audio hand-off benchmark")
+    parser.add_argument("--minutes", type=int, default=10)
+    parser.add_argument("--mode", choices=["wav", "pcm"])
+    parser.add_argument("--source")
+    args = parser.parse_args()
+
+    if args.mode:
+        result = run_wav(args.source) if args.mode == "wav" else run_pcm(args.source)
+        print(json.dumps(result))
+        return
+
+    source = make_fixture(args.minutes, tempfile.mkdtemp(prefix="bench_audio_"))
+    for mode in ("wav", "pcm"):
+        out = subprocess.run([sys.executable, __file__, "--mode", mode, "--source", source],
+                             capture_output=True, text=True, check=True).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        print(f"{mode}: convert={result['convert_s']:.2f}s decode={result['decode_s']:.2f}s "
+              f"peak_rss={result['peak_rss_mb']:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
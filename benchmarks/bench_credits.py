@@ -0,0 +1,82 @@
+"""Współbieżny test obciążeniowy rezerwacji kredytów.
+
+Uruchamia wiele wątków rezerwujących kredyty tego samego użytkownika i sprawdza,
+że saldo nigdy nie spada poniżej zera, a liczba udanych rezerwacji równa się
+liczbie dostępnych kredytów.
+
+    python benchmarks/bench_credits.py --credits 50 --workers 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent credit reservation load test")
+    parser.add_argument("--credits", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=200)
+    args = parser.parse_args()
+
+    db_dir = tempfile.mkdtemp(prefix="bench_credits_")
+    os.environ["SQLITE_PATH"] = os.path.join(db_dir, "bench.db")
+    os.environ.pop("DATABASE_URL", None)
+
+    import database
+
+    database.init_db()
+    database.register_user("bench", "bench", "bench@example.com", True)
+    user_id = database.verify_user("bench", None)[0]
+    database.add_credits(user_id, args.credits - database.get_user_credits(user_id))
+
+    reservations = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(args.workers)
+
+    def worker():
+        barrier.wait()
+        reservation_id = database.reserve_credit(user_id)
+        if reservation_id is not None:
+            with lock:
+                reservations.append(reservation_id)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.workers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    remaining = database.get_user_credits(user_id)
+    print(f"workers={args.workers} reserved={len(reservations)} remaining={remaining} "
+          f"elapsed={elapsed:.3f}s ({args.workers / elapsed:.0f} req/s)")
+    assert len(set(reservations)) == len(reservations), "duplicate reservation ids"
+    assert len(reservations) == args.credits, "reservations do not match available credits"
+    assert remaining == 0, "credits overdrawn or lost"
+
+    # Połowa zadań kończy się sukcesem, połowa błędem - błędy oddają kredyty
+    half = len(reservations) // 2
+    for reservation_id in reservations[:half]:
+        assert database.commit_reservation(reservation_id)
+    for reservation_id in reservations[half:]:
+        assert database.release_reservation(reservation_id)
+        assert not database.release_reservation(reservation_id), "double release"
+    assert database.get_user_credits(user_id) == len(reservations) - half
+    assert database.get_user_premium_tokens(user_id) == half
+
+    # Rezerwacja po czasie jest zwalniana automatycznie
+    expired_id = database.reserve_credit(user_id, ttl_seconds=-1)
+    assert expired_id is not None
+    assert database.release_expired_reservations(user_id) == 1
+    assert not database.commit_reservation(expired_id)
+    assert database.get_user_credits(user_id) == len(reservations) - half
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
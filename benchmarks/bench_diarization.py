@@ -0,0 +1,152 @@
+"""Koszt diaryzacji na CPU względem transkrypcji - diaryzacja nie może wydłużać całego zadania.
+
+    python benchmarks/bench_diarization.py --minutes 1 10 60                 # syntetyczna rozmowa 3 mówców
+    python benchmarks/bench_diarization.py --minutes 10 --whisper-model tiny # + whisper osobno i równolegle
+    python benchmarks/bench_diarization.py --source spotkanie.mp3 --whisper-model base
+
+Syntetyczna rozmowa: mówcy o różnej częstotliwości podstawowej i formantach, tury 2-10 s
+przedzielone pauzami. Dla niej liczymy też zgodność etykiet z prawdą (ramki 10 ms, najlepsze
+dopasowanie numeracji mówców). Z --whisper-model mierzymy transkrypcję samą i razem z diaryzacją
+w wątku obok (tak jak w aplikacji) - narzut to różnica czasów ściennych.
+"""
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from audio import PCM_SAMPLE_RATE, convert_to_pcm, load_pcm  # noqa: E402
+from diarization import diarize, diarize_async  # noqa: E402
+
+# (f0 w Hz, formanty w Hz) dla kolejnych syntetycznych mówców
+VOICES = (
+    (110, (700, 1200, 2600)),
+    (190, (500, 1900, 2900)),
+    (240, (850, 1500, 3300)),
+    (140, (400, 900, 2300)),
+)
+
+
+def synthetic_conversation(minutes, speakers, seed=0):
+    """Zwraca (audio float32 16 kHz, tury prawdy [(start, end, mówca)])"""
+    rng = np.random.default_rng(seed)
+    total = int(minutes * 60 * PCM_SAMPLE_RATE)
+    audio = (rng.standard_normal(total) * 0.001).astype(np.float32)
+    turns = []
+    position = 0.5
+    previous = None
+    while True:
+        speaker = rng.choice([s for s in range(speakers) if s != previous] or [0])
+        length = rng.uniform(2, 10)
+        if position + length > minutes * 60:
+            break
+        f0, formants = VOICES[speaker]
+        t = np.arange(int(length * PCM_SAMPLE_RATE)) / PCM_SAMPLE_RATE
+        pitch = f0 * (1 + 0.05 * np.sin(2 * np.pi * 0.7 * t))  # Intonacja
+        phase = 2 * np.pi * np.cumsum(pitch) / PCM_SAMPLE_RATE
+        signal = np.zeros_like(t)
+        for harmonic in range(1, int(4000 / f0)):
+            frequency = harmonic * f0
+            gain = sum(np.exp(-((frequency - formant) / 150) ** 2) for formant in formants) + 0.05
+            signal += gain / harmonic ** 0.5 * np.sin(harmonic * phase)
+        signal *= 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t + rng.uniform(0, 6))  # Sylaby
+        start = int(position * PCM_SAMPLE_RATE)
+        audio[start:start + len(signal)] += (0.1 * signal / np.abs(signal).max()).astype(np.float32)
+        turns.append((position, position + length, int(speaker)))
+        previous = speaker
+        position += length + rng.uniform(0.3, 1.0)
+    return audio, turns
+
+
+def frame_labels(turns, seconds):
+    labels = np.full(int(seconds * 100), -1, dtype=int)
+    for start, end, speaker in turns:
+        labels[int(start * 100):int(end * 100)] = speaker
+    return labels
+
+
+def accuracy(predicted, truth, seconds):
+    """Udział ramek mowy (wg prawdy) z poprawnym mówcą przy najlepszej permutacji numeracji"""
+    truth_frames = frame_labels(truth, seconds)
+    predicted_frames = frame_labels(predicted, seconds)
+    speech = truth_frames >= 0
+    speakers = max(truth_frames.max(), predicted_frames.max()) + 1
+    confusion = np.zeros((speakers, speakers), dtype=int)
+    np.add.at(confusion, (truth_frames[speech], np.maximum(predicted_frames[speech], 0)), 1)
+    best = max(sum(confusion[i, p] for i, p in enumerate(permutation))
+               for permutation in itertools.permutations(range(speakers)))
+    return best / speech.sum()
+
+
+def transcribe(model, pcm_path):
+    import torch
+
+    start = time.perf_counter()
+    model.transcribe(load_pcm(pcm_path), fp16=torch.cuda.is_available())
+    return time.perf_counter() - start
+
+
+def run(pcm_path, seconds, truth, model):
+    start = time.perf_counter()
+    turns = diarize(pcm_path)
+    diarize_seconds = time.perf_counter() - start
+    line = (f"diarize={diarize_seconds:.2f}s rtf={diarize_seconds / seconds:.4f} "
+            f"speakers={len({speaker for _, _, speaker in turns})}")
+    if truth is not None:
+        line += f" expected={len({speaker for _, _, speaker in truth})} accuracy={accuracy(turns, truth, seconds):.1%}"
+    if model is not None:
+        alone = transcribe(model, pcm_path)
+        start = time.perf_counter()
+        future = diarize_async(pcm_path)
+        transcribe(model, pcm_path)
+        future.result()
+        together = time.perf_counter() - start
+        line += (f" | transcribe={alone:.2f}s with_diarization={together:.2f}s "
+                 f"overhead={(together / alone - 1) * 100:+.0f}%")
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU diarization cost benchmark")
+    parser.add_argument("--minutes", type=float, nargs="+", default=[1, 10])
+    parser.add_argument("--speakers", type=int, default=3, choices=range(1, len(VOICES) + 1))
+    parser.add_argument("--source", help="Real recording instead of the synthetic conversation (no accuracy)")
+    parser.add_argument("--whisper-model", help="Also measure whisper alone and in parallel with diarization")
+    args = parser.parse_args()
+
+    model = None
+    if args.whisper_model:
+        import torch
+        import whisper
+
+        model = whisper.load_model(args.whisper_model, device="cuda" if torch.cuda.is_available() else "cpu")
+
+    if args.source:
+        pcm_path = convert_to_pcm(args.source)
+        try:
+            seconds = os.path.getsize(pcm_path) / 4 / PCM_SAMPLE_RATE
+            print(f"{os.path.basename(args.source)} ({seconds / 60:.1f} min): ", end="")
+            run(pcm_path, seconds, None, model)
+        finally:
+            os.unlink(pcm_path)
+        return
+
+    for minutes in args.minutes:
+        audio, truth = synthetic_conversation(minutes, args.speakers)
+        with tempfile.NamedTemporaryFile(suffix=".pcm", delete=False) as f:
+            f.write(audio.tobytes())
+        try:
+            print(f"synthetic {minutes:g} min, {args.speakers} speakers: ", end="")
+            run(f.name, minutes * 60, truth, model)
+        finally:
+            os.unlink(f.name)
+
+
+if __name__ == "__main__":
+    main()
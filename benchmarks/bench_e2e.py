@@ -0,0 +1,234 @@
+"""Benchmark całego przetwarzania na syntetycznych nagraniach, z lokalnymi atrapami API i SQLite.
+
+    python benchmarks/bench_e2e.py                        # audio i wideo 1, 10 i 60 min, porównanie z baseline.json
+    python benchmarks/bench_e2e.py --minutes 1 10 --kinds audio
+    python benchmarks/bench_e2e.py --update-baseline      # zapisuje wyniki jako nowy baseline
+    python benchmarks/bench_e2e.py --speech-file mowa.wav # zapętla prawdziwą mowę zamiast sygnału syntetycznego
+
+Każde nagranie jest przetwarzane w osobnym procesie (niezależne szczytowe RSS) przez prawdziwe
+funkcje aplikacji: convert_to_pcm, detect_audio_language, transcribe_audio (model WHISPER_MODEL,
+domyślnie tiny), diarize, analyze_transcription, save_transcription + segmenty + indeks fragmentów
+i get_user_transcriptions. OpenAI i Stripe są zastąpione atrapami z stubs.py, baza to SQLite w katalogu tymczasowym.
+
+Dla każdego etapu zapisujemy czas, RSS po etapie i - dla etapów audio - real-time factor
+(czas etapu / długość nagrania). Wynik trafia do pliku JSON (--output); czasy są porównywane
+z baseline.json i skrypt kończy się kodem 1, gdy któryś etap jest wolniejszy o więcej niż --threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+DEFAULT_MINUTES = (1, 10, 60)
+# Sygnał "mowopodobny": trzy formanty modulowane w rytmie sylab (~4 Hz)
+SYNTHETIC_SPEECH = "(0.5+0.5*sin(2*PI*4*t))*(sin(2*PI*220*t)+0.5*sin(2*PI*880*t)+0.3*sin(2*PI*2400*t))*0.3"
+# Etapy o czasie poniżej progu pomijamy przy porównaniu - szum pomiaru przeważa nad sygnałem
+MIN_COMPARED_SECONDS = 0.05
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_fixture(kind, minutes, directory, speech_file=None):
+    """Tworzy (lub bierze z cache) nagranie audio (mp3) albo wideo (mp4) o zadanej długości"""
+    suffix = ".mp3" if kind == "audio" else ".mp4"
+    source_tag = "speech" if speech_file else "synthetic"
+    path = os.path.join(directory, f"{kind}_{minutes}m_{source_tag}{suffix}")
+    if os.path.exists(path):
+        return path
+
+    seconds = minutes * 60
+    if speech_file:
+        audio_input = ["-stream_loop", "-1", "-t", str(seconds), "-i", speech_file]
+    else:
+        audio_input = ["-f", "lavfi", "-i", f"aevalsrc='{SYNTHETIC_SPEECH}':s=16000:d={seconds}"]
+
+    command = ["ffmpeg", "-nostdin", "-v", "error", "-y"]
+    if kind == "video":
+        command += ["-f", "lavfi", "-i", f"testsrc2=size=320x240:rate=10:duration={seconds}"]
+        command += audio_input
+        command += ["-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac", "-shortest", path + ".part.mp4"]
+    else:
+        command += audio_input
+        command += ["-ac", "2", "-ar", "44100", "-b:a", "128k", "-f", "mp3", path + ".part.mp4"]
+    subprocess.run(command, check=True)
+    os.replace(path + ".part.mp4", path)
+    return path
+
+
+def run_fixture(source, minutes):
+    """Przetwarza jedno nagranie wszystkimi etapami w bieżącym procesie i zwraca metryki"""
+    from stubs import start_stubs
+
+    stubs = start_stubs()
+    work_dir = tempfile.mkdtemp(prefix="bench_e2e_")
+    os.environ["SQLITE_PATH"] = os.path.join(work_dir, "bench.db")
+    os.environ["SCRATCH_DIR"] = os.path.join(work_dir, "scratch")
+    os.environ.pop("DATABASE_URL", None)
+    os.environ.setdefault("WHISPER_MODEL", "tiny")
+
+    stages = {}
+    audio_seconds = minutes * 60
+
+    def stage(name, fn, realtime=False):
+        start = time.perf_counter()
+        result = fn()
+        seconds = time.perf_counter() - start
+        metrics = {"seconds": round(seconds, 4), "rss_mb": round(rss_mb(), 1)}
+        if realtime:
+            metrics["rtf"] = round(seconds / audio_seconds, 5)
+        stages[name] = metrics
+        return result
+
+    try:
+        app = stage("import_app", lambda: __import__("app"))
+        import database
+        from diarization import diarize
+
+        stage("load_model", lambda: app.load_whisper_model(app.WHISPER_MODEL))
+        database.register_user("bench", "bench", "bench@example.com", True)
+        user_id = database.verify_user("bench", None)[0]
+
+        pcm_path = stage("convert", lambda: app.convert_to_pcm(source, output_dir=work_dir), realtime=True)
+        language = stage("detect_language", lambda: app.detect_audio_language(pcm_path)) or "en"
+        transcription, segments_data = stage(
+            "transcribe", lambda: app.transcribe_audio(pcm_path, language, return_segments=True), realtime=True
+        )
+        stage("diarize", lambda: diarize(pcm_path), realtime=True)
+        notes = stage("analyze", lambda: app.analyze_transcription(transcription, "en", user_id=user_id))
+
+        def save():
+            trans_id = database.save_transcription(user_id, "bench", transcription, notes)
+            if segments_data:
+                database.save_transcription_segments(trans_id, segments_data)
+            app.index_transcription(trans_id, transcription)
+            return trans_id
+
+        stage("save", save)
+        stage("history", lambda: database.get_user_transcriptions(user_id))
+
+        return {
+            "audio_seconds": audio_seconds,
+            "transcript_words": len(transcription.split()),
+            "stages": stages,
+            "total_seconds": round(sum(metrics["seconds"] for name, metrics in stages.items()
+                                       if name not in ("import_app", "load_model")), 4),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "stub_calls": stubs.stats(),
+        }
+    finally:
+        stubs.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def compare(results, baseline, threshold):
+    """Zwraca listę regresji: etapy wolniejsze od baseline o więcej niż threshold (ułamek)"""
+    regressions = []
+    for fixture, result in results["fixtures"].items():
+        expected = baseline.get("fixtures", {}).get(fixture)
+        if not expected:
+            continue
+        for name, metrics in result["stages"].items():
+            before = expected["stages"].get(name, {}).get("seconds")
+            if before is None or before < MIN_COMPARED_SECONDS:
+                continue
+            if metrics["seconds"] > before * (1 + threshold):
+                regressions.append(f"{fixture}/{name}: {metrics['seconds']:.3f}s vs baseline {before:.3f}s "
+                                   f"(+{(metrics['seconds'] / before - 1) * 100:.0f}%)")
+        before_rss = expected.get("peak_rss_mb")
+        if before_rss and result["peak_rss_mb"] > before_rss * (1 + threshold):
+            regressions.append(f"{fixture}/peak_rss: {result['peak_rss_mb']:.0f} MB vs baseline {before_rss:.0f} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end processing benchmark")
+    parser.add_argument("--minutes", type=int, nargs="+", default=list(DEFAULT_MINUTES))
+    parser.add_argument("--kinds", nargs="+", choices=["audio", "video"], default=["audio", "video"])
+    parser.add_argument("--speech-file", help="Speech recording looped to the fixture length")
+    parser.add_argument("--fixtures-dir", default=os.path.join(tempfile.gettempdir(), "transcription_bench_fixtures"))
+    parser.add_argument("--output", default="bench_e2e_results.json")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown vs baseline (0.2 = 20%%)")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_fixture(args.run, args.minutes[0])))
+        return 0
+
+    os.makedirs(args.fixtures_dir, exist_ok=True)
+    results = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "whisper_model": os.getenv("WHISPER_MODEL", "tiny"),
+            "speech_file": bool(args.speech_file),
+        },
+        "fixtures": {},
+    }
+    for kind in args.kinds:
+        for minutes in args.minutes:
+            name = f"{kind}_{minutes}m"
+            source = make_fixture(kind, minutes, args.fixtures_dir, args.speech_file)
+            out = subprocess.run([sys.executable, __file__, "--run", source, "--minutes", str(minutes)],
+                                 capture_output=True, text=True)
+            if out.returncode != 0:
+                print(out.stderr, file=sys.stderr)
+                raise SystemExit(f"{name}: benchmark run failed")
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            results["fixtures"][name] = result
+            stages = " ".join(f"{stage}={metrics['seconds']:.2f}s" for stage, metrics in result["stages"].items())
+            print(f"{name}: {stages} rtf={result['stages']['transcribe']['rtf']:.3f} "
+                  f"peak_rss={result['peak_rss_mb']:.0f} MB")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline} - run with --update-baseline on the reference machine")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        return 1
+    print(f"No regressions above {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
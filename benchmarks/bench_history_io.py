@@ -0,0 +1,147 @@
+"""Przepustowość eksportu i importu całej historii użytkownika.
+
+    python benchmarks/bench_history_io.py --rows 100000
+    python benchmarks/bench_history_io.py --rows 100000 --memory          # + szczyt pamięci eksportu (tracemalloc)
+    DATABASE_URL=postgres://...neon.../db python benchmarks/bench_history_io.py --postgres --rows 100000
+
+Wypełnia historię jednego użytkownika przez import_transcriptions (partiami), eksportuje ją
+w obu formatach przez iter_user_transcriptions i importuje plik .jsonl.gz z powrotem innemu
+użytkownikowi. Raport: wiersze/s, MB/s danych tekstowych, rozmiar plików i - z --memory -
+szczyt pamięci eksportu, który nie powinien rosnąć z liczbą wierszy.
+
+Domyślnie tymczasowa baza SQLite. Z --postgres używany jest DATABASE_URL ze środowiska
+(adres musi spełniać warunek aplikacji, tj. zawierać "neon"); dane testowe są na końcu usuwane.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from segments import SegmentTable  # noqa: E402
+
+VOCABULARY = [
+    "spotkanie", "projekt", "budżet", "termin", "klient", "zadanie", "raport", "sprzedaż",
+    "meeting", "project", "budget", "deadline", "customer", "task", "report", "sales",
+]
+
+
+def records(rows, words, segments_share, seed=42):
+    """Syntetyczne rekordy w postaci, jaką import_transcriptions dostaje z HistoryReader"""
+    rng = random.Random(seed)
+    for i in range(rows):
+        text = " ".join(rng.choice(VOCABULARY) for _ in range(words))
+        segments = None
+        if rng.random() < segments_share:
+            sentences = [text[start:start + 80] for start in range(0, len(text), 80)]
+            segments = SegmentTable.from_whisper([
+                {"start": j * 5.0, "end": j * 5.0 + 4.5, "text": sentence} for j, sentence in enumerate(sentences)
+            ]).to_bytes()
+        yield {
+            "title": f"Title {i}",
+            "created_at": f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d} 12:00:00",
+            "transcription": text,
+            "notes": " ".join(rng.choice(VOCABULARY) for _ in range(words // 5)),
+            "custom_notes": None,
+            "custom_prompt": None,
+            "notes_bundle": None,
+            "segments": segments,
+        }
+
+
+def create_user(database, name):
+    database.register_user(name, "bench", f"{name}@example.com", True)
+    return database.get_user_id(name)
+
+
+def delete_user(database, user_id):
+    conn = database.get_db_connection()
+    c = conn.cursor()
+    placeholder = "%s" if database.DATABASE_URL and "neon" in database.DATABASE_URL else "?"
+    c.execute(f"DELETE FROM transcription_segments WHERE transcription_id IN "
+              f"(SELECT id FROM transcriptions WHERE user_id = {placeholder})", (user_id,))
+    c.execute(f"DELETE FROM transcriptions WHERE user_id = {placeholder}", (user_id,))
+    c.execute(f"DELETE FROM users WHERE id = {placeholder}", (user_id,))
+    conn.commit()
+    conn.close()
+
+
+def report(label, rows, seconds, text_bytes=None, extra=""):
+    line = f"{label:28} {rows} rows in {seconds:6.2f}s  {rows / seconds:9.0f} rows/s"
+    if text_bytes is not None:
+        line += f"  {text_bytes / seconds / 1e6:6.1f} MB/s"
+    print(line + extra)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="History export/import throughput benchmark")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--words", type=int, default=150)
+    parser.add_argument("--segments-share", type=float, default=0.5, help="Share of rows with a segments table")
+    parser.add_argument("--batch", type=int, help="Rows per batch (default: HISTORY_BATCH_ROWS)")
+    parser.add_argument("--postgres", action="store_true", help="Use DATABASE_URL instead of a temporary SQLite file")
+    parser.add_argument("--memory", action="store_true", help="Also measure export peak memory with tracemalloc")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_history_")
+    if not args.postgres:
+        os.environ["SQLITE_PATH"] = os.path.join(work_dir, "bench.db")
+        os.environ.pop("DATABASE_URL", None)
+
+    import database
+    from history_io import HISTORY_FORMATS, HistoryReader, write_history
+
+    batch = args.batch or database.HISTORY_BATCH_ROWS
+    database.init_db()
+    suffix = uuid.uuid4().hex[:8]
+    source_user = create_user(database, f"bench_history_{suffix}")
+    target_user = create_user(database, f"bench_history_{suffix}_copy")
+    try:
+        text_bytes = sum(len(r["transcription"].encode()) + len(r["notes"].encode())
+                         for r in records(min(args.rows, 1000), args.words, 0)) * args.rows / min(args.rows, 1000)
+
+        start = time.perf_counter()
+        imported = database.import_transcriptions(source_user, records(args.rows, args.words, args.segments_share), batch)
+        assert imported == args.rows, imported
+        report("import (fixture)", imported, time.perf_counter() - start, text_bytes)
+
+        paths = {}
+        for fmt in HISTORY_FORMATS:
+            paths[fmt] = os.path.join(work_dir, f"history.{fmt}")
+            start = time.perf_counter()
+            with open(paths[fmt], "wb") as f:
+                count = write_history(f, fmt, database.iter_user_transcriptions(source_user, batch))
+            assert count == args.rows, count
+            report(f"export {fmt}", count, time.perf_counter() - start, text_bytes,
+                   f"  file {os.path.getsize(paths[fmt]) / 1e6:.1f} MB")
+
+        if args.memory:
+            tracemalloc.start()
+            with open(os.devnull, "wb") as f:
+                write_history(f, "jsonl.gz", database.iter_user_transcriptions(source_user, batch))
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"export jsonl.gz peak memory: {peak / 1e6:.1f} MB")
+
+        for fmt in HISTORY_FORMATS:
+            start = time.perf_counter()
+            with open(paths[fmt], "rb") as f:
+                reader = HistoryReader(f, paths[fmt])
+                imported = database.import_transcriptions(target_user, reader, batch)
+            assert imported == args.rows, reader.error or imported
+            report(f"import {fmt}", imported, time.perf_counter() - start, text_bytes)
+    finally:
+        delete_user(database, source_user)
+        delete_user(database, target_user)
+        for name in os.listdir(work_dir):
+            os.unlink(os.path.join(work_dir, name))
+        os.rmdir(work_dir)
+
+
+if __name__ == "__main__":
+    main()
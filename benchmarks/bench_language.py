@@ -0,0 +1,78 @@
+"""Wykrywanie języka: wbudowane w pełny przebieg whispera vs osobny przebieg małym modelem na 30 s.
+
+    python benchmarks/bench_language.py --source nagranie.mp3 --model large --detect-model tiny
+
+Potrzebne jest prawdziwe nagranie z mową (ton syntetyczny nie ma języka). Mierzymy:
+- detect:  czas samego wykrycia języka modelem głównym i małym (jedno okno 30 s)
+- full:    transcribe(language=None) - whisper sam wykrywa język dużym modelem
+- routed:  wykrycie małym modelem + transcribe(language=...) modelem z WHISPER_LANGUAGE_MODELS
+           (lub --routed-model), tak jak w aplikacji
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def detect(model, audio, seconds=30):
+    import numpy as np
+    import whisper
+    from audio import PCM_SAMPLE_RATE
+
+    start = time.perf_counter()
+    window = whisper.pad_or_trim(np.array(audio[:seconds * PCM_SAMPLE_RATE]))
+    mel = whisper.log_mel_spectrogram(window, n_mels=model.dims.n_mels).to(model.device)
+    _, probabilities = model.detect_language(mel)
+    language = max(probabilities, key=probabilities.get)
+    return language, probabilities[language], time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Language detection fast-path benchmark")
+    parser.add_argument("--source", required=True, help="Audio/video file with speech")
+    parser.add_argument("--model", default="large")
+    parser.add_argument("--detect-model", default="tiny")
+    parser.add_argument("--routed-model", help="Model used after detection (default: --model)")
+    parser.add_argument("--skip-full", action="store_true", help="Only measure detection and the routed run")
+    args = parser.parse_args()
+
+    import torch
+    import whisper
+    from audio import convert_to_pcm, load_pcm
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    pcm_path = convert_to_pcm(args.source)
+    try:
+        audio = load_pcm(pcm_path)
+        main_model = whisper.load_model(args.model, device=device)
+        detect_model = whisper.load_model(args.detect_model, device=device)
+
+        language, probability, seconds = detect(main_model, audio)
+        print(f"detect[{args.model}]: {language} p={probability:.2f} {seconds:.2f}s")
+        language, probability, detect_seconds = detect(detect_model, audio)
+        print(f"detect[{args.detect_model}]: {language} p={probability:.2f} {detect_seconds:.2f}s")
+
+        fp16 = torch.cuda.is_available()
+        if not args.skip_full:
+            start = time.perf_counter()
+            result = main_model.transcribe(audio, language=None, fp16=fp16)
+            print(f"full[{args.model}, language=None]: {time.perf_counter() - start:.2f}s "
+                  f"(whisper detected {result.get('language')})")
+
+        routed_model = main_model
+        if args.routed_model and args.routed_model != args.model:
+            routed_model = whisper.load_model(args.routed_model, device=device)
+        start = time.perf_counter()
+        routed_model.transcribe(audio, language=language, fp16=fp16)
+        routed_seconds = time.perf_counter() - start
+        print(f"routed[{args.detect_model} -> {args.routed_model or args.model}, language={language}]: "
+              f"{detect_seconds + routed_seconds:.2f}s (detect {detect_seconds:.2f}s + transcribe {routed_seconds:.2f}s)")
+    finally:
+        os.unlink(pcm_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Benchmark przepustowości logowania dla wybranego kosztu bcrypt.
+
+    BCRYPT_ROUNDS=12 python benchmarks/bench_login.py --users 20 --logins 200 --threads 8
+
+Mierzy liczbę logowań na sekundę oraz koszt pierwszego logowania użytkownika
+ze starym hashem SHA-256 (weryfikacja + przehaszowanie).
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Login throughput benchmark")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    db_dir = tempfile.mkdtemp(prefix="bench_login_")
+    os.environ["SQLITE_PATH"] = os.path.join(db_dir, "bench.db")
+    os.environ.pop("DATABASE_URL", None)
+
+    import database
+
+    database.init_db()
+    for i in range(args.users):
+        database.register_user(f"user{i}", f"password{i}", f"user{i}@example.com", True)
+
+    def login(i):
+        user = database.verify_user(f"user{i % args.users}", f"password{i % args.users}")
+        assert user is not None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(login, range(args.logins)))
+    elapsed = time.perf_counter() - start
+    print(f"bcrypt rounds={database.BCRYPT_ROUNDS} threads={args.threads} "
+          f"logins={args.logins} elapsed={elapsed:.2f}s throughput={args.logins / elapsed:.1f} logins/s")
+
+    # Użytkownik ze starym hashem SHA-256 - pierwsze logowanie przehaszowuje hasło
+    database.register_user("legacy", "legacy", "legacy@example.com", True)
+    conn = database.get_db_connection()
+    conn.execute("UPDATE users SET password = ? WHERE username = ?",
+                 (hashlib.sha256(b"legacy").hexdigest(), "legacy"))
+    conn.commit()
+    conn.close()
+
+    start = time.perf_counter()
+    assert database.verify_user("legacy", "legacy") is not None
+    rehash = time.perf_counter() - start
+    start = time.perf_counter()
+    assert database.verify_user("legacy", "legacy") is not None
+    after = time.perf_counter() - start
+    assert database.verify_user("legacy", "wrong") is None
+    print(f"legacy login with rehash={rehash * 1000:.1f} ms, next login={after * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Serwer modeli pod obciążeniem wielu procesów aplikacji.
+
+    python benchmarks/bench_model_server.py --model tiny --clients 4 --jobs 2 --minutes 1
+    python benchmarks/bench_model_server.py --model base --clients 8 --detect 32 --workers 2
+
+Uruchamia model_server.py jako osobny proces, a następnie --clients procesów-klientów
+(tak jak osobne procesy Streamlit), z których każdy zleca --jobs transkrypcji nagrania
+i --detect wykrywań języka. Raport: czas ścienny, opóźnienia p50/p95 zleceń, największa
+obserwowana głębokość kolejki, średnia wielkość partii wykrywania języka oraz pamięć RSS
+serwera i klientów - klienci nie ładują wag, więc ich pamięć nie zależy od modelu.
+"""
+import argparse
+import multiprocessing
+import os
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_e2e import make_fixture  # noqa: E402
+from load_test import percentile  # noqa: E402
+from audio import PCM_SAMPLE_RATE, convert_to_pcm, load_pcm  # noqa: E402
+from model_server import ModelClient, ModelServerUnavailable  # noqa: E402
+
+
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def client_process(socket_path, authkey, model, pcm_path, jobs, detect, results):
+    client = ModelClient(socket_path, authkey)
+    window = load_pcm(pcm_path)[:30 * PCM_SAMPLE_RATE]
+    latencies = {"transcribe": [], "detect_language": []}
+
+    def timed(kind, call):
+        start = time.perf_counter()
+        call()
+        latencies[kind].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=timed, args=("detect_language", lambda: client.detect_language(model, window)))
+               for _ in range(detect)]
+    for thread in threads:
+        thread.start()
+    for _ in range(jobs):
+        timed("transcribe", lambda: client.transcribe(model, pcm_path))
+    for thread in threads:
+        thread.join()
+    results.put((latencies, rss_mb(os.getpid())))
+
+
+def wait_for_server(client, process, timeout=600):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Model server exited")
+        try:
+            return client.stats()
+        except ModelServerUnavailable:
+            time.sleep(0.5)
+    raise RuntimeError("Model server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared model server benchmark")
+    parser.add_argument("--model", default="tiny")
+    parser.add_argument("--clients", type=int, default=4, help="Client processes (app processes)")
+    parser.add_argument("--jobs", type=int, default=1, help="Transcriptions per client")
+    parser.add_argument("--detect", type=int, default=8, help="Concurrent language detections per client")
+    parser.add_argument("--workers", type=int, default=1, help="Model server workers")
+    parser.add_argument("--minutes", type=int, default=1)
+    parser.add_argument("--speech-file", help="Speech recording looped to the fixture length")
+    parser.add_argument("--fixtures-dir", default=os.path.join(tempfile.gettempdir(), "transcription_bench_fixtures"))
+    args = parser.parse_args()
+
+    os.makedirs(args.fixtures_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="bench_model_server_")
+    pcm_path = convert_to_pcm(make_fixture("audio", args.minutes, args.fixtures_dir, args.speech_file), output_dir=work_dir)
+    socket_path = os.path.join(work_dir, "models.sock")
+    authkey = secrets.token_hex(32)
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "model_server.py"), "--socket", socket_path,
+                               "--workers", str(args.workers), "--audio-root", work_dir, "--preload", args.model],
+                              env={**os.environ, "MODEL_SERVER_AUTHKEY": authkey})
+    client = ModelClient(socket_path, authkey.encode())
+    try:
+        wait_for_server(client, server)
+        results = multiprocessing.Queue()
+        clients = [multiprocessing.Process(target=client_process,
+                                           args=(socket_path, authkey.encode(), args.model, pcm_path, args.jobs, args.detect, results))
+                   for _ in range(args.clients)]
+        start = time.perf_counter()
+        for process in clients:
+            process.start()
+
+        max_depth = 0
+        collected = []
+        while len(collected) < len(clients):
+            max_depth = max(max_depth, client.stats()["queue_depth"])
+            while not results.empty():
+                collected.append(results.get())
+            time.sleep(0.2)
+        elapsed = time.perf_counter() - start
+        for process in clients:
+            process.join()
+
+        stats = client.stats()
+        print(f"{args.clients} clients x ({args.jobs} x {args.minutes} min transcription + {args.detect} detections), "
+              f"model {args.model}, {args.workers} worker(s): {elapsed:.1f}s")
+        for kind in ("transcribe", "detect_language"):
+            values = [value for latencies, _ in collected for value in latencies[kind]]
+            if values:
+                print(f"  {kind:16} n={len(values):4} p50={percentile(values, 50):7.2f}s p95={percentile(values, 95):7.2f}s")
+        batch = stats["batched_requests"] / stats["batches"] if stats["batches"] else 1
+        print(f"  max queue depth {max_depth}, avg detection batch {batch:.1f}, errors {stats['errors']}")
+        client_rss = [rss for _, rss in collected if rss]
+        print(f"  RSS: server {rss_mb(server.pid):.0f} MB, client max {max(client_rss):.0f} MB")
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
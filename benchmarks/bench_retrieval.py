@@ -0,0 +1,170 @@
+"""Sprawdzenie i benchmark wyszukiwania fragmentów transkrypcji (retrieval.py) bez API OpenAI.
+
+    python benchmarks/bench_retrieval.py
+    python benchmarks/bench_retrieval.py --words 200000 --repeats 200
+
+Zamiast openai_embedder używana jest deterministyczna atrapa embed_fn (worek słów haszowanych
+do wektora), więc fragment zawierający słowo z pytania musi wygrać z pozostałymi. Skrypt sprawdza
+chunk_transcript (pokrycie i zakładkę), zapis i odczyt indeksu float16 w tymczasowej bazie SQLite
+(index_transcription / load_index), top_k względem pełnego sortowania oraz relevant_context
+(krótka transkrypcja w całości, długa - fragmenty z szukanym słowem, indeks z bazy bez ponownego
+liczenia embeddingów). Na końcu podaje czasy budowy indeksu i zapytań top_k; błąd kończy się wyjątkiem.
+"""
+import argparse
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STUB_DIM = 256
+VOCABULARY = [
+    "spotkanie", "projekt", "budżet", "termin", "klient", "zadanie", "raport", "sprzedaż",
+    "meeting", "project", "budget", "deadline", "customer", "task", "report", "sales",
+]
+RARE_WORD = "kwantowy"
+
+
+class StubEmbedder:
+    """Deterministyczne embeddingi: suma wektorów bazowych słów (wektor słowa z hasha). Liczy wywołania."""
+
+    def __init__(self, dim=STUB_DIM):
+        self.dim = dim
+        self.calls = 0
+        self.texts = 0
+
+    def _word(self, word):
+        seed = int.from_bytes(hashlib.sha256(word.encode("utf-8")).digest()[:8], "little")
+        return np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+
+    def __call__(self, texts):
+        self.calls += 1
+        self.texts += len(texts)
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            counts = {}
+            for word in text.split():
+                counts[word] = counts.get(word, 0) + 1
+            for word, count in counts.items():
+                # Rzadkie słowa ważą więcej - jak w prawdziwych embeddingach dominują temat fragmentu
+                vectors[i] += self._word(word) * (1.0 if word in VOCABULARY else 50.0) * count
+        return vectors
+
+
+def make_transcript(words, rare_positions, seed=42):
+    rng = random.Random(seed)
+    tokens = [rng.choice(VOCABULARY) for _ in range(words)]
+    for position in rare_positions:
+        tokens[position] = RARE_WORD
+    return " ".join(tokens)
+
+
+def check_chunks(retrieval):
+    assert retrieval.chunk_transcript("") == []
+    assert retrieval.chunk_transcript("jedno słowo") == ["jedno słowo"]
+    words = [f"w{i}" for i in range(1000)]
+    chunks = retrieval.chunk_transcript(" ".join(words), chunk_words=200, overlap=40)
+    assert all(len(chunk.split()) <= 200 for chunk in chunks)
+    assert chunks[0].split() == words[:200] and chunks[1].split()[:40] == words[160:200], "overlap"
+    assert chunks[-1].split()[-1] == words[-1], "last word not covered"
+    covered = {word for chunk in chunks for word in chunk.split()}
+    assert covered == set(words)
+    print(f"chunk_transcript: {len(chunks)} chunks for {len(words)} words - ok")
+
+
+def check_top_k(retrieval, rng):
+    vectors = retrieval._normalize(rng.standard_normal((500, 64)).astype(np.float32)).astype(np.float16)
+    query = rng.standard_normal(64).astype(np.float32)
+    expected = np.argsort(-(vectors.astype(np.float32) @ (query / np.linalg.norm(query))))
+    assert list(retrieval.top_k(vectors, query, 10)) == list(expected[:10])
+    assert len(retrieval.top_k(vectors[:3], query, 10)) == 3
+    print("top_k: matches full sort, k larger than index - ok")
+
+
+def check_index_round_trip(retrieval, database, embed, user_id, transcript):
+    trans_id = database.save_transcription(user_id, "Retrieval", transcript, "notes")
+    vectors = retrieval.index_transcription(trans_id, transcript, embed)
+    assert vectors is not None and vectors.dtype == np.float16
+    loaded = retrieval.load_index(trans_id, user_id)
+    assert loaded is not None and np.array_equal(loaded, vectors), "blob round trip"
+    assert retrieval.load_index(trans_id, user_id + 1) is None, "index visible to another user"
+
+    original = retrieval.CHUNK_WORDS
+    retrieval.CHUNK_WORDS = original + 1
+    try:
+        assert retrieval.load_index(trans_id, user_id) is None, "index built with other parameters"
+    finally:
+        retrieval.CHUNK_WORDS = original
+    print(f"index round trip: {vectors.shape[0]} x {vectors.shape[1]} float16, {vectors.nbytes / 1024:.0f} KB - ok")
+    return trans_id
+
+
+def check_relevant_context(retrieval, embed, user_id, trans_id, transcript, rare_positions):
+    short = make_transcript(retrieval.RETRIEVAL_MIN_WORDS - 1, [])
+    assert retrieval.relevant_context(short, RARE_WORD, embed_fn=embed) == short
+
+    context = retrieval.relevant_context(transcript, RARE_WORD, embed_fn=embed, k=2)
+    assert context.count(RARE_WORD) == len(rare_positions), "chunks with the query word not selected"
+
+    texts_before = embed.texts
+    stored = retrieval.relevant_context(transcript, RARE_WORD, trans_id, user_id, embed_fn=embed, k=2)
+    assert embed.texts - texts_before == 1, "stored index was not reused"
+    assert stored == context
+    print("relevant_context: short text whole, query chunks selected, stored index reused - ok")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcript chunk retrieval check and benchmark")
+    parser.add_argument("--words", type=int, default=50000, help="Words in the long transcript")
+    parser.add_argument("--repeats", type=int, default=100, help="top_k queries to time")
+    args = parser.parse_args()
+
+    db_dir = tempfile.mkdtemp(prefix="bench_retrieval_")
+    os.environ["SQLITE_PATH"] = os.path.join(db_dir, "bench.db")
+    os.environ.pop("DATABASE_URL", None)
+
+    import database
+    import retrieval
+
+    database.init_db()
+    database.register_user("bench_retrieval", "bench", "bench_retrieval@example.com", True)
+    user_id = database.get_user_id("bench_retrieval")
+
+    words = max(args.words, retrieval.RETRIEVAL_MIN_WORDS)
+    # Rzadkie słowo w dwóch odległych miejscach - oba fragmenty powinny trafić do kontekstu
+    rare_positions = [words // 4, 3 * words // 4]
+    transcript = make_transcript(words, rare_positions)
+    embed = StubEmbedder()
+    rng = np.random.default_rng(0)
+
+    check_chunks(retrieval)
+    check_top_k(retrieval, rng)
+    trans_id = check_index_round_trip(retrieval, database, embed, user_id, transcript)
+    check_relevant_context(retrieval, embed, user_id, trans_id, transcript, rare_positions)
+
+    chunks = retrieval.chunk_transcript(transcript)
+    start = time.perf_counter()
+    vectors = retrieval.build_index(chunks, embed)
+    build_seconds = time.perf_counter() - start
+    queries = embed([rng.choice(VOCABULARY) for _ in range(args.repeats)])
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        retrieval.top_k(vectors, query)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    print(f"{words} words, {len(chunks)} chunks: build_index (stub) {build_seconds:.2f}s, "
+          f"top_k p50={timings[len(timings) // 2]:.3f} ms p95={timings[int(len(timings) * 0.95) - 1]:.3f} ms")
+
+    for name in os.listdir(db_dir):
+        os.unlink(os.path.join(db_dir, name))
+    os.rmdir(db_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Benchmark wyszukiwania pełnotekstowego w transkrypcjach (SQLite FTS5).
+
+    python benchmarks/bench_search.py --rows 100000 --users 200
+
+Wypełnia tymczasową bazę losowymi transkrypcjami i mierzy opóźnienia
+search_transcriptions() dla częstych i rzadkich słów. Cel: p95 < 50 ms.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+VOCABULARY = [
+    "spotkanie", "projekt", "budżet", "termin", "klient", "zadanie", "raport", "sprzedaż",
+    "meeting", "project", "budget", "deadline", "customer", "task", "report", "sales",
+    "marketing", "release", "roadmap", "hiring", "design", "review", "contract", "invoice",
+]
+
+
+def fill(database, rows, users, words):
+    rng = random.Random(42)
+    conn = database.get_db_connection()
+    batch = []
+    for i in range(rows):
+        text = " ".join(rng.choice(VOCABULARY) for _ in range(words))
+        if i % 1000 == 0:
+            text += " kwantowy"  # rzadkie słowo
+        notes = " ".join(rng.choice(VOCABULARY) for _ in range(words // 5))
+        batch.append((i % users + 1, f"Title {i}", text, notes))
+        if len(batch) == 5000:
+            conn.executemany("INSERT INTO transcriptions (user_id, title, transcription, notes) VALUES (?, ?, ?, ?)", batch)
+            batch = []
+    if batch:
+        conn.executemany("INSERT INTO transcriptions (user_id, title, transcription, notes) VALUES (?, ?, ?, ?)", batch)
+    conn.commit()
+    conn.close()
+
+
+def measure(database, user_ids, query, repeats):
+    timings = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        database.search_transcriptions(user_ids[i % len(user_ids)], query, limit=20)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-text search benchmark")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--words", type=int, default=150)
+    parser.add_argument("--repeats", type=int, default=100)
+    args = parser.parse_args()
+
+    db_dir = tempfile.mkdtemp(prefix="bench_search_")
+    os.environ["SQLITE_PATH"] = os.path.join(db_dir, "bench.db")
+    os.environ.pop("DATABASE_URL", None)
+
+    import database
+
+    database.init_db()
+    start = time.perf_counter()
+    fill(database, args.rows, args.users, args.words)
+    print(f"indexed {args.rows} rows in {time.perf_counter() - start:.1f}s")
+
+    user_ids = list(range(1, args.users + 1))
+    for query in ("budget", "project deadline", "kwantowy", "rev"):
+        p50, p95 = measure(database, user_ids, query, args.repeats)
+        print(f"query={query!r:22} p50={p50:6.2f} ms p95={p95:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Opóźnienie transkrypcji na żywo: nagranie jest dopisywane do pliku w tempie rzeczywistym (rosnący plik),
+a LiveTranscriber czyta je przez ffmpeg tak jak strumień z URL.
+
+    python benchmarks/bench_streaming.py --minutes 2 --whisper-model tiny
+    python benchmarks/bench_streaming.py --minutes 5 --fake-rtf 1.5      # transkrypcja wolniejsza niż strumień
+    python benchmarks/bench_streaming.py --speech-file mowa.wav --speed 4 --whisper-model base
+
+Bez --whisper-model okna "transkrybuje" atrapa śpiąca rtf * długość okna - pozwala sprawdzić,
+że opóźnienie pozostaje ograniczone (STREAM_MAX_LAG_SECONDS) także gdy model nie nadąża.
+Raport: opóźnienie tekstu względem odebrania audio (p50/p95/max), pominięte sekundy i liczba okien.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_e2e import make_fixture  # noqa: E402
+from load_test import percentile  # noqa: E402
+from streaming import LiveTranscriber, open_stream, STREAM_MAX_LAG_SECONDS, STREAM_WINDOW_SECONDS  # noqa: E402
+from audio import PCM_SAMPLE_RATE  # noqa: E402
+
+MP3_BYTES_PER_SECOND = 128000 // 8
+
+
+def grow_file(source, target, speed, stop):
+    """Dopisuje plik mp3 do target w tempie odtwarzania pomnożonym przez speed"""
+    chunk = int(MP3_BYTES_PER_SECOND * 0.25)
+    with open(source, "rb") as f, open(target, "ab") as out:
+        while not stop.is_set() and (data := f.read(chunk)):
+            out.write(data)
+            out.flush()
+            time.sleep(0.25 / speed)
+
+
+def fake_transcriber(rtf):
+    def transcribe_window(audio, prompt, language):
+        seconds = len(audio) / PCM_SAMPLE_RATE
+        time.sleep(seconds * rtf)
+        return [{"start": 0.0, "end": seconds, "text": f"window of {seconds:.1f}s"}], language or "en"
+    return transcribe_window
+
+
+def whisper_transcriber(model_name):
+    import torch
+    import whisper
+
+    model = whisper.load_model(model_name, device="cuda" if torch.cuda.is_available() else "cpu")
+
+    def transcribe_window(audio, prompt, language):
+        result = model.transcribe(audio, language=language, initial_prompt=prompt, condition_on_previous_text=False,
+                                  fp16=torch.cuda.is_available())
+        return result.get("segments", []), result.get("language")
+    return transcribe_window
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Live transcription lag benchmark")
+    parser.add_argument("--minutes", type=int, default=2)
+    parser.add_argument("--speech-file", help="Speech recording looped to the fixture length")
+    parser.add_argument("--speed", type=float, default=1.0, help="Stream speed relative to real time")
+    parser.add_argument("--whisper-model", help="Transcribe with this whisper model (default: fake transcriber)")
+    parser.add_argument("--fake-rtf", type=float, default=0.3, help="Fake transcriber real-time factor")
+    parser.add_argument("--window", type=float, default=STREAM_WINDOW_SECONDS)
+    parser.add_argument("--max-lag", type=float, default=STREAM_MAX_LAG_SECONDS)
+    parser.add_argument("--fixtures-dir", default=os.path.join(tempfile.gettempdir(), "transcription_bench_fixtures"))
+    args = parser.parse_args()
+
+    os.makedirs(args.fixtures_dir, exist_ok=True)
+    fixture = make_fixture("audio", args.minutes, args.fixtures_dir, args.speech_file)
+    transcribe_window = whisper_transcriber(args.whisper_model) if args.whisper_model else fake_transcriber(args.fake_rtf)
+
+    work_dir = tempfile.mkdtemp(prefix="bench_streaming_")
+    target = os.path.join(work_dir, "live.mp3")
+    open(target, "wb").close()
+    stop = threading.Event()
+    writer = threading.Thread(target=grow_file, args=(fixture, target, args.speed, stop), daemon=True)
+    writer.start()
+
+    transcriber = LiveTranscriber(transcribe_window, window_seconds=args.window, max_lag_seconds=args.max_lag)
+    start = time.perf_counter()
+    windows = 0
+    try:
+        # Po dopisaniu całego pliku strumień kończy się po STREAM_IDLE_TIMEOUT_SECONDS bez nowych danych
+        for event in transcriber.run(open_stream(target, idle_timeout=3)):
+            if event["type"] == "partial":
+                windows += 1
+                print(f"\r{event['audio_seconds']:7.1f}s audio  lag {event['lag_seconds']:5.2f}s  "
+                      f"dropped {event['dropped_seconds']:5.1f}s", end="", flush=True)
+    finally:
+        stop.set()
+        os.unlink(target)
+        os.rmdir(work_dir)
+    elapsed = time.perf_counter() - start
+
+    lags = transcriber.lags
+    print()
+    print(f"{args.minutes} min at {args.speed}x, window {args.window}s: {windows} windows in {elapsed:.1f}s, "
+          f"lag p50={percentile(lags, 50):.2f}s p95={percentile(lags, 95):.2f}s max={max(lags):.2f}s "
+          f"(bound {args.max_lag}s + one window), dropped {transcriber.dropped_seconds:.1f}s, "
+          f"{len(transcriber.segments)} segments")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""Test obciążeniowy: N wirtualnych użytkowników klika po aplikacji równolegle (Streamlit AppTest).
+
+    python benchmarks/load_test.py --users 20 --iterations 5
+    python benchmarks/load_test.py --users 5 --process-every 2 --minutes 1   # z przetwarzaniem nagrań
+
+Każdy wirtualny użytkownik ma własną sesję AppTest uruchamiającą app.py (tak jak serwer Streamlit,
+każda sesja wykonuje skrypt od nowa przy każdej interakcji, a cache_resource jest wspólny dla procesu):
+- login:    wpisanie loginu/hasła i "Sign In"
+- browse:   rerun strony (weryfikacja tokena, kredyty, historia) i otwarcie transkrypcji z historii
+- process:  link do nagrania serwowanego lokalnie przez stubs.py i "Start Processing"
+            (prawdziwe pobieranie yt-dlp, PCM i whisper z WHISPER_MODEL, domyślnie tiny)
+- extract:  pytanie własne do otwartej transkrypcji i "Extract Information"
+
+Wszystko działa bez sieci: OpenAI i Stripe to atrapy, baza to SQLite w katalogu tymczasowym.
+Raport: przepustowość (akcje/s), opóźnienia p50/p95/p99 na typ akcji, błędy oraz liczba połączeń
+z bazą (otwarte łącznie, na akcję, maksymalnie naraz, czas uzyskania połączenia) - liczone przez
+opakowanie database.get_db_connection.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+APP_PATH = os.path.join(ROOT, "app.py")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+PASSWORD = "load-test-password"
+EXTRACT_PROMPT = "List all people mentioned in the conversation."
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class ConnectionStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.closed = 0
+        self.open_now = 0
+        self.peak_open = 0
+        self.acquire_seconds = []
+
+    def acquired(self, seconds):
+        with self._lock:
+            self.opened += 1
+            self.open_now += 1
+            self.peak_open = max(self.peak_open, self.open_now)
+            self.acquire_seconds.append(seconds)
+
+    def released(self):
+        with self._lock:
+            self.closed += 1
+            self.open_now -= 1
+
+    def report(self, actions):
+        return {
+            "opened": self.opened,
+            "closed": self.closed,
+            "leaked": self.opened - self.closed,
+            "peak_concurrent": self.peak_open,
+            "per_action": round(self.opened / actions, 2) if actions else None,
+            "acquire_ms_p50": round(percentile(self.acquire_seconds, 50) * 1000, 3) if self.acquire_seconds else None,
+            "acquire_ms_p95": round(percentile(self.acquire_seconds, 95) * 1000, 3) if self.acquire_seconds else None,
+        }
+
+
+class _CountedConnection:
+    """Połączenie z bazą zgłaszające zamknięcie do statystyk; resztę deleguje do prawdziwego połączenia"""
+
+    def __init__(self, conn, stats):
+        self._conn = conn
+        self._stats = stats
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._stats.released()
+        self._conn.close()
+
+
+def instrument_connections(database, stats):
+    original = database.get_db_connection
+
+    def get_db_connection():
+        start = time.perf_counter()
+        conn = original()
+        stats.acquired(time.perf_counter() - start)
+        return _CountedConnection(conn, stats)
+
+    database.get_db_connection = get_db_connection
+
+
+def _by_label(elements, label):
+    for element in elements:
+        if element.label == label:
+            return element
+    raise LookupError(f"Widget {label!r} not found")
+
+
+class VirtualUser:
+    def __init__(self, index, args, media_url, record):
+        self.username = f"load{index}"
+        self.args = args
+        self.media_url = media_url
+        self.record = record
+        self.random = random.Random(index)
+
+    def _action(self, name, fn):
+        start = time.perf_counter()
+        error = None
+        try:
+            at = fn()
+            if at is not None and at.exception:
+                error = str(at.exception[0].message)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        self.record(name, time.perf_counter() - start, error)
+        time.sleep(self.random.uniform(0, self.args.think_time))
+
+    def run(self):
+        from streamlit.testing.v1 import AppTest
+
+        at = AppTest.from_file(APP_PATH, default_timeout=self.args.timeout)
+        self._action("open", lambda: at.run())
+
+        def login():
+            _by_label(at.text_input, "Username").input(self.username)
+            _by_label(at.text_input, "Password").input(PASSWORD)
+            return _by_label(at.button, "Sign In").click().run()
+
+        self._action("login", login)
+
+        for iteration in range(self.args.iterations):
+            self._action("browse", lambda: at.run())
+
+            def open_history():
+                history = [button for button in at.sidebar.button if (button.key or "").startswith("trans_")]
+                if not history:
+                    return at.run()
+                return self.random.choice(history).click().run()
+
+            self._action("open_history", open_history)
+
+            if self.args.process_every and iteration % self.args.process_every == 0:
+                def process():
+                    reset = [button for button in at.sidebar.button if button.key == "reset_app"]
+                    if reset:
+                        reset[0].click().run()
+                    at.text_input(key="video_url").input(self.media_url).run()
+                    return _by_label(at.button, "Start Processing").click().run()
+
+                self._action("process", process)
+
+            def extract():
+                if not [area for area in at.text_area if area.label.startswith("Enter your question")]:
+                    return at.run()
+                _by_label(at.text_area, "Enter your question or instruction for analysis").input(EXTRACT_PROMPT)
+                return _by_label(at.button, "Extract Information").click().run()
+
+            self._action("extract", extract)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent Streamlit session load test")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--process-every", type=int, default=0,
+                        help="Process a recording every N iterations (0 = never, processing is heavy)")
+    parser.add_argument("--minutes", type=int, default=1, help="Length of the processed fixture")
+    parser.add_argument("--history", type=int, default=50, help="Seeded transcriptions per user")
+    parser.add_argument("--credits", type=int, default=1000)
+    parser.add_argument("--think-time", type=float, default=0.5, help="Max random pause between actions (s)")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Simulated OpenAI latency (s)")
+    parser.add_argument("--timeout", type=float, default=900, help="Per-rerun timeout (s)")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    from stubs import start_stubs
+    from bench_e2e import make_fixture
+
+    work_dir = tempfile.mkdtemp(prefix="load_test_")
+    media_dir = os.path.join(work_dir, "media")
+    os.makedirs(media_dir)
+    stubs = start_stubs(latency=args.llm_latency, media_dir=media_dir)
+    os.environ["SQLITE_PATH"] = os.path.join(work_dir, "load.db")
+    os.environ["SCRATCH_DIR"] = os.path.join(work_dir, "scratch")
+    os.environ.pop("DATABASE_URL", None)
+    os.environ.setdefault("WHISPER_MODEL", "tiny")
+    os.environ.setdefault("ADMISSION_PER_USER_JOBS", "1")
+
+    import database
+
+    database.init_db()
+    for index in range(args.users):
+        database.register_user(f"load{index}", PASSWORD, f"load{index}@example.com", True)
+        user_id = database.verify_user(f"load{index}", None)[0]
+        database.add_credits(user_id, args.credits)
+        for n in range(args.history):
+            database.save_transcription(user_id, f"Seeded meeting {n}", f"seeded transcription {n} " * 200, f"notes {n}")
+
+    media_url = None
+    if args.process_every:
+        fixture = make_fixture("audio", args.minutes, media_dir)
+        media_url = stubs.media_url(os.path.basename(fixture))
+
+    stats = ConnectionStats()
+    instrument_connections(database, stats)
+
+    latencies = defaultdict(list)
+    errors = defaultdict(list)
+    lock = threading.Lock()
+
+    def record(name, seconds, error):
+        with lock:
+            latencies[name].append(seconds)
+            if error:
+                errors[name].append(error)
+
+    users = [VirtualUser(index, args, media_url, record) for index in range(args.users)]
+    threads = [threading.Thread(target=user.run, name=user.username) for user in users]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    actions = sum(len(values) for values in latencies.values())
+    report = {
+        "users": args.users,
+        "iterations": args.iterations,
+        "elapsed_s": round(elapsed, 2),
+        "actions": actions,
+        "throughput_per_s": round(actions / elapsed, 2),
+        "actions_by_type": {
+            name: {
+                "count": len(values),
+                "errors": len(errors[name]),
+                "p50_ms": round(percentile(values, 50) * 1000, 1),
+                "p95_ms": round(percentile(values, 95) * 1000, 1),
+                "p99_ms": round(percentile(values, 99) * 1000, 1),
+                "max_ms": round(max(values) * 1000, 1),
+            }
+            for name, values in latencies.items()
+        },
+        "db_connections": stats.report(actions),
+        "stub_calls": stubs.stats(),
+        "sample_errors": {name: values[:3] for name, values in errors.items() if values},
+    }
+    stubs.stop()
+
+    print(f"{args.users} users, {actions} actions in {elapsed:.1f}s -> {report['throughput_per_s']} actions/s")
+    for name, metrics in report["actions_by_type"].items():
+        print(f"  {name:13s} n={metrics['count']:4d} err={metrics['errors']:3d} p50={metrics['p50_ms']:8.1f}ms "
+              f"p95={metrics['p95_ms']:8.1f}ms p99={metrics['p99_ms']:8.1f}ms")
+    connections = report["db_connections"]
+    print(f"  db connections: {connections['opened']} opened ({connections['per_action']}/action), "
+          f"peak {connections['peak_concurrent']} concurrent, leaked {connections['leaked']}, "
+          f"acquire p95 {connections['acquire_ms_p95']} ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if any(errors.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""Lokalne atrapy API OpenAI i Stripe do benchmarków i testów obciążeniowych (bez sieci).
+
+    from stubs import start_stubs
+    stubs = start_stubs()   # ustawia OPENAI_BASE_URL, STRIPE_API_BASE i klucze testowe
+    ...
+    stubs.stats()           # liczba wywołań na endpoint
+    stubs.stop()
+
+Atrapy odpowiadają formatem zgodnym z oficjalnymi SDK:
+- POST /v1/chat/completions  - krótka odpowiedź z polem usage (opcjonalne opóźnienie --latency)
+- POST /v1/embeddings        - deterministyczne wektory z hasha tekstu (float lub base64)
+- POST /v1/checkout/sessions, GET /v1/checkout/sessions/<id> - sesje Stripe opłacone od razu
+- GET /media/<plik>          - pliki z media_dir, do "pobierania" nagrań z linku przez yt-dlp
+"""
+import base64
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import numpy as np
+
+EMBEDDING_DIM = 256
+
+
+def _embedding(text):
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    return np.random.default_rng(seed).standard_normal(EMBEDDING_DIM).astype(np.float32)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        self.server.calls[path] += 1
+        body = self._body()
+        if path.endswith("/chat/completions"):
+            request = json.loads(body)
+            time.sleep(self.server.latency)
+            prompt_chars = sum(len(message["content"]) for message in request["messages"])
+            content = "1. **Key Decisions**\n- stub\n2. **Tasks to Complete**\n- stub\n3. **Additional Notes**\n- stub"
+            self._reply({
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "gpt-4o-mini"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(content) // 4,
+                          "total_tokens": (prompt_chars + len(content)) // 4},
+            })
+        elif path.endswith("/embeddings"):
+            request = json.loads(body)
+            texts = request["input"] if isinstance(request["input"], list) else [request["input"]]
+            data = []
+            for i, text in enumerate(texts):
+                vector = _embedding(text)
+                if request.get("encoding_format") == "base64":
+                    embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+                else:
+                    embedding = vector.tolist()
+                data.append({"object": "embedding", "index": i, "embedding": embedding})
+            self._reply({"object": "list", "data": data, "model": request.get("model"),
+                         "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+        elif path.endswith("/checkout/sessions"):
+            form = parse_qs(body.decode("utf-8"))
+            session = {
+                "id": f"cs_test_{uuid.uuid4().hex}",
+                "object": "checkout.session",
+                "payment_status": "paid",
+                "url": "http://stub.invalid/checkout",
+                "metadata": {key[len("metadata["):-1]: values[0] for key, values in form.items() if key.startswith("metadata[")},
+            }
+            self.server.sessions[session["id"]] = session
+            self._reply(session)
+        else:
+            self._reply({"error": {"message": f"Unknown stub endpoint {path}"}}, status=404)
+
+    def _media(self, path, head=False):
+        name = os.path.basename(path)
+        file_path = os.path.join(self.server.media_dir or "", name)
+        if not self.server.media_dir or not os.path.isfile(file_path):
+            self._reply({"error": {"message": "No such media file"}}, status=404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", mimetypes.guess_type(name)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(os.path.getsize(file_path)))
+        self.end_headers()
+        if not head:
+            with open(file_path, "rb") as f:
+                while chunk := f.read(1024 * 1024):
+                    self.wfile.write(chunk)
+
+    def do_HEAD(self):
+        path = self.path.split("?")[0]
+        if path.startswith("/media/"):
+            self._media(path, head=True)
+        else:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path.startswith("/media/"):
+            self.server.calls["/media/<file>"] += 1
+            self._media(path)
+            return
+        self.server.calls[path.rsplit("/", 1)[0] + "/<id>"] += 1
+        session = self.server.sessions.get(path.rsplit("/", 1)[-1])
+        if "/checkout/sessions/" in path and session:
+            self._reply(session)
+        else:
+            self._reply({"error": {"message": "No such checkout session"}}, status=404)
+
+
+class Stubs:
+    def __init__(self, server, thread):
+        self.server = server
+        self.thread = thread
+        self.url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def media_url(self, name):
+        return f"{self.url}/media/{name}"
+
+    def stats(self):
+        return dict(self.server.calls)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def start_stubs(latency=0.0, set_env=True, media_dir=None):
+    """Uruchamia atrapy w wątku tła. Z set_env=True kieruje do nich SDK OpenAI i Stripe przez zmienne środowiskowe."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    server.daemon_threads = True
+    server.calls = Counter()
+    server.sessions = {}
+    server.latency = latency
+    server.media_dir = media_dir
+    thread = threading.Thread(target=server.serve_forever, daemon=True, name="api-stubs")
+    thread.start()
+    stubs = Stubs(server, thread)
+    if set_env:
+        os.environ["OPENAI_BASE_URL"] = f"{stubs.url}/v1"
+        os.environ["OPENAI_API_KEY"] = "sk-stub"
+        os.environ["STRIPE_API_BASE"] = stubs.url
+        os.environ["STRIPE_SECRET_KEY"] = "sk_test_stub"
+    return stubs
@@ -1,9 +1,16 @@
 import sqlite3
 import hashlib
+import hmac
 import os
-from datetime import datetime
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
+from passlib.context import CryptContext
 import urllib.parse
+from profiling import profiled
+from dbstats import instrument_connection
 
 try:
     import psycopg2
@@ -16,9 +23,39 @@ load_dotenv()
 
 # Wybór bazy danych w zależności od środowiska
 DATABASE_URL = os.getenv('DATABASE_URL')
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'users.db')
+
+# Czas po którym niezatwierdzona rezerwacja kredytu jest automatycznie zwalniana
+CREDIT_RESERVATION_TTL_SECONDS = int(os.getenv('CREDIT_RESERVATION_TTL_SECONDS', 2 * 60 * 60))
+
+# Koszt bcrypt (log2 liczby rund). Hasła z innym kosztem są przehaszowywane przy logowaniu.
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+# Haszowanie jest kosztowne dla CPU - wykonujemy je poza wątkiem skryptu Streamlit, w osobnej puli
+# wątków. Semafor ogranicza liczbę zleceń w puli do liczby jej wątków, więc przy fali logowań
+# kolejne czekają w swoich sesjach, a nie w nieograniczonej kolejce puli.
+KDF_WORKERS = int(os.getenv('KDF_WORKERS', os.cpu_count() or 2))
+_kdf_executor = ThreadPoolExecutor(max_workers=KDF_WORKERS, thread_name_prefix="kdf")
+_kdf_slots = threading.BoundedSemaphore(KDF_WORKERS)
+
+def _run_kdf(fn, *args):
+    with _kdf_slots:
+        return _kdf_executor.submit(fn, *args).result()
 
 def get_db_connection():
-    """Zwraca połączenie do bazy danych w zależności od środowiska"""
+    """Zwraca połączenie do bazy danych w zależności od środowiska (z pomiarem zapytań, patrz dbstats)"""
+    start = time.perf_counter()
+    conn = _connect()
+    return instrument_connection(conn, time.perf_counter() - start)
+
+def _connect():
     if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
         # Produkcja - Neon PostgreSQL
         try:
@@ -40,115 +77,42 @@ def get_db_connection():
             )
         except Exception as e:
             print(f"Error connecting to PostgreSQL: {e}")
-            return sqlite3.connect('users.db')
+            return sqlite3.connect(SQLITE_PATH)
     else:
         # Rozwój - SQLite
-        return sqlite3.connect('users.db')
+        return sqlite3.connect(SQLITE_PATH)
 
 def init_db():
     """Inicjalizuje bazę danych"""
-    conn = get_db_connection()
-    c = conn.cursor()
-    
-    if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
-        # PostgreSQL
-        try:
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    username VARCHAR(255) UNIQUE NOT NULL,
-                    password TEXT NOT NULL,
-                    email VARCHAR(255) UNIQUE NOT NULL,
-                    credits INTEGER DEFAULT 10,
-                    premium_tokens INTEGER DEFAULT 0,
-                    terms_accepted BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS transcriptions (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER REFERENCES users(id),
-                    title TEXT,
-                    transcription TEXT,
-                    notes TEXT,
-                    custom_notes TEXT,
-                    custom_prompt TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-        except Exception as e:
-            print(f"Error creating PostgreSQL tables: {e}")
-            # Fallback to SQLite
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    password TEXT NOT NULL,
-                    email TEXT UNIQUE NOT NULL,
-                    credits INTEGER DEFAULT 10,
-                    premium_tokens INTEGER DEFAULT 0,
-                    terms_accepted BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS transcriptions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    title TEXT NOT NULL,
-                    transcription TEXT NOT NULL,
-                    notes TEXT,
-                    custom_notes TEXT,
-                    custom_prompt TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-    else:
-        # SQLite
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                credits INTEGER DEFAULT 10,
-                premium_tokens INTEGER DEFAULT 0,
-                terms_accepted BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS transcriptions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                title TEXT NOT NULL,
-                transcription TEXT NOT NULL,
-                notes TEXT,
-                custom_notes TEXT,
-                custom_prompt TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-    
-    conn.commit()
-    conn.close()
+    migrate_database()
 
 def hash_password(password):
-    """Haszuje hasło używając SHA-256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Haszuje hasło używając bcrypt"""
+    return _run_kdf(pwd_context.hash, password)
+
+def _is_legacy_hash(stored_hash):
+    """Sprawdza czy hasło zapisano starym, niesolonym SHA-256"""
+    return len(stored_hash) == 64 and all(ch in '0123456789abcdef' for ch in stored_hash)
+
+def _check_password(password, stored_hash):
+    """Zwraca (czy hasło poprawne, nowy hash jeśli trzeba go zaktualizować)"""
+    if _is_legacy_hash(stored_hash):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        if not hmac.compare_digest(legacy, stored_hash):
+            return False, None
+        return True, pwd_context.hash(password)
+    return pwd_context.verify_and_update(password, stored_hash)
+
+def check_password(password, stored_hash):
+    """Weryfikuje hasło w puli KDF, poza wątkiem skryptu Streamlit. Zwraca (poprawne, nowy_hash lub None)."""
+    return _run_kdf(_check_password, password, stored_hash)
 
 def register_user(username, password, email, terms_accepted=False):
     """Rejestruje nowego użytkownika"""
+    hashed_password = hash_password(password)
     conn = get_db_connection()
     c = conn.cursor()
     try:
-        hashed_password = hash_password(password)
         if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
             c.execute('INSERT INTO users (username, password, email, terms_accepted) VALUES (%s, %s, %s, %s)',
                      (username, hashed_password, email, terms_accepted))
@@ -162,6 +126,21 @@ def register_user(username, password, email, terms_accepted=False):
     finally:
         conn.close()
 
+def _update_password_hash(user_id, new_hash):
+    """Zapisuje przehaszowane hasło użytkownika"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
+            c.execute('UPDATE users SET password = %s WHERE id = %s', (new_hash, user_id))
+        else:
+            c.execute('UPDATE users SET password = ? WHERE id = ?', (new_hash, user_id))
+        conn.commit()
+    except Exception as e:
+        print(f"Error updating password hash: {e}")
+    finally:
+        conn.close()
+
 def verify_user(username, password):
     """Weryfikuje dane logowania użytkownika"""
     conn = get_db_connection()
@@ -174,44 +153,184 @@ def verify_user(username, password):
                 c.execute('SELECT id, username, credits FROM users WHERE username = %s', (username,))
             else:
                 c.execute('SELECT id, username, credits FROM users WHERE username = ?', (username,))
+            user = c.fetchone()
+            return user if user else None
+
+        # Przypadek logowania - pobieramy hash, weryfikacja odbywa się po zamknięciu połączenia
+        if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
+            c.execute('SELECT id, username, credits, password FROM users WHERE username = %s', (username,))
         else:
-            # Przypadek logowania - sprawdzamy username i hasło
-            hashed_password = hash_password(password)
-            if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
-                c.execute('SELECT id, username, credits FROM users WHERE username = %s AND password = %s',
-                         (username, hashed_password))
-            else:
-                c.execute('SELECT id, username, credits FROM users WHERE username = ? AND password = ?',
-                         (username, hashed_password))
-        
-        user = c.fetchone()
-        return user if user else None
+            c.execute('SELECT id, username, credits, password FROM users WHERE username = ?', (username,))
+        row = c.fetchone()
     finally:
         conn.close()
 
-def save_transcription(user_id, title, transcription, notes, custom_notes=None, custom_prompt=None):
-    """Zapisuje transkrypcję dla użytkownika"""
+    if not row:
+        return None
+    valid, new_hash = check_password(password, row[3])
+    if not valid:
+        return None
+    if new_hash:
+        # Płynna migracja starych hashy SHA-256 i zmian kosztu bcrypt
+        _update_password_hash(row[0], new_hash)
+    return tuple(row[:3])
+
+def save_transcription(user_id, title, transcription, notes, custom_notes=None, custom_prompt=None, notes_bundle=None):
+    """Zapisuje transkrypcję dla użytkownika. Zwraca id zapisanej transkrypcji lub False."""
     conn = get_db_connection()
     c = conn.cursor()
     try:
         if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
             c.execute('''INSERT INTO transcriptions 
-                         (user_id, title, transcription, notes, custom_notes, custom_prompt)
-                         VALUES (%s, %s, %s, %s, %s, %s)''',
-                     (user_id, title, transcription, notes, custom_notes, custom_prompt))
+                         (user_id, title, transcription, notes, custom_notes, custom_prompt, notes_bundle)
+                         VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id''',
+                     (user_id, title, transcription, notes, custom_notes, custom_prompt, notes_bundle))
+            trans_id = c.fetchone()[0]
         else:
             c.execute('''INSERT INTO transcriptions 
-                         (user_id, title, transcription, notes, custom_notes, custom_prompt)
-                         VALUES (?, ?, ?, ?, ?, ?)''',
-                     (user_id, title, transcription, notes, custom_notes, custom_prompt))
+                         (user_id, title, transcription, notes, custom_notes, custom_prompt, notes_bundle)
+                         VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                     (user_id, title, transcription, notes, custom_notes, custom_prompt, notes_bundle))
+            trans_id = c.lastrowid
         conn.commit()
-        return True
+        return trans_id
     except Exception as e:
         print(f"Error saving transcription: {e}")
         return False
     finally:
         conn.close()
 
+def update_transcription_text(trans_id, user_id, transcription):
+    """Aktualizuje treść transkrypcji użytkownika (np. po poprawieniu fragmentów)"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
+            c.execute('UPDATE transcriptions SET transcription = %s WHERE id = %s AND user_id = %s',
+                      (transcription, trans_id, user_id))
+        else:
+            c.execute('UPDATE transcriptions SET transcription = ? WHERE id = ? AND user_id = ?',
+                      (transcription, trans_id, user_id))
+        conn.commit()
+        return c.rowcount == 1
+    except Exception as e:
+        print(f"Error updating transcription: {e}")
+        return False
+    finally:
+        conn.close()
+
+def update_transcription_notes(trans_id, user_id, notes, notes_bundle=None):
+    """Zapisuje notatki transkrypcji wraz z pakietem notatek w innych językach / z dodatkowych poleceń (JSON)"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
+            c.execute('UPDATE transcriptions SET notes = %s, notes_bundle = %s WHERE id = %s AND user_id = %s',
+                      (notes, notes_bundle, trans_id, user_id))
+        else:
+            c.execute('UPDATE transcriptions SET notes = ?, notes_bundle = ? WHERE id = ? AND user_id = ?',
+                      (notes, notes_bundle, trans_id, user_id))
+        conn.commit()
+        return c.rowcount == 1
+    except Exception as e:
+        print(f"Error updating notes: {e}")
+        return False
+    finally:
+        conn.close()
+
+def save_transcription_embeddings(trans_id, model, dim, chunk_words, chunk_overlap, vectors):
+    """Zapisuje indeks wektorowy fragmentów transkrypcji (macierz float16 jako blob)"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
+            c.execute('''INSERT INTO transcription_embeddings
+                         (transcription_id, model, dim, chunk_words, chunk_overlap, vectors)
+                         VALUES (%s, %s, %s, %s, %s, %s)
+                         ON CONFLICT (transcription_id) DO UPDATE SET
+                         model = EXCLUDED.model, dim = EXCLUDED.dim, chunk_words = EXCLUDED.chunk_words,
+                         chunk_overlap = EXCLUDED.chunk_overlap, vectors = EXCLUDED.vectors''',
+                     (trans_id, model, dim, chunk_words, chunk_overlap, psycopg2.Binary(vectors)))
+        else:
+            c.execute('''INSERT INTO transcription_embeddings
+                         (transcription_id, model, dim, chunk_words, chunk_overlap, vectors)
+                         VALUES (?, ?, ?, ?, ?, ?)
+                         ON CONFLICT (transcription_id) DO UPDATE SET
+                         model = excluded.model, dim = excluded.dim, chunk_words = excluded.chunk_words,
+                         chunk_overlap = excluded.chunk_overlap, vectors = excluded.vectors''',
+                     (trans_id, model, dim, chunk_words, chunk_overlap, vectors))
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"Error saving transcription embeddings: {e}")
+        return False
+    finally:
+        conn.close()
+
+def get_transcription_embeddings(trans_id, user_id):
+    """Pobiera indeks wektorowy transkrypcji użytkownika: (model, dim, chunk_words, chunk_overlap, vectors)"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
+            c.execute('''SELECT e.model, e.dim, e.chunk_words, e.chunk_overlap, e.vectors
+                         FROM transcription_embeddings e
+                         JOIN transcriptions t ON t.id = e.transcription_id
+                         WHERE e.transcription_id = %s AND t.user_id = %s''', (trans_id, user_id))
+        else:
+            c.execute('''SELECT e.model, e.dim, e.chunk_words, e.chunk_overlap, e.vectors
+                         FROM transcription_embeddings e
+                         JOIN transcriptions t ON t.id = e.transcription_id
+                         WHERE e.transcription_id = ? AND t.user_id = ?''', (trans_id, user_id))
+        return c.fetchone()
+    except Exception as e:
+        print(f"Error getting transcription embeddings: {e}")
+        return None
+    finally:
+        conn.close()
+
+def save_transcription_segments(trans_id, data):
+    """Zapisuje binarną tabelę segmentów (czasy, pewność, tekst) dla transkrypcji"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
+            c.execute('''INSERT INTO transcription_segments (transcription_id, data) VALUES (%s, %s)
+                         ON CONFLICT (transcription_id) DO UPDATE SET data = EXCLUDED.data''',
+                     (trans_id, psycopg2.Binary(data)))
+        else:
+            c.execute('''INSERT INTO transcription_segments (transcription_id, data) VALUES (?, ?)
+                         ON CONFLICT (transcription_id) DO UPDATE SET data = excluded.data''',
+                     (trans_id, data))
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"Error saving transcription segments: {e}")
+        return False
+    finally:
+        conn.close()
+
+def get_transcription_segments(trans_id, user_id):
+    """Pobiera binarną tabelę segmentów transkrypcji użytkownika (None jeśli brak)"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
+            c.execute('''SELECT s.data FROM transcription_segments s
+                         JOIN transcriptions t ON t.id = s.transcription_id
+                         WHERE s.transcription_id = %s AND t.user_id = %s''', (trans_id, user_id))
+        else:
+            c.execute('''SELECT s.data FROM transcription_segments s
+                         JOIN transcriptions t ON t.id = s.transcription_id
+                         WHERE s.transcription_id = ? AND t.user_id = ?''', (trans_id, user_id))
+        result = c.fetchone()
+        return bytes(result[0]) if result else None
+    except Exception as e:
+        print(f"Error getting transcription segments: {e}")
+        return None
+    finally:
+        conn.close()
+
 def get_user_transcriptions(user_id):
     """Pobiera wszystkie transkrypcje użytkownika"""
     conn = get_db_connection()
@@ -236,14 +355,61 @@ def get_user_transcriptions(user_id):
     finally:
         conn.close()
 
+def _fts_match_query(user_id, query):
+    """Zamienia zapytanie użytkownika na bezpieczne wyrażenie FTS5 (wszystkie słowa, prefiks dla ostatniego)"""
+    terms = ['"' + term.replace('"', '""') + '"' for term in query.split()]
+    if not terms:
+        return None
+    terms[-1] += '*'
+    return f'owner : "u{int(user_id)}" AND {{transcription notes custom_notes}} : ({" ".join(terms)})'
+
+def search_transcriptions(user_id, query, limit=20, offset=0):
+    """Wyszukuje pełnotekstowo w transkrypcjach i notatkach użytkownika, od najlepiej dopasowanych"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
+            if not query.strip():
+                return []
+            c.execute('''
+                SELECT id, title, created_at, ts_rank(search_vector, q) AS rank
+                FROM transcriptions, websearch_to_tsquery('simple', %s) q
+                WHERE user_id = %s AND search_vector @@ q
+                ORDER BY rank DESC, created_at DESC
+                LIMIT %s OFFSET %s
+            ''', (query, user_id, limit, offset))
+        else:
+            match = _fts_match_query(user_id, query)
+            if match is None:
+                return []
+            c.execute('''
+                SELECT t.id, t.title, t.created_at, bm25(transcriptions_fts, 0.0, 1.0, 2.0, 2.0) AS rank
+                FROM transcriptions_fts
+                JOIN transcriptions t ON t.id = transcriptions_fts.rowid
+                WHERE transcriptions_fts MATCH ?
+                ORDER BY rank, t.created_at DESC
+                LIMIT ? OFFSET ?
+            ''', (match, limit, offset))
+        return c.fetchall()
+    except Exception as e:
+        print(f"Error searching transcriptions: {e}")
+        return []
+    finally:
+        conn.close()
+
 def get_transcription(trans_id, user_id):
     """Pobiera konkretną transkrypcję użytkownika"""
     conn = get_db_connection()
     c = conn.cursor()
     try:
-        c.execute('''SELECT id, transcription, notes, custom_notes, custom_prompt 
-                     FROM transcriptions 
-                     WHERE id = %s AND user_id = %s''', (trans_id, user_id))
+        if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
+            c.execute('''SELECT id, transcription, notes, custom_notes, custom_prompt, notes_bundle 
+                         FROM transcriptions 
+                         WHERE id = %s AND user_id = %s''', (trans_id, user_id))
+        else:
+            c.execute('''SELECT id, transcription, notes, custom_notes, custom_prompt, notes_bundle 
+                         FROM transcriptions 
+                         WHERE id = ? AND user_id = ?''', (trans_id, user_id))
         result = c.fetchone()
         return result
     except Exception as e:
@@ -252,6 +418,123 @@ def get_transcription(trans_id, user_id):
     finally:
         conn.close()
 
+def get_user_id(username):
+    """Zwraca id użytkownika o podanej nazwie albo None"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
+            c.execute('SELECT id FROM users WHERE username = %s', (username,))
+        else:
+            c.execute('SELECT id FROM users WHERE username = ?', (username,))
+        result = c.fetchone()
+        return result[0] if result else None
+    except Exception as e:
+        print(f"Error getting user id: {e}")
+        return None
+    finally:
+        conn.close()
+
+# Eksport/import całej historii przetwarza wiersze partiami - pamięć nie zależy od liczby transkrypcji
+HISTORY_BATCH_ROWS = int(os.getenv('HISTORY_BATCH_ROWS', 500))
+
+HISTORY_COLUMNS = ('id', 'title', 'created_at', 'transcription', 'notes', 'custom_notes', 'custom_prompt',
+                   'notes_bundle', 'segments')
+
+def iter_user_transcriptions(user_id, batch_size=HISTORY_BATCH_ROWS):
+    """Generator wszystkich transkrypcji użytkownika (kolumny HISTORY_COLUMNS, segmenty jako bajty).
+    PostgreSQL czyta kursorem po stronie serwera (nazwanym), SQLite krokowo z otwartego zapytania."""
+    conn = get_db_connection()
+    try:
+        if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
+            c = conn.cursor(name=f'history_export_{user_id}')
+            c.execute('''SELECT t.id, t.title, t.created_at, t.transcription, t.notes, t.custom_notes,
+                                t.custom_prompt, t.notes_bundle, s.data
+                         FROM transcriptions t
+                         LEFT JOIN transcription_segments s ON s.transcription_id = t.id
+                         WHERE t.user_id = %s
+                         ORDER BY t.created_at, t.id''', (user_id,))
+        else:
+            c = conn.cursor()
+            c.execute('''SELECT t.id, t.title, t.created_at, t.transcription, t.notes, t.custom_notes,
+                                t.custom_prompt, t.notes_bundle, s.data
+                         FROM transcriptions t
+                         LEFT JOIN transcription_segments s ON s.transcription_id = t.id
+                         WHERE t.user_id = ?
+                         ORDER BY t.created_at, t.id''', (user_id,))
+        while rows := c.fetchmany(batch_size):
+            for row in rows:
+                yield (*row[:8], bytes(row[8]) if row[8] is not None else None)
+    except Exception as e:
+        print(f"Error exporting transcriptions: {e}")
+        raise
+    finally:
+        conn.close()
+
+def _next_transcription_ids(c, count, is_postgres):
+    """Rezerwuje count kolejnych id transkrypcji, żeby segmenty wstawić partią razem z wierszami"""
+    if is_postgres:
+        c.execute("SELECT nextval(pg_get_serial_sequence('transcriptions', 'id')) FROM generate_series(1, %s)", (count,))
+        return [row[0] for row in c.fetchall()]
+    # Wywoływane w transakcji BEGIN IMMEDIATE - nikt inny nie wstawia w międzyczasie.
+    # AUTOINCREMENT nie używa ponownie id usuniętych wierszy, więc bierzemy też licznik z sqlite_sequence.
+    c.execute('''SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'transcriptions'), 0),
+                            COALESCE((SELECT MAX(id) FROM transcriptions), 0))''')
+    first = c.fetchone()[0] + 1
+    return list(range(first, first + count))
+
+def _insert_history_batch(c, user_id, batch, is_postgres):
+    ids = _next_transcription_ids(c, len(batch), is_postgres)
+    rows = [(trans_id, user_id, record['title'], record['transcription'], record['notes'], record['custom_notes'],
+             record['custom_prompt'], record['notes_bundle'], record['created_at'])
+            for trans_id, record in zip(ids, batch)]
+    segments = [(trans_id, record['segments']) for trans_id, record in zip(ids, batch) if record['segments']]
+    if is_postgres:
+        # Jedno wielowierszowe INSERT na partię zamiast zapytania na wiersz
+        values = ','.join(['(%s, %s, %s, %s, %s, %s, %s, %s, COALESCE(%s::timestamp, CURRENT_TIMESTAMP))'] * len(rows))
+        c.execute(f'''INSERT INTO transcriptions
+                      (id, user_id, title, transcription, notes, custom_notes, custom_prompt, notes_bundle, created_at)
+                      VALUES {values}''', [value for row in rows for value in row])
+        if segments:
+            values = ','.join(['(%s, %s)'] * len(segments))
+            c.execute(f'INSERT INTO transcription_segments (transcription_id, data) VALUES {values}',
+                      [value for trans_id, data in segments for value in (trans_id, psycopg2.Binary(data))])
+    else:
+        c.executemany('''INSERT INTO transcriptions
+                         (id, user_id, title, transcription, notes, custom_notes, custom_prompt, notes_bundle, created_at)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))''', rows)
+        if segments:
+            c.executemany('INSERT INTO transcription_segments (transcription_id, data) VALUES (?, ?)', segments)
+
+def import_transcriptions(user_id, records, batch_size=HISTORY_BATCH_ROWS):
+    """Dodaje transkrypcje użytkownikowi partiami, w jednej transakcji (wszystkie albo żadna).
+    records: iterowalne słowniki z polami HISTORY_COLUMNS bez id. Zwraca liczbę dodanych lub False."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    is_postgres = bool(DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL)
+    try:
+        if not is_postgres:
+            c.execute('BEGIN IMMEDIATE')
+        imported = 0
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                _insert_history_batch(c, user_id, batch, is_postgres)
+                imported += len(batch)
+                batch = []
+        if batch:
+            _insert_history_batch(c, user_id, batch, is_postgres)
+            imported += len(batch)
+        conn.commit()
+        return imported
+    except Exception as e:
+        conn.rollback()
+        print(f"Error importing transcriptions: {e}")
+        return False
+    finally:
+        conn.close()
+
 def get_user_credits(user_id):
     """Pobiera liczbę dostępnych kredytów użytkownika"""
     conn = get_db_connection()
@@ -271,22 +554,144 @@ def use_credit(user_id):
     conn = get_db_connection()
     c = conn.cursor()
     try:
+        # Jedno warunkowe UPDATE - sprawdzenie i obciążenie są atomowe
         if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
-            c.execute('SELECT credits FROM users WHERE id = %s', (user_id,))
+            c.execute('''UPDATE users SET credits = credits - 1, premium_tokens = premium_tokens + 1
+                         WHERE id = %s AND credits > 0 RETURNING credits''', (user_id,))
         else:
-            c.execute('SELECT credits FROM users WHERE id = ?', (user_id,))
-        credits = c.fetchone()[0]
-        if credits > 0:
-            if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
-                c.execute('UPDATE users SET credits = credits - 1, premium_tokens = premium_tokens + 1 WHERE id = %s', (user_id,))
-            else:
-                c.execute('UPDATE users SET credits = credits - 1, premium_tokens = premium_tokens + 1 WHERE id = ?', (user_id,))
-            conn.commit()
-            return True
+            c.execute('''UPDATE users SET credits = credits - 1, premium_tokens = premium_tokens + 1
+                         WHERE id = ? AND credits > 0 RETURNING credits''', (user_id,))
+        result = c.fetchone()
+        conn.commit()
+        return result is not None
+    finally:
+        conn.close()
+
+def _reservation_timestamp(seconds_from_now=0):
+    return (datetime.utcnow() + timedelta(seconds=seconds_from_now)).strftime('%Y-%m-%d %H:%M:%S')
+
+def reserve_credit(user_id, amount=1, ttl_seconds=CREDIT_RESERVATION_TTL_SECONDS):
+    """Rezerwuje kredyty na czas zadania. Zwraca id rezerwacji lub None jeśli brakuje kredytów."""
+    release_expired_reservations(user_id)
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        expires_at = _reservation_timestamp(ttl_seconds)
+        if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
+            c.execute('UPDATE users SET credits = credits - %s WHERE id = %s AND credits >= %s RETURNING credits',
+                      (amount, user_id, amount))
+            if c.fetchone() is None:
+                conn.rollback()
+                return None
+            c.execute('''INSERT INTO credit_reservations (user_id, amount, status, expires_at)
+                         VALUES (%s, %s, 'reserved', %s) RETURNING id''', (user_id, amount, expires_at))
+        else:
+            c.execute('UPDATE users SET credits = credits - ? WHERE id = ? AND credits >= ? RETURNING credits',
+                      (amount, user_id, amount))
+            if c.fetchone() is None:
+                conn.rollback()
+                return None
+            c.execute('''INSERT INTO credit_reservations (user_id, amount, status, expires_at)
+                         VALUES (?, ?, 'reserved', ?) RETURNING id''', (user_id, amount, expires_at))
+        reservation_id = c.fetchone()[0]
+        conn.commit()
+        return reservation_id
+    except Exception as e:
+        conn.rollback()
+        print(f"Error reserving credit: {e}")
+        return None
+    finally:
+        conn.close()
+
+def commit_reservation(reservation_id):
+    """Zatwierdza rezerwację po udanym zadaniu i dodaje premium tokeny. Zwraca True jeśli rezerwacja była aktywna."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
+            c.execute('''UPDATE credit_reservations SET status = 'committed'
+                         WHERE id = %s AND status = 'reserved' RETURNING user_id, amount''', (reservation_id,))
+            result = c.fetchone()
+            if result:
+                c.execute('UPDATE users SET premium_tokens = premium_tokens + %s WHERE id = %s', (result[1], result[0]))
+        else:
+            c.execute('''UPDATE credit_reservations SET status = 'committed'
+                         WHERE id = ? AND status = 'reserved' RETURNING user_id, amount''', (reservation_id,))
+            result = c.fetchone()
+            if result:
+                c.execute('UPDATE users SET premium_tokens = premium_tokens + ? WHERE id = ?', (result[1], result[0]))
+        conn.commit()
+        return result is not None
+    except Exception as e:
+        conn.rollback()
+        print(f"Error committing credit reservation: {e}")
+        return False
+    finally:
+        conn.close()
+
+def release_reservation(reservation_id):
+    """Zwalnia rezerwację po nieudanym zadaniu i oddaje kredyty. Zwraca True jeśli rezerwacja była aktywna."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
+            c.execute('''UPDATE credit_reservations SET status = 'released'
+                         WHERE id = %s AND status = 'reserved' RETURNING user_id, amount''', (reservation_id,))
+            result = c.fetchone()
+            if result:
+                c.execute('UPDATE users SET credits = credits + %s WHERE id = %s', (result[1], result[0]))
+        else:
+            c.execute('''UPDATE credit_reservations SET status = 'released'
+                         WHERE id = ? AND status = 'reserved' RETURNING user_id, amount''', (reservation_id,))
+            result = c.fetchone()
+            if result:
+                c.execute('UPDATE users SET credits = credits + ? WHERE id = ?', (result[1], result[0]))
+        conn.commit()
+        return result is not None
+    except Exception as e:
+        conn.rollback()
+        print(f"Error releasing credit reservation: {e}")
         return False
     finally:
         conn.close()
 
+def release_expired_reservations(user_id=None):
+    """Zwalnia rezerwacje zadań, które przekroczyły limit czasu. Zwraca liczbę zwolnionych rezerwacji."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        now = _reservation_timestamp()
+        if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
+            query = '''UPDATE credit_reservations SET status = 'released'
+                       WHERE status = 'reserved' AND expires_at < %s'''
+            params = (now,)
+            if user_id is not None:
+                query += ' AND user_id = %s'
+                params += (user_id,)
+            c.execute(query + ' RETURNING user_id, amount', params)
+            released = c.fetchall()
+            for released_user_id, amount in released:
+                c.execute('UPDATE users SET credits = credits + %s WHERE id = %s', (amount, released_user_id))
+        else:
+            query = '''UPDATE credit_reservations SET status = 'released'
+                       WHERE status = 'reserved' AND expires_at < ?'''
+            params = (now,)
+            if user_id is not None:
+                query += ' AND user_id = ?'
+                params += (user_id,)
+            c.execute(query + ' RETURNING user_id, amount', params)
+            released = c.fetchall()
+            for released_user_id, amount in released:
+                c.execute('UPDATE users SET credits = credits + ? WHERE id = ?', (amount, released_user_id))
+        conn.commit()
+        return len(released)
+    except Exception as e:
+        conn.rollback()
+        print(f"Error releasing expired reservations: {e}")
+        return 0
+    finally:
+        conn.close()
+
 def add_credits(user_id, credits_to_add=30):
     """Dodaje kredyty do konta użytkownika"""
     conn = get_db_connection()
@@ -304,6 +709,63 @@ def add_credits(user_id, credits_to_add=30):
     finally:
         conn.close() 
 
+def get_payment(session_id):
+    """Pobiera zaksięgowaną płatność po id sesji Stripe (None jeśli sesja nie była jeszcze przetworzona)"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
+            c.execute('SELECT session_id, user_id, credits, created_at FROM payments WHERE session_id = %s', (session_id,))
+        else:
+            c.execute('SELECT session_id, user_id, credits, created_at FROM payments WHERE session_id = ?', (session_id,))
+        return c.fetchone()
+    finally:
+        conn.close()
+
+def record_payment(session_id, user_id, credits):
+    """Księguje płatność i dodaje kredyty dokładnie raz. Zwraca True jeśli kredyty zostały dodane teraz."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        # Unikalny session_id gwarantuje, że ponowne przetworzenie tej samej sesji nic nie zmieni
+        if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
+            c.execute('''INSERT INTO payments (session_id, user_id, credits) VALUES (%s, %s, %s)
+                         ON CONFLICT (session_id) DO NOTHING RETURNING session_id''', (session_id, user_id, credits))
+            inserted = c.fetchone() is not None
+            if inserted:
+                c.execute('UPDATE users SET credits = credits + %s WHERE id = %s', (credits, user_id))
+        else:
+            c.execute('''INSERT INTO payments (session_id, user_id, credits) VALUES (?, ?, ?)
+                         ON CONFLICT (session_id) DO NOTHING RETURNING session_id''', (session_id, user_id, credits))
+            inserted = c.fetchone() is not None
+            if inserted:
+                c.execute('UPDATE users SET credits = credits + ? WHERE id = ?', (credits, user_id))
+        conn.commit()
+        return inserted
+    except Exception as e:
+        conn.rollback()
+        print(f"Error recording payment: {e}")
+        raise
+    finally:
+        conn.close()
+
+def get_user_largest_package(user_id):
+    """Zwraca liczbę kredytów największego kupionego pakietu (0 jeśli użytkownik nic nie kupił)"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
+            c.execute('SELECT MAX(credits) FROM payments WHERE user_id = %s', (user_id,))
+        else:
+            c.execute('SELECT MAX(credits) FROM payments WHERE user_id = ?', (user_id,))
+        result = c.fetchone()
+        return (result[0] or 0) if result else 0
+    except Exception as e:
+        print(f"Error getting user package: {e}")
+        return 0
+    finally:
+        conn.close()
+
 def get_user_premium_tokens(user_id):
     """Pobiera liczbę premium tokens użytkownika"""
     conn = get_db_connection()
@@ -318,24 +780,478 @@ def get_user_premium_tokens(user_id):
     finally:
         conn.close()
 
-def migrate_database():
-    """Dodaje nowe kolumny do istniejących tabel"""
+def record_token_usage(user_id, purpose, model, estimated_tokens, prompt_tokens, completion_tokens, transcription_id=None, truncated=False):
+    """Zapisuje zużycie tokenów jednego wywołania LLM (szacunek przed wysłaniem i faktyczne z odpowiedzi)"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
+            c.execute('''INSERT INTO token_usage (user_id, transcription_id, purpose, model, estimated_tokens,
+                         prompt_tokens, completion_tokens, truncated) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)''',
+                      (user_id, transcription_id, purpose, model, estimated_tokens, prompt_tokens, completion_tokens, truncated))
+        else:
+            c.execute('''INSERT INTO token_usage (user_id, transcription_id, purpose, model, estimated_tokens,
+                         prompt_tokens, completion_tokens, truncated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                      (user_id, transcription_id, purpose, model, estimated_tokens, prompt_tokens, completion_tokens, truncated))
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"Error recording token usage: {e}")
+        return False
+    finally:
+        conn.close()
+
+def get_top_token_users(days=30, limit=10):
+    """Użytkownicy z największym zużyciem tokenów w ostatnich dniach: (username, wywołania, prompt, completion)"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    since = _reservation_timestamp(-days * 24 * 60 * 60)
+    try:
+        query = '''SELECT u.username, COUNT(*), COALESCE(SUM(t.prompt_tokens), 0), COALESCE(SUM(t.completion_tokens), 0)
+                   FROM token_usage t JOIN users u ON u.id = t.user_id
+                   WHERE t.created_at >= {0}
+                   GROUP BY u.username
+                   ORDER BY 3 DESC
+                   LIMIT {0}'''
+        if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
+            c.execute(query.format('%s'), (since, limit))
+        else:
+            c.execute(query.format('?'), (since, limit))
+        return c.fetchall()
+    except Exception as e:
+        print(f"Error getting token usage: {e}")
+        return []
+    finally:
+        conn.close()
+
+def record_job_stats(user_id, model, device, media_seconds, transcribe_seconds, total_seconds):
+    """Zapisuje czasy zakończonego zadania - z nich liczymy współczynnik czasu rzeczywistego do szacunków"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
+            c.execute('''INSERT INTO job_stats (user_id, model, device, media_seconds, transcribe_seconds, total_seconds)
+                         VALUES (%s, %s, %s, %s, %s, %s)''',
+                      (user_id, model, device, media_seconds, transcribe_seconds, total_seconds))
+        else:
+            c.execute('''INSERT INTO job_stats (user_id, model, device, media_seconds, transcribe_seconds, total_seconds)
+                         VALUES (?, ?, ?, ?, ?, ?)''',
+                      (user_id, model, device, media_seconds, transcribe_seconds, total_seconds))
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"Error recording job stats: {e}")
+        return False
+    finally:
+        conn.close()
+
+def get_job_rtfs(model, device, limit=50):
+    """Współczynniki czasu rzeczywistego (czas zadania / długość nagrania) ostatnich zadań modelu, od najnowszego"""
     conn = get_db_connection()
     c = conn.cursor()
     try:
+        query = '''SELECT total_seconds / media_seconds FROM job_stats
+                   WHERE model = {0} AND device = {0} AND media_seconds > 0
+                   ORDER BY id DESC
+                   LIMIT {0}'''
         if DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL:
-            # PostgreSQL
-            c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS premium_tokens INTEGER DEFAULT 0")
-            c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS terms_accepted BOOLEAN DEFAULT FALSE")
+            c.execute(query.format('%s'), (model, device, limit))
+        else:
+            c.execute(query.format('?'), (model, device, limit))
+        return [row[0] for row in c.fetchall()]
+    except Exception as e:
+        print(f"Error getting job stats: {e}")
+        return []
+    finally:
+        conn.close()
+
+def _column_exists(c, table, column, is_postgres):
+    """Sprawdza czy kolumna istnieje w tabeli"""
+    if is_postgres:
+        c.execute('SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = %s',
+                  (table, column))
+        return c.fetchone() is not None
+    c.execute(f'PRAGMA table_info({table})')
+    return any(row[1] == column for row in c.fetchall())
+
+def _add_column(c, table, column, definition, is_postgres):
+    """Dodaje kolumnę tylko jeśli jeszcze nie istnieje"""
+    if not _column_exists(c, table, column, is_postgres):
+        c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def _migration_base_tables(c, is_postgres):
+    if is_postgres:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id SERIAL PRIMARY KEY,
+                username VARCHAR(255) UNIQUE NOT NULL,
+                password TEXT NOT NULL,
+                email VARCHAR(255) UNIQUE NOT NULL,
+                credits INTEGER DEFAULT 10,
+                premium_tokens INTEGER DEFAULT 0,
+                terms_accepted BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS transcriptions (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER REFERENCES users(id),
+                title TEXT,
+                transcription TEXT,
+                notes TEXT,
+                custom_notes TEXT,
+                custom_prompt TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+    else:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password TEXT NOT NULL,
+                email TEXT UNIQUE NOT NULL,
+                credits INTEGER DEFAULT 10,
+                premium_tokens INTEGER DEFAULT 0,
+                terms_accepted BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS transcriptions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                transcription TEXT NOT NULL,
+                notes TEXT,
+                custom_notes TEXT,
+                custom_prompt TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+
+def _migration_user_columns(c, is_postgres):
+    # Starsze bazy mogą nie mieć kolumn dodanych po pierwszym wdrożeniu
+    _add_column(c, 'users', 'premium_tokens', 'INTEGER DEFAULT 0', is_postgres)
+    _add_column(c, 'users', 'terms_accepted', 'BOOLEAN DEFAULT FALSE', is_postgres)
+
+def _migration_transcriptions_user_index(c, is_postgres):
+    # Historia w sidebarze filtruje po user_id i sortuje po created_at
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_transcriptions_user_created
+        ON transcriptions (user_id, created_at DESC)
+    ''')
+
+def _migration_credit_reservations(c, is_postgres):
+    if is_postgres:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS credit_reservations (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER REFERENCES users(id),
+                amount INTEGER NOT NULL,
+                status VARCHAR(16) NOT NULL DEFAULT 'reserved',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                expires_at TIMESTAMP NOT NULL
+            )
+        ''')
+    else:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS credit_reservations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'reserved',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                expires_at TIMESTAMP NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_credit_reservations_status_expires
+        ON credit_reservations (status, expires_at)
+    ''')
+
+def _migration_payments(c, is_postgres):
+    if is_postgres:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS payments (
+                session_id VARCHAR(255) PRIMARY KEY,
+                user_id INTEGER REFERENCES users(id),
+                credits INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+    else:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS payments (
+                session_id TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                credits INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+
+def _migration_transcriptions_search(c, is_postgres):
+    if is_postgres:
+        # Kolumna generowana jest aktualizowana przez PostgreSQL przy każdym INSERT/UPDATE
+        c.execute('''
+            ALTER TABLE transcriptions ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('simple', coalesce(notes, '')), 'A') ||
+                setweight(to_tsvector('simple', coalesce(custom_notes, '')), 'A') ||
+                setweight(to_tsvector('simple', coalesce(transcription, '')), 'B')
+            ) STORED
+        ''')
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_transcriptions_search
+            ON transcriptions USING GIN (search_vector)
+        ''')
+    else:
+        # Indeks FTS5 na zewnętrznej treści, utrzymywany przyrostowo przez triggery.
+        # Kolumna owner (token "u<user_id>") pozwala FTS5 zawęzić wyniki do użytkownika
+        # bez przeglądania dopasowań wszystkich pozostałych użytkowników.
+        c.execute('''
+            CREATE VIEW IF NOT EXISTS transcriptions_fts_source AS
+            SELECT id, 'u' || user_id AS owner, transcription, notes, custom_notes
+            FROM transcriptions
+        ''')
+        c.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS transcriptions_fts USING fts5(
+                owner, transcription, notes, custom_notes,
+                content='transcriptions_fts_source', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS transcriptions_fts_insert AFTER INSERT ON transcriptions BEGIN
+                INSERT INTO transcriptions_fts (rowid, owner, transcription, notes, custom_notes)
+                VALUES (new.id, 'u' || new.user_id, new.transcription, new.notes, new.custom_notes);
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS transcriptions_fts_delete AFTER DELETE ON transcriptions BEGIN
+                INSERT INTO transcriptions_fts (transcriptions_fts, rowid, owner, transcription, notes, custom_notes)
+                VALUES ('delete', old.id, 'u' || old.user_id, old.transcription, old.notes, old.custom_notes);
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS transcriptions_fts_update AFTER UPDATE ON transcriptions BEGIN
+                INSERT INTO transcriptions_fts (transcriptions_fts, rowid, owner, transcription, notes, custom_notes)
+                VALUES ('delete', old.id, 'u' || old.user_id, old.transcription, old.notes, old.custom_notes);
+                INSERT INTO transcriptions_fts (rowid, owner, transcription, notes, custom_notes)
+                VALUES (new.id, 'u' || new.user_id, new.transcription, new.notes, new.custom_notes);
+            END
+        ''')
+        c.execute("INSERT INTO transcriptions_fts (transcriptions_fts) VALUES ('rebuild')")
+
+def _migration_transcription_embeddings(c, is_postgres):
+    # Fragmenty nie są zapisywane - odtwarzamy je z transkrypcji na podstawie chunk_words/chunk_overlap
+    if is_postgres:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS transcription_embeddings (
+                transcription_id INTEGER PRIMARY KEY REFERENCES transcriptions(id) ON DELETE CASCADE,
+                model VARCHAR(64) NOT NULL,
+                dim INTEGER NOT NULL,
+                chunk_words INTEGER NOT NULL,
+                chunk_overlap INTEGER NOT NULL,
+                vectors BYTEA NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+    else:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS transcription_embeddings (
+                transcription_id INTEGER PRIMARY KEY,
+                model TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                chunk_words INTEGER NOT NULL,
+                chunk_overlap INTEGER NOT NULL,
+                vectors BLOB NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (transcription_id) REFERENCES transcriptions (id) ON DELETE CASCADE
+            )
+        ''')
+
+def _migration_transcription_segments(c, is_postgres):
+    if is_postgres:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS transcription_segments (
+                transcription_id INTEGER PRIMARY KEY REFERENCES transcriptions(id) ON DELETE CASCADE,
+                data BYTEA NOT NULL
+            )
+        ''')
+    else:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS transcription_segments (
+                transcription_id INTEGER PRIMARY KEY,
+                data BLOB NOT NULL,
+                FOREIGN KEY (transcription_id) REFERENCES transcriptions (id) ON DELETE CASCADE
+            )
+        ''')
+
+def _migration_transcription_notes_bundle(c, is_postgres):
+    # Notatki w dodatkowych językach i wyniki dodatkowych poleceń jako jeden dokument JSON
+    _add_column(c, 'transcriptions', 'notes_bundle', 'TEXT', is_postgres)
+
+def _migration_token_usage(c, is_postgres):
+    if is_postgres:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS token_usage (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER REFERENCES users(id),
+                transcription_id INTEGER,
+                purpose VARCHAR(32) NOT NULL,
+                model VARCHAR(64) NOT NULL,
+                estimated_tokens INTEGER NOT NULL,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                truncated BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+    else:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS token_usage (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                transcription_id INTEGER,
+                purpose TEXT NOT NULL,
+                model TEXT NOT NULL,
+                estimated_tokens INTEGER NOT NULL,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                truncated BOOLEAN DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_token_usage_user_created
+        ON token_usage (user_id, created_at)
+    ''')
+
+def _migration_job_stats(c, is_postgres):
+    if is_postgres:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS job_stats (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER REFERENCES users(id),
+                model VARCHAR(64) NOT NULL,
+                device VARCHAR(16) NOT NULL,
+                media_seconds DOUBLE PRECISION NOT NULL,
+                transcribe_seconds DOUBLE PRECISION NOT NULL,
+                total_seconds DOUBLE PRECISION NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+    else:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS job_stats (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                model TEXT NOT NULL,
+                device TEXT NOT NULL,
+                media_seconds REAL NOT NULL,
+                transcribe_seconds REAL NOT NULL,
+                total_seconds REAL NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+    # Szacunki czytają ostatnie zadania danego modelu na danym urządzeniu
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_job_stats_model_device
+        ON job_stats (model, device, id)
+    ''')
+
+# Uporządkowana lista migracji: (wersja, opis, funkcja). Każda migracja musi być
+# idempotentna - nowe zmiany schematu dodajemy wyłącznie na końcu listy.
+MIGRATIONS = [
+    (1, 'base tables', _migration_base_tables),
+    (2, 'users premium_tokens and terms_accepted', _migration_user_columns),
+    (3, 'transcriptions (user_id, created_at) index', _migration_transcriptions_user_index),
+    (4, 'credit reservations ledger', _migration_credit_reservations),
+    (5, 'payments keyed by Stripe session id', _migration_payments),
+    (6, 'full-text search over transcriptions', _migration_transcriptions_search),
+    (7, 'transcription chunk embeddings', _migration_transcription_embeddings),
+    (8, 'timestamped transcription segments', _migration_transcription_segments),
+    (9, 'transcriptions notes bundle', _migration_transcription_notes_bundle),
+    (10, 'per-call LLM token usage', _migration_token_usage),
+    (11, 'job timings for processing time estimates', _migration_job_stats),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Klucz advisory locka chroniącego migracje w PostgreSQL
+MIGRATION_LOCK_ID = 7261001
+
+def _read_schema_version(conn, c):
+    """Zwraca aktualną wersję schematu (0 jeśli tabela wersji nie istnieje)"""
+    try:
+        c.execute('SELECT MAX(version) FROM schema_version')
+        result = c.fetchone()
+        return result[0] or 0
+    except Exception:
+        conn.rollback()
+        return 0
+
+def migrate_database():
+    """Stosuje brakujące migracje schematu. Przy aktualnym schemacie wykonuje tylko jeden odczyt wersji."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    is_postgres = bool(DATABASE_URL and HAS_POSTGRES and 'neon' in DATABASE_URL)
+    try:
+        current = _read_schema_version(conn, c)
+        if current >= SCHEMA_VERSION:
+            return current
+
+        # Blokada, aby równolegle startujące procesy nie wykonywały DDL jednocześnie
+        if is_postgres:
+            c.execute('SELECT pg_advisory_xact_lock(%s)', (MIGRATION_LOCK_ID,))
         else:
-            # SQLite
-            c.execute("ALTER TABLE users ADD COLUMN premium_tokens INTEGER DEFAULT 0")
-            c.execute("ALTER TABLE users ADD COLUMN terms_accepted BOOLEAN DEFAULT FALSE")
+            c.execute('BEGIN IMMEDIATE')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # Inny proces mógł zakończyć migracje zanim dostaliśmy blokadę
+        c.execute('SELECT MAX(version) FROM schema_version')
+        current = c.fetchone()[0] or 0
+
+        for version, name, migration in MIGRATIONS:
+            if version <= current:
+                continue
+            print(f"Applying migration {version}: {name}")
+            migration(c, is_postgres)
+            if is_postgres:
+                c.execute('INSERT INTO schema_version (version, name) VALUES (%s, %s)', (version, name))
+            else:
+                c.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)', (version, name))
+            current = version
         conn.commit()
+        return current
     except Exception as e:
-        print(f"Migration error (columns may already exist): {e}")
+        conn.rollback()
+        print(f"Migration error: {e}")
+        return None
     finally:
         conn.close()
 
-# Wywołaj migrację w init_db()
-migrate_database() 
\ No newline at end of file
+# Funkcje zapytań raportują swój czas do profilera; przy wyłączonym profilowaniu to tylko sprawdzenie flagi
+PROFILED_FUNCTIONS = (
+    'register_user', 'verify_user', 'save_transcription', 'update_transcription_text', 'update_transcription_notes',
+    'save_transcription_embeddings', 'get_transcription_embeddings', 'save_transcription_segments',
+    'get_transcription_segments', 'get_user_transcriptions', 'search_transcriptions', 'get_transcription',
+    'get_user_credits', 'use_credit', 'reserve_credit', 'commit_reservation', 'release_reservation',
+    'release_expired_reservations', 'add_credits', 'get_payment', 'record_payment', 'get_user_largest_package',
+    'get_user_premium_tokens', 'record_token_usage', 'get_top_token_users', 'get_user_id', 'import_transcriptions',
+    'record_job_stats', 'get_job_rtfs',
+)
+for _name in PROFILED_FUNCTIONS:
+    globals()[_name] = profiled(globals()[_name])
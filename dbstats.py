@@ -0,0 +1,306 @@
+import contextvars
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from contextlib import ContextDecorator
+from functools import lru_cache
+
+# Statystyki zapytań: każde wykonanie kursora jest liczone pod odciskiem zapytania (SQL bez literałów)
+# i pod ścieżką aplikacji (np. "sidebar.history", "processing.save"), z której przyszło
+DB_STATS_ENABLED = os.getenv("DB_STATS", "1").lower() not in ("0", "false", "no")
+DB_STATS_WINDOW = int(os.getenv("DB_STATS_WINDOW", 500))  # Ile ostatnich wykonań zapytania trafia do histogramu
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", 250))
+DB_SLOW_QUERY_LOG = os.getenv("DB_SLOW_QUERY_LOG", os.path.join(tempfile.gettempdir(), "transcription_app", "slow_queries.log"))
+DB_SLOW_QUERY_LOG_MAX_BYTES = 5 * 1024 * 1024
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+DEFAULT_PATH = "page"
+
+_path = contextvars.ContextVar("db_path", default=DEFAULT_PATH)
+_lock = threading.Lock()
+_log_lock = threading.Lock()
+_queries = {}
+_paths = {}
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])\d+(?:\.\d+)?\b")
+_PLACEHOLDERS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+@lru_cache(maxsize=1024)
+def fingerprint(sql):
+    """Odcisk zapytania: literały i parametry jako ?, listy parametrów zwinięte, jednolite spacje"""
+    sql = _STRING.sub("?", sql.replace("%s", "?"))
+    sql = _NUMBER.sub("?", sql)
+    sql = _PLACEHOLDERS.sub("(?, ...)", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+class db_path(ContextDecorator):
+    """Oznacza zapytania wykonane w bloku/funkcji ścieżką aplikacji (context manager albo dekorator)"""
+
+    def __init__(self, name):
+        self.name = name
+        self._tokens = []
+
+    def __enter__(self):
+        self._tokens.append(_path.set(self.name))
+        return self
+
+    def __exit__(self, *exc):
+        _path.reset(self._tokens.pop())
+        return False
+
+def current_path():
+    return _path.get()
+
+class _QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.slow = 0
+        self.rows = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.recent = deque(maxlen=DB_STATS_WINDOW)
+
+class _PathStats:
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.connections = 0
+        self.acquire_seconds = 0.0
+        self.by_query = Counter()
+
+def _path_stats(path):
+    stats = _paths.get(path)
+    if stats is None:
+        stats = _paths[path] = _PathStats()
+    return stats
+
+def record_connection(seconds):
+    """Czas uzyskania połączenia z bazą (przy Neon to zwykle nawiązanie połączenia TLS)"""
+    with _lock:
+        stats = _path_stats(current_path())
+        stats.connections += 1
+        stats.acquire_seconds += seconds
+
+def record_query(sql, seconds, rows, path=None, error=None):
+    key = fingerprint(sql)
+    path = path or current_path()
+    slow = seconds * 1000 >= DB_SLOW_QUERY_MS
+    with _lock:
+        stats = _queries.get(key)
+        if stats is None:
+            stats = _queries[key] = _QueryStats()
+        stats.count += 1
+        stats.rows += max(rows, 0)
+        stats.seconds += seconds
+        stats.max_seconds = max(stats.max_seconds, seconds)
+        stats.recent.append(seconds)
+        stats.errors += error is not None
+        stats.slow += slow
+        by_path = _path_stats(path)
+        by_path.queries += 1
+        by_path.seconds += seconds
+        by_path.by_query[key] += seconds
+    if slow or error is not None:
+        _log_query(key, sql, seconds, rows, path, error)
+
+def _log_query(key, sql, seconds, rows, path, error):
+    entry = {
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "ms": round(seconds * 1000, 1),
+        "path": path,
+        "rows": rows,
+        "fingerprint": key,
+        "sql": _WHITESPACE.sub(" ", sql).strip()[:2000],
+    }
+    if error is not None:
+        entry["error"] = str(error)
+    try:
+        with _log_lock:
+            os.makedirs(os.path.dirname(DB_SLOW_QUERY_LOG), exist_ok=True)
+            if os.path.exists(DB_SLOW_QUERY_LOG) and os.path.getsize(DB_SLOW_QUERY_LOG) > DB_SLOW_QUERY_LOG_MAX_BYTES:
+                os.replace(DB_SLOW_QUERY_LOG, DB_SLOW_QUERY_LOG + ".1")
+            with open(DB_SLOW_QUERY_LOG, "a") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    except Exception as e:
+        print(f"Error writing slow query log: {e}")
+
+class _InstrumentedCursor:
+    """Kursor mierzący zapytania. Przy SQLite SELECT wykonuje się dopiero przy pobieraniu wierszy,
+    dlatego czas i liczbę wierszy z fetch* doliczamy do zapytania i zapisujemy je przy kolejnym
+    execute, po pobraniu wszystkich wierszy albo przy zamknięciu kursora/połączenia."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._pending = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        while (row := self.fetchone()) is not None:
+            yield row
+
+    def _run(self, method, sql, *args):
+        self._finish()
+        path = current_path()
+        start = time.perf_counter()
+        try:
+            result = method(sql, *args)
+        except Exception as e:
+            record_query(sql, time.perf_counter() - start, 0, path=path, error=e)
+            raise
+        # Dla SELECT w SQLite rowcount to -1 - wiersze liczymy przy pobieraniu
+        self._pending = [sql, time.perf_counter() - start, max(self._cursor.rowcount, 0), path]
+        return self if result is self._cursor else result
+
+    def execute(self, sql, params=None):
+        if params is None:
+            return self._run(self._cursor.execute, sql)
+        return self._run(self._cursor.execute, sql, params)
+
+    def executemany(self, sql, params):
+        return self._run(self._cursor.executemany, sql, params)
+
+    def _fetch(self, method, *args):
+        start = time.perf_counter()
+        result = method(*args)
+        if self._pending:
+            self._pending[1] += time.perf_counter() - start
+        return result
+
+    def fetchone(self):
+        row = self._fetch(self._cursor.fetchone)
+        if self._pending:
+            if row is None:
+                self._finish()
+            elif self._cursor.rowcount < 0:
+                self._pending[2] += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._fetch(self._cursor.fetchmany, *args)
+        if self._pending and self._cursor.rowcount < 0:
+            self._pending[2] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(self._cursor.fetchall)
+        if self._pending and self._cursor.rowcount < 0:
+            self._pending[2] += len(rows)
+        self._finish()
+        return rows
+
+    def _finish(self):
+        if self._pending:
+            sql, seconds, rows, path = self._pending
+            self._pending = None
+            record_query(sql, seconds, rows, path=path)
+
+    def close(self):
+        self._finish()
+        self._cursor.close()
+
+class _InstrumentedConnection:
+    """Połączenie zwracające mierzone kursory; resztę deleguje do prawdziwego połączenia"""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._cursors = []
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def cursor(self, *args, **kwargs):
+        cursor = _InstrumentedCursor(self._conn.cursor(*args, **kwargs))
+        self._cursors.append(cursor)
+        return cursor
+
+    def close(self):
+        for cursor in self._cursors:
+            cursor._finish()
+        self._cursors = []
+        self._conn.close()
+
+def instrument_connection(conn, acquire_seconds):
+    """Opakowuje świeże połączenie z bazą (przy wyłączonych statystykach zwraca je bez zmian)"""
+    if not DB_STATS_ENABLED:
+        return conn
+    record_connection(acquire_seconds)
+    return _InstrumentedConnection(conn)
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+def _histogram(samples):
+    counts = Counter()
+    for seconds in samples:
+        ms = seconds * 1000
+        bucket = next((f"<{limit}ms" for limit in HISTOGRAM_BUCKETS_MS if ms < limit), f">={HISTOGRAM_BUCKETS_MS[-1]}ms")
+        counts[bucket] += 1
+    labels = [f"<{limit}ms" for limit in HISTOGRAM_BUCKETS_MS] + [f">={HISTOGRAM_BUCKETS_MS[-1]}ms"]
+    return {label: counts[label] for label in labels if counts[label]}
+
+def query_stats(limit=None):
+    """Zapytania od największego łącznego czasu, z percentylami i histogramem ostatnich wykonań"""
+    with _lock:
+        items = [(key, stats.count, stats.errors, stats.slow, stats.rows, stats.seconds, stats.max_seconds, list(stats.recent))
+                 for key, stats in _queries.items()]
+    items.sort(key=lambda item: item[5], reverse=True)
+    result = []
+    for key, count, errors, slow, rows, seconds, max_seconds, recent in items[:limit]:
+        ordered = sorted(recent)
+        result.append({
+            "query": key,
+            "calls": count,
+            "errors": errors,
+            "slow": slow,
+            "rows": rows,
+            "total_ms": round(seconds * 1000, 1),
+            "avg_ms": round(seconds / count * 1000, 2),
+            "p50_ms": round(_percentile(ordered, 50) * 1000, 2),
+            "p95_ms": round(_percentile(ordered, 95) * 1000, 2),
+            "max_ms": round(max_seconds * 1000, 1),
+            "histogram": _histogram(recent),
+        })
+    return result
+
+def path_stats(top_queries=3):
+    """Ścieżki aplikacji od największego czasu w bazie (zapytania + uzyskiwanie połączeń)"""
+    with _lock:
+        items = [(path, stats.queries, stats.seconds, stats.connections, stats.acquire_seconds,
+                  stats.by_query.most_common(top_queries)) for path, stats in _paths.items()]
+    total = sum(seconds + acquire for _, _, seconds, _, acquire, _ in items) or 1.0
+    items.sort(key=lambda item: item[2] + item[4], reverse=True)
+    return [
+        {"path": path, "queries": queries, "query_ms": round(seconds * 1000, 1), "connections": connections,
+         "connect_ms": round(acquire * 1000, 1), "share": round((seconds + acquire) / total, 3),
+         "top_queries": [{"query": key, "total_ms": round(value * 1000, 1)} for key, value in top]}
+        for path, queries, seconds, connections, acquire, top in items
+    ]
+
+def export_stats():
+    """Pełny zrzut statystyk do pobrania (JSON)"""
+    return json.dumps({
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "slow_query_ms": DB_SLOW_QUERY_MS,
+        "paths": path_stats(top_queries=10),
+        "queries": query_stats(),
+    }, indent=2)
+
+def reset_stats():
+    with _lock:
+        _queries.clear()
+        _paths.clear()
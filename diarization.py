@@ -0,0 +1,219 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from audio import load_pcm, PCM_SAMPLE_RATE
+
+# Diaryzacja na CPU bez dodatkowych modeli: VAD energetyczny, wektory mówcy ze statystyk MFCC
+# dla okien mowy i sferyczny k-means z wyborem liczby mówców po współczynniku silhouette.
+# Działa w osobnym wątku równolegle z whisperem na tym samym pliku PCM (mapa w pamięci).
+DIARIZATION_MAX_SPEAKERS = int(os.getenv("DIARIZATION_MAX_SPEAKERS", 6))
+DIARIZATION_MIN_SILHOUETTE = float(os.getenv("DIARIZATION_MIN_SILHOUETTE", 0.2))  # Poniżej - jeden mówca
+DIARIZATION_WORKERS = int(os.getenv("DIARIZATION_WORKERS", 2))
+
+FRAME_SAMPLES = 400  # 25 ms
+HOP_SAMPLES = 160  # 10 ms
+FRAMES_PER_SECOND = PCM_SAMPLE_RATE // HOP_SAMPLES
+N_FFT = 512
+N_MELS = 40
+N_MFCC = 20
+WINDOW_FRAMES = 150  # Okno wektora mówcy: 1.5 s
+WINDOW_HOP_FRAMES = 75
+MIN_WINDOW_FRAMES = 50  # Krótsze wypowiedzi pomijamy (za mało danych na wektor mówcy)
+MIN_SPEECH_FRAMES = 30
+MAX_GAP_FRAMES = 30  # Przerwy krótsze niż 0.3 s nie dzielą wypowiedzi
+FEATURE_CHUNK_SECONDS = 60  # Długie fragmenty mowy liczymy kawałkami - stała pamięć niezależnie od długości
+VAD_BLOCK_SECONDS = 600
+MIN_CLUSTER_SHARE = 0.02  # Klastry z mniejszym udziałem okien dołączamy do najbliższego mówcy
+SILHOUETTE_SAMPLE = 1000
+TURN_MERGE_GAP = 0.5
+
+_executor = ThreadPoolExecutor(max_workers=DIARIZATION_WORKERS, thread_name_prefix="diarize")
+
+def _mel_filterbank():
+    def hz_to_mel(hz):
+        return 2595 * np.log10(1 + hz / 700)
+
+    mel_points = np.linspace(hz_to_mel(0), hz_to_mel(PCM_SAMPLE_RATE / 2), N_MELS + 2)
+    bins = np.floor((N_FFT + 1) * 700 * (10 ** (mel_points / 2595) - 1) / PCM_SAMPLE_RATE).astype(int)
+    filters = np.zeros((N_MELS, N_FFT // 2 + 1), dtype=np.float32)
+    for m in range(1, N_MELS + 1):
+        left, center, right = bins[m - 1], bins[m], bins[m + 1]
+        filters[m - 1, left:center] = (np.arange(left, center) - left) / max(center - left, 1)
+        filters[m - 1, center:right] = (right - np.arange(center, right)) / max(right - center, 1)
+    return filters
+
+def _dct_matrix():
+    n = np.arange(N_MELS)
+    k = np.arange(N_MFCC)[:, None]
+    return (np.cos(np.pi * k * (2 * n + 1) / (2 * N_MELS)) * np.sqrt(2 / N_MELS)).astype(np.float32)
+
+_MEL_FILTERS = _mel_filterbank()
+_DCT = _dct_matrix()
+_WINDOW = np.hamming(FRAME_SAMPLES).astype(np.float32)
+
+def speech_regions(audio):
+    """Fragmenty mowy (start, end) w ramkach 10 ms wyznaczone z energii sygnału"""
+    energies = []
+    block = VAD_BLOCK_SECONDS * PCM_SAMPLE_RATE
+    for offset in range(0, len(audio) - HOP_SAMPLES + 1, block):
+        chunk = np.asarray(audio[offset:offset + block], dtype=np.float32)
+        frames = chunk[:len(chunk) // HOP_SAMPLES * HOP_SAMPLES].reshape(-1, HOP_SAMPLES)
+        energies.append(np.einsum("ij,ij->i", frames, frames) / HOP_SAMPLES)
+    if not energies:
+        return []
+    db = 10 * np.log10(np.concatenate(energies) + 1e-10)
+    db = np.convolve(db, np.ones(5) / 5, mode="same")
+    # Próg adaptacyjny między poziomem szumu a głośną mową
+    noise, loud = np.percentile(db, 10), np.percentile(db, 95)
+    speech = db > max(noise + max(6.0, (loud - noise) * 0.3), -60.0)
+
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], speech.astype(np.int8), [0]))))
+    starts, ends = edges[0::2], edges[1::2]
+    if not len(starts):
+        return []
+    # Sklejamy wypowiedzi rozdzielone krótką przerwą i odrzucamy bardzo krótkie
+    keep = np.concatenate(([True], starts[1:] - ends[:-1] >= MAX_GAP_FRAMES))
+    starts = starts[keep]
+    ends = ends[np.concatenate((keep[1:], [True]))]
+    long_enough = ends - starts >= MIN_SPEECH_FRAMES
+    return list(zip(starts[long_enough].tolist(), ends[long_enough].tolist()))
+
+def mfcc(samples):
+    """MFCC (bez współczynnika energii c0) dla ramek 25 ms co 10 ms"""
+    if len(samples) < FRAME_SAMPLES:
+        return np.zeros((0, N_MFCC - 1), dtype=np.float32)
+    samples = np.append(samples[0], samples[1:] - 0.97 * samples[:-1]).astype(np.float32)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FRAME_SAMPLES)[::HOP_SAMPLES] * _WINDOW
+    power = np.abs(np.fft.rfft(frames, n=N_FFT)) ** 2
+    log_mel = np.log(power.astype(np.float32) @ _MEL_FILTERS.T + 1e-6)
+    return (log_mel @ _DCT.T)[:, 1:]
+
+def _window_embeddings(features):
+    """Średnia i odchylenie MFCC w przesuwanych oknach 1.5 s (sumy skumulowane zamiast pętli po oknach)"""
+    count = len(features)
+    if count < MIN_WINDOW_FRAMES:
+        return np.zeros((0, 2 * features.shape[1]), dtype=np.float32), np.zeros(0, dtype=int)
+    length = min(WINDOW_FRAMES, count)
+    starts = np.arange(0, count - length + 1, WINDOW_HOP_FRAMES)
+    cumulative = np.vstack([np.zeros((1, features.shape[1])), np.cumsum(features, axis=0, dtype=np.float64)])
+    squares = np.vstack([np.zeros((1, features.shape[1])), np.cumsum(features.astype(np.float64) ** 2, axis=0)])
+    mean = (cumulative[starts + length] - cumulative[starts]) / length
+    variance = (squares[starts + length] - squares[starts]) / length - mean ** 2
+    return np.hstack([mean, np.sqrt(np.clip(variance, 0, None))]).astype(np.float32), starts
+
+def speaker_windows(audio, regions):
+    """Wektory mówcy dla okien mowy. Zwraca (wektory, czasy okien [start, end] w sekundach)."""
+    embeddings, spans = [], []
+    chunk_frames = FEATURE_CHUNK_SECONDS * FRAMES_PER_SECOND
+    for region_start, region_end in regions:
+        for start in range(region_start, region_end, chunk_frames):
+            end = min(start + chunk_frames, region_end)
+            samples = np.asarray(audio[start * HOP_SAMPLES:end * HOP_SAMPLES + FRAME_SAMPLES - HOP_SAMPLES], dtype=np.float32)
+            vectors, offsets = _window_embeddings(mfcc(samples))
+            if not len(vectors):
+                continue
+            length = min(WINDOW_FRAMES, end - start)
+            # Każde okno "posiada" odcinek długości kroku wokół swojego środka; skrajne sięgają do granic fragmentu
+            centers = start + offsets + length / 2
+            span_starts = np.maximum(centers - WINDOW_HOP_FRAMES / 2, start)
+            span_ends = np.minimum(centers + WINDOW_HOP_FRAMES / 2, end)
+            span_starts[0], span_ends[-1] = start, end
+            embeddings.append(vectors)
+            spans.append(np.stack([span_starts, span_ends], axis=1) / FRAMES_PER_SECOND)
+    if not embeddings:
+        return np.zeros((0, 2 * (N_MFCC - 1)), dtype=np.float32), np.zeros((0, 2))
+    return np.vstack(embeddings), np.vstack(spans)
+
+def _normalize(vectors):
+    vectors = (vectors - vectors.mean(axis=0)) / (vectors.std(axis=0) + 1e-6)
+    return vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-9)
+
+def spherical_kmeans(vectors, k, rng, iterations=50):
+    """k-means na sferze jednostkowej (podobieństwo kosinusowe) z inicjalizacją k-means++"""
+    centers = [vectors[rng.integers(len(vectors))]]
+    for _ in range(1, k):
+        distance = np.clip(1 - np.max(vectors @ np.array(centers).T, axis=1), 0, None) ** 2
+        if distance.sum() <= 0:
+            break
+        centers.append(vectors[rng.choice(len(vectors), p=distance / distance.sum())])
+    centers = np.array(centers)
+    labels = np.argmax(vectors @ centers.T, axis=1)
+    for _ in range(iterations):
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, vectors)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centers = np.where(norms > 0, sums / np.where(norms > 0, norms, 1), centers)
+        updated = np.argmax(vectors @ centers.T, axis=1)
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+    return labels, centers
+
+def silhouette(vectors, labels):
+    """Średni współczynnik silhouette dla odległości kosinusowej (macierzowo, na próbce okien)"""
+    clusters = np.unique(labels)
+    if len(clusters) < 2:
+        return -1.0
+    one_hot = (labels[:, None] == clusters[None, :]).astype(np.float32)
+    sizes = one_hot.sum(axis=0)
+    distances = 1 - vectors @ vectors.T
+    mean_to = (distances @ one_hot) / np.maximum(sizes - one_hot, 1)
+    own = mean_to[one_hot.astype(bool)]
+    other = np.where(one_hot.astype(bool), np.inf, mean_to).min(axis=1)
+    scores = np.where(sizes[np.argmax(one_hot, axis=1)] > 1, (other - own) / np.maximum(np.maximum(own, other), 1e-9), 0)
+    return float(scores.mean())
+
+def cluster_speakers(vectors, max_speakers=DIARIZATION_MAX_SPEAKERS, seed=0):
+    """Etykiety mówców dla wektorów okien; liczba mówców wybierana po silhouette"""
+    if len(vectors) < 4:
+        return np.zeros(len(vectors), dtype=int)
+    rng = np.random.default_rng(seed)
+    vectors = _normalize(vectors)
+    sample = rng.choice(len(vectors), min(len(vectors), SILHOUETTE_SAMPLE), replace=False)
+    best_labels, best_centers, best_score = None, None, DIARIZATION_MIN_SILHOUETTE
+    for k in range(2, min(max_speakers, len(vectors) - 1) + 1):
+        labels, centers = spherical_kmeans(vectors, k, rng)
+        score = silhouette(vectors[sample], labels[sample])
+        if score > best_score:
+            best_labels, best_centers, best_score = labels, centers, score
+    if best_labels is None:
+        return np.zeros(len(vectors), dtype=int)
+
+    # Małe klastry to zwykle szum lub śmiech - dołączamy je do najbliższego dużego mówcy
+    shares = np.bincount(best_labels, minlength=len(best_centers)) / len(best_labels)
+    large = np.flatnonzero(shares >= MIN_CLUSTER_SHARE)
+    labels = large[np.argmax(vectors @ best_centers[large].T, axis=1)]
+    # Pojedyncze okno innego mówcy między dwoma oknami tego samego mówcy traktujemy jako błąd
+    if len(labels) > 2:
+        outlier = (labels[:-2] == labels[2:]) & (labels[1:-1] != labels[:-2])
+        labels[1:-1][outlier] = labels[:-2][outlier]
+    return labels
+
+def diarize(pcm_path, max_speakers=DIARIZATION_MAX_SPEAKERS):
+    """Diaryzacja pliku PCM. Zwraca tury [(start, end, mówca)] w sekundach; mówcy numerowani od 0
+    w kolejności pierwszej wypowiedzi."""
+    start_time = time.perf_counter()
+    audio = load_pcm(pcm_path)
+    regions = speech_regions(audio)
+    vectors, spans = speaker_windows(audio, regions)
+    labels = cluster_speakers(vectors, max_speakers)
+
+    # Po dołączeniu małych klastrów etykiety nie muszą być ciągłe - numerujemy je od nowa
+    _, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    order = np.argsort(np.argsort(first))
+    labels = order[inverse] if len(labels) else labels
+
+    turns = []
+    for (start, end), speaker in zip(spans.tolist(), labels.tolist()):
+        if turns and turns[-1][2] == speaker and start - turns[-1][1] < TURN_MERGE_GAP:
+            turns[-1][1] = end
+        else:
+            turns.append([start, end, speaker])
+    print(f"Diarization: {len(regions)} speech regions, {len(vectors)} windows, "
+          f"{len(set(labels.tolist()))} speakers in {time.perf_counter() - start_time:.1f}s")
+    return [tuple(turn) for turn in turns]
+
+def diarize_async(pcm_path, max_speakers=DIARIZATION_MAX_SPEAKERS):
+    """Uruchamia diaryzację w tle (równolegle z transkrypcją). Zwraca Future z listą tur."""
+    return _executor.submit(diarize, pcm_path, max_speakers)
@@ -0,0 +1,64 @@
+import math
+import os
+
+# Szacowanie zadania przed pobraniem kredytu i przed dekodowaniem: długość nagrania z nagłówka
+# (ffprobe) albo z metadanych yt-dlp, czas przetwarzania z historycznego współczynnika czasu
+# rzeczywistego (RTF = czas zadania / długość nagrania) dla modelu i urządzenia.
+# Limity są opcjonalne (0 = brak): przy domyślnych RTF dla CPU i modelu large nawet półgodzinne
+# nagranie przetwarza się ok. 2 h, więc stały limit odrzucałby nagrania przyjmowane wcześniej
+MAX_MEDIA_MINUTES = float(os.getenv("MAX_MEDIA_MINUTES", 0))
+MAX_JOB_MINUTES = float(os.getenv("MAX_JOB_MINUTES", 0))  # Limit przewidywanego czasu przetwarzania
+# Model dla nagrań, które domyślnym modelem przekroczyłyby MAX_JOB_MINUTES (np. "medium"); brak = odrzucenie
+LONG_MEDIA_MODEL = os.getenv("LONG_MEDIA_MODEL")
+# Cena: jeden kredyt za każde rozpoczęte tyle minut nagrania; 0 = jeden kredyt za zadanie
+MEDIA_MINUTES_PER_CREDIT = float(os.getenv("MEDIA_MINUTES_PER_CREDIT", 0))
+RTF_HISTORY_JOBS = 50
+RTF_MIN_JOBS = 3  # Przy mniejszej liczbie zadań korzystamy z wartości domyślnych
+JOB_OVERHEAD_SECONDS = 30  # Analiza notatek i zapis nie zależą od długości nagrania
+
+# Przybliżone RTF całego zadania, zanim zbierzemy własne pomiary
+DEFAULT_RTF = {
+    "cuda": {"tiny": 0.03, "base": 0.04, "small": 0.08, "medium": 0.15, "large": 0.25},
+    "cpu": {"tiny": 0.15, "base": 0.3, "small": 0.8, "medium": 2.0, "large": 4.0},
+}
+
+def default_rtf(model, device):
+    rates = DEFAULT_RTF.get(device, DEFAULT_RTF["cuda"])
+    return rates.get(model.split(".")[0].split("-")[0], rates["large"])
+
+def historical_rtf(rtfs, model, device):
+    """Mediana RTF ostatnich zadań (odporna na pojedyncze zadania czekające w kolejce) albo wartość domyślna"""
+    if len(rtfs) < RTF_MIN_JOBS:
+        return default_rtf(model, device)
+    ordered = sorted(rtfs)
+    return ordered[len(ordered) // 2]
+
+def job_credits(media_seconds):
+    if not MEDIA_MINUTES_PER_CREDIT or not media_seconds:
+        return 1
+    return max(1, math.ceil(media_seconds / (MEDIA_MINUTES_PER_CREDIT * 60)))
+
+def estimate_job(media_seconds, model, device, rtf_lookup):
+    """Plan zadania dla nagrania o znanej (lub nieznanej: None) długości.
+    rtf_lookup(model, device) -> lista ostatnich RTF. Zwraca słownik z modelem, szacowanym czasem,
+    ceną w kredytach i powodem odrzucenia (None gdy zadanie może ruszyć)."""
+    estimate = {"media_seconds": media_seconds, "model": model, "routed": False, "seconds": None,
+                "credits": job_credits(media_seconds), "rejected": None}
+    if media_seconds is None:
+        return estimate
+    if MAX_MEDIA_MINUTES and media_seconds > MAX_MEDIA_MINUTES * 60:
+        estimate["rejected"] = f"The recording is {media_seconds / 60:.0f} minutes long. The maximum is {MAX_MEDIA_MINUTES:.0f} minutes."
+        return estimate
+
+    estimate["seconds"] = media_seconds * historical_rtf(rtf_lookup(model, device), model, device) + JOB_OVERHEAD_SECONDS
+    if not MAX_JOB_MINUTES:
+        return estimate
+    if estimate["seconds"] > MAX_JOB_MINUTES * 60 and LONG_MEDIA_MODEL and LONG_MEDIA_MODEL != model:
+        # Długie nagranie kierujemy do szybszego modelu zamiast je odrzucać
+        seconds = media_seconds * historical_rtf(rtf_lookup(LONG_MEDIA_MODEL, device), LONG_MEDIA_MODEL, device) + JOB_OVERHEAD_SECONDS
+        estimate.update(model=LONG_MEDIA_MODEL, routed=True, seconds=seconds)
+    if estimate["seconds"] > MAX_JOB_MINUTES * 60:
+        rtf = (estimate["seconds"] - JOB_OVERHEAD_SECONDS) / media_seconds
+        estimate["rejected"] = (f"Processing this recording would take about {estimate['seconds'] / 60:.0f} minutes. "
+                                f"Please use a recording shorter than {(MAX_JOB_MINUTES * 60 - JOB_OVERHEAD_SECONDS) / rtf / 60:.0f} minutes.")
+    return estimate
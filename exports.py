@@ -0,0 +1,103 @@
+import json
+import zipfile
+from xml.sax.saxutils import escape
+
+EXPORT_CHUNK_CHARS = 64 * 1024  # Długie transkrypcje generujemy kawałkami zamiast jednym dużym stringiem
+
+def _chunks(text):
+    text = text or ""
+    for start in range(0, len(text), EXPORT_CHUNK_CHARS):
+        yield text[start:start + EXPORT_CHUNK_CHARS]
+
+def _sections(transcription, notes, custom_notes=None, custom_prompt=None, notes_bundle=None):
+    yield "📌", "Transcription", transcription
+    yield "📝", "Notes", notes
+    if custom_notes:
+        yield "❓", "Custom prompt", custom_prompt
+        yield "🔎", "Custom analysis", custom_notes
+    if notes_bundle:
+        for language, text in notes_bundle["notes"].items():
+            yield "📝", f"Notes ({language})", text
+        for item in notes_bundle["custom"]:
+            yield "🔎", item["prompt"], item["result"]
+
+def iter_txt(transcription, notes, custom_notes=None, custom_prompt=None, notes_bundle=None):
+    for icon, title, text in _sections(transcription, notes, custom_notes, custom_prompt, notes_bundle):
+        yield f"{icon} **{title}:**\n"
+        yield from _chunks(text)
+        yield "\n\n"
+
+def iter_md(transcription, notes, custom_notes=None, custom_prompt=None, notes_bundle=None):
+    for _, title, text in _sections(transcription, notes, custom_notes, custom_prompt, notes_bundle):
+        yield f"## {title}\n\n"
+        yield from _chunks(text)
+        yield "\n\n"
+
+def iter_json(transcription, notes, custom_notes=None, custom_prompt=None, notes_bundle=None):
+    yield "{"
+    fields = {"transcription": transcription, "notes": notes, "custom_prompt": custom_prompt, "custom_notes": custom_notes}
+    for i, (key, text) in enumerate(fields.items()):
+        yield ("," if i else "") + json.dumps(key) + ":"
+        if text is None:
+            yield "null"
+            continue
+        # Każdy kawałek kodujemy osobno i sklejamy w jeden string JSON
+        yield '"'
+        for chunk in _chunks(text):
+            yield json.dumps(chunk, ensure_ascii=False)[1:-1]
+        yield '"'
+    # Pakiet notatek jest mały w porównaniu z transkrypcją - kodujemy go w całości
+    yield ',"notes_bundle":' + json.dumps(notes_bundle, ensure_ascii=False)
+    yield "}"
+
+_DOCX_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+</Types>"""
+
+_DOCX_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+
+def _docx_paragraph(text, bold=False):
+    properties = "<w:rPr><w:b/></w:rPr>" if bold else ""
+    return f'<w:p><w:r>{properties}<w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>'
+
+def _iter_docx_body(transcription, notes, custom_notes=None, custom_prompt=None, notes_bundle=None):
+    yield ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+           '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>')
+    for _, title, text in _sections(transcription, notes, custom_notes, custom_prompt, notes_bundle):
+        yield _docx_paragraph(title, bold=True)
+        for line in (text or "").splitlines():
+            yield _docx_paragraph(line)
+    yield "</w:body></w:document>"
+
+def write_docx(output, transcription, notes, custom_notes=None, custom_prompt=None, notes_bundle=None):
+    """Zapisuje minimalny dokument .docx do obiektu plikowego, strumieniując treść akapit po akapicie"""
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr("[Content_Types].xml", _DOCX_CONTENT_TYPES)
+        docx.writestr("_rels/.rels", _DOCX_RELS)
+        with docx.open("word/document.xml", "w") as document:
+            for part in _iter_docx_body(transcription, notes, custom_notes, custom_prompt, notes_bundle):
+                document.write(part.encode("utf-8"))
+
+EXPORT_FORMATS = {
+    "txt": ("Text (.txt)", "text/plain"),
+    "md": ("Markdown (.md)", "text/markdown"),
+    "docx": ("Word (.docx)", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+    "json": ("JSON (.json)", "application/json"),
+}
+
+_TEXT_EXPORTS = {"txt": iter_txt, "md": iter_md, "json": iter_json}
+
+def write_export(output, fmt, transcription, notes, custom_notes=None, custom_prompt=None, notes_bundle=None):
+    """Zapisuje plik do pobrania do obiektu plikowego. Zwraca typ MIME."""
+    if fmt == "docx":
+        write_docx(output, transcription, notes, custom_notes, custom_prompt, notes_bundle)
+    else:
+        for part in _TEXT_EXPORTS[fmt](transcription, notes, custom_notes, custom_prompt, notes_bundle):
+            output.write(part.encode("utf-8"))
+    return EXPORT_FORMATS[fmt][1]
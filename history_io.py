@@ -0,0 +1,179 @@
+import base64
+import gzip
+import io
+import json
+import re
+import struct
+import zipfile
+from datetime import datetime
+import numpy as np
+from exports import iter_md
+from segments import SegmentTable
+
+# Kopia całej historii użytkownika: JSON Lines skompresowany gzip (jeden rekord na linię)
+# albo ZIP z plikiem JSON i Markdown dla każdej transkrypcji. Oba formaty da się zaimportować.
+HISTORY_VERSION = 1
+HISTORY_FORMATS = {
+    "jsonl.gz": ("Compressed JSON Lines (.jsonl.gz)", "application/gzip"),
+    "zip": ("ZIP, one file per transcription (.zip)", "application/zip"),
+}
+HISTORY_IMPORT_TYPES = ["gz", "jsonl", "zip"]
+IMPORTED_TITLE = "Imported transcription"
+
+_SLUG = re.compile(r"[^\w-]+")
+
+class HistoryFormatError(ValueError):
+    pass
+
+def history_record(row):
+    """Rekord eksportu z wiersza iter_user_transcriptions"""
+    trans_id, title, created_at, transcription, notes, custom_notes, custom_prompt, notes_bundle, segments = row
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat(sep=" ")
+    return {
+        "version": HISTORY_VERSION,
+        "id": trans_id,
+        "title": title,
+        "created_at": created_at,
+        "transcription": transcription,
+        "notes": notes,
+        "custom_notes": custom_notes,
+        "custom_prompt": custom_prompt,
+        "notes_bundle": json.loads(notes_bundle) if notes_bundle else None,
+        "segments": base64.b64encode(segments).decode("ascii") if segments else None,
+    }
+
+def _entry_name(record):
+    slug = _SLUG.sub("_", record["title"] or "")[:60].strip("_") or "transcription"
+    return f"{record['id']:08d}_{slug}"
+
+def write_history(output, fmt, rows):
+    """Zapisuje historię do obiektu plikowego wiersz po wierszu. Zwraca liczbę transkrypcji."""
+    count = 0
+    if fmt == "jsonl.gz":
+        with gzip.GzipFile(fileobj=output, mode="wb", compresslevel=6) as archive:
+            for row in rows:
+                archive.write((json.dumps(history_record(row), ensure_ascii=False) + "\n").encode("utf-8"))
+                count += 1
+        return count
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as archive:
+        for row in rows:
+            record = history_record(row)
+            name = _entry_name(record)
+            archive.writestr(f"{name}.json", json.dumps(record, ensure_ascii=False, indent=1))
+            with archive.open(f"{name}.md", "w") as document:
+                document.write(f"# {record['title']}\n\n".encode("utf-8"))
+                for part in iter_md(record["transcription"], record["notes"], record["custom_notes"],
+                                    record["custom_prompt"], record["notes_bundle"]):
+                    document.write(part.encode("utf-8"))
+            count += 1
+    return count
+
+def _optional_text(data, key, where):
+    value = data.get(key)
+    if value is not None and not isinstance(value, str):
+        raise HistoryFormatError(f"{where}: field '{key}' must be text")
+    return value
+
+def _check_notes_bundle(bundle, where):
+    """Pakiet notatek musi mieć kształt czytany przez widok transkrypcji i eksporty"""
+    if bundle is None:
+        return
+    notes = bundle.get("notes") if isinstance(bundle, dict) else None
+    custom = bundle.get("custom") if isinstance(bundle, dict) else None
+    if not isinstance(notes, dict) or not isinstance(custom, list):
+        raise HistoryFormatError(f"{where}: invalid notes_bundle")
+    if not all(isinstance(language, str) and isinstance(text, str) for language, text in notes.items()):
+        raise HistoryFormatError(f"{where}: invalid notes_bundle notes")
+    for item in custom:
+        if (not isinstance(item, dict) or not isinstance(item.get("prompt"), str)
+                or not isinstance(item.get("result"), (str, type(None)))):
+            raise HistoryFormatError(f"{where}: invalid notes_bundle custom item")
+
+def _check_segments(segments, where):
+    """Dekoduje tabelę segmentów - długości kolumn i przesunięcia tekstu muszą zgadzać się z nagłówkiem"""
+    try:
+        table = SegmentTable.from_bytes(segments)
+        offsets = table.offsets.astype(np.int64)
+        if offsets[0] != 0 or offsets[-1] != len(table.text_blob) or np.any(np.diff(offsets) < 0):
+            raise ValueError("text offsets out of range")
+        for i in range(len(table)):
+            table.text(i)
+    except (ValueError, struct.error) as e:  # UnicodeDecodeError to też ValueError
+        raise HistoryFormatError(f"{where}: invalid segments ({e})")
+
+def import_record(data, where):
+    """Sprawdza rekord z pliku i zamienia go na pola dla import_transcriptions"""
+    if not isinstance(data, dict):
+        raise HistoryFormatError(f"{where}: expected a JSON object")
+    version = data.get("version", HISTORY_VERSION)
+    if not isinstance(version, int) or version > HISTORY_VERSION:
+        raise HistoryFormatError(f"{where}: unsupported export version {version!r}")
+    transcription = _optional_text(data, "transcription", where)
+    if not transcription:
+        raise HistoryFormatError(f"{where}: missing transcription")
+    created_at = _optional_text(data, "created_at", where)
+    if created_at:
+        try:
+            created_at = datetime.fromisoformat(created_at).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            raise HistoryFormatError(f"{where}: invalid created_at")
+    notes_bundle = data.get("notes_bundle")
+    _check_notes_bundle(notes_bundle, where)
+    segments = _optional_text(data, "segments", where)
+    if segments:
+        try:
+            segments = base64.b64decode(segments, validate=True)
+        except ValueError:
+            raise HistoryFormatError(f"{where}: invalid segments")
+        _check_segments(segments, where)
+    return {
+        "title": _optional_text(data, "title", where) or IMPORTED_TITLE,
+        "created_at": created_at or None,
+        "transcription": transcription,
+        "notes": _optional_text(data, "notes", where),
+        "custom_notes": _optional_text(data, "custom_notes", where),
+        "custom_prompt": _optional_text(data, "custom_prompt", where),
+        "notes_bundle": json.dumps(notes_bundle, ensure_ascii=False) if notes_bundle else None,
+        "segments": segments or None,
+    }
+
+class HistoryReader:
+    """Czyta rekordy z pliku eksportu (.jsonl.gz, .jsonl albo .zip) po jednym.
+    Błąd formatu przerywa iterację wyjątkiem HistoryFormatError; jego opis zostaje w .error."""
+
+    def __init__(self, fileobj, name):
+        self.fileobj = fileobj
+        self.name = name
+        self.error = None
+
+    def __iter__(self):
+        try:
+            yield from self._records()
+        except HistoryFormatError as e:
+            self.error = str(e)
+            raise
+        except (OSError, EOFError, UnicodeDecodeError, zipfile.BadZipFile) as e:
+            self.error = f"Cannot read {self.name}: {e}"
+            raise HistoryFormatError(self.error)
+
+    def _records(self):
+        if self.name.endswith(".zip"):
+            with zipfile.ZipFile(self.fileobj) as archive:
+                for info in archive.infolist():
+                    if info.filename.endswith(".json"):
+                        with archive.open(info) as f:
+                            yield import_record(self._parse(f.read(), info.filename), info.filename)
+            return
+        stream = gzip.GzipFile(fileobj=self.fileobj) if self.name.endswith(".gz") else self.fileobj
+        for number, line in enumerate(io.TextIOWrapper(stream, encoding="utf-8"), start=1):
+            if line.strip():
+                where = f"line {number}"
+                yield import_record(self._parse(line, where), where)
+
+    @staticmethod
+    def _parse(text, where):
+        try:
+            return json.loads(text)
+        except ValueError:
+            raise HistoryFormatError(f"{where}: invalid JSON")
@@ -0,0 +1,330 @@
+import argparse
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+import numpy as np
+from audio import PCM_SAMPLE_RATE, PCM_SUFFIX, load_pcm
+from scratch import SCRATCH_ROOT
+
+# Serwer modeli: osobny proces na węźle trzyma wagi whispera, a procesy aplikacji wysyłają mu
+# zlecenia przez gniazdo Unix. Dzięki temu liczba procesów Streamlit nie zależy od pamięci modeli.
+# Pliki audio przekazujemy ścieżką (serwer mapuje ten sam plik PCM), krótkie fragmenty jako tablice.
+MODEL_SERVER_SOCKET = os.getenv("MODEL_SERVER_SOCKET")  # Brak = modele ładowane w procesie aplikacji
+# Klucz jest wymagany: połączenie przesyła obiekty pickle, więc znajomość klucza oznacza wykonanie kodu
+# w serwerze. Musi być tajny i wspólny dla serwera i procesów aplikacji (np. `openssl rand -hex 32`).
+MODEL_SERVER_AUTHKEY = os.getenv("MODEL_SERVER_AUTHKEY", "").encode() or None
+# Ścieżki audio od klientów przyjmujemy tylko z tego katalogu (katalogi zadań aplikacji)
+MODEL_SERVER_AUDIO_ROOT = os.getenv("MODEL_SERVER_AUDIO_ROOT", SCRATCH_ROOT)
+# Instancja modelu obsługuje jedno zlecenie naraz (whisper podpina cache kluczy/wartości do modułów),
+# więc każdy worker ma własne kopie modeli. Drugi worker pozwala obsłużyć okna transmisji na żywo
+# w trakcie długiej transkrypcji kosztem drugiej kopii wag.
+MODEL_SERVER_WORKERS = int(os.getenv("MODEL_SERVER_WORKERS", 1))
+MODEL_SERVER_MAX_MODELS = int(os.getenv("MODEL_SERVER_MAX_MODELS", 3))  # Załadowane modele na workera (LRU)
+MODEL_SERVER_BATCH_SIZE = int(os.getenv("MODEL_SERVER_BATCH_SIZE", 16))
+MODEL_SERVER_BATCH_WAIT_SECONDS = 0.05  # Tyle czekamy na kolejne zlecenia, które można dołączyć do partii
+MODEL_SERVER_POLL_SECONDS = 0.5
+
+# Mniejsza liczba = wcześniej. Okna na żywo i wykrywanie języka są krótkie i ktoś na nie czeka.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_JOB = 1
+
+class ModelServerError(Exception):
+    pass
+
+class ModelServerUnavailable(ModelServerError):
+    pass
+
+class _Request:
+    def __init__(self, request_id, op, model, audio, options, priority):
+        self.id = request_id
+        self.op = op
+        self.model = model
+        self.audio = audio
+        self.options = options
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class ModelServer:
+    """Kolejka zleceń do modeli whispera. Wykrywanie języka dla wielu zleceń liczy się jedną partią
+    (jeden przebieg enkodera), transkrypcje wykonują się pojedynczo w kolejności priorytetu."""
+
+    def __init__(self, device=None, workers=MODEL_SERVER_WORKERS, max_models=MODEL_SERVER_MAX_MODELS,
+                 audio_root=MODEL_SERVER_AUDIO_ROOT):
+        if device is None:
+            import torch
+
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = device
+        self.max_models = max_models
+        self.audio_root = os.path.realpath(audio_root)
+        self._condition = threading.Condition()
+        self._sequence = itertools.count(1)
+        self._pending = []
+        self._running = {}
+        self._started = time.time()
+        self.metrics = {
+            "completed": 0,
+            "errors": 0,
+            "cancelled": 0,
+            "batches": 0,
+            "batched_requests": 0,
+            "total_wait_seconds": 0.0,
+            "total_run_seconds": 0.0,
+        }
+        self._workers = [
+            threading.Thread(target=self._work, args=(OrderedDict(),), daemon=True, name=f"model-worker-{i}")
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, op, model, audio, options=None, priority=PRIORITY_JOB):
+        request = _Request(next(self._sequence), op, model, audio, options or {}, priority)
+        with self._condition:
+            self._pending.append(request)
+            self._condition.notify_all()
+        return request
+
+    def cancel(self, request):
+        """Usuwa zlecenie z kolejki (np. klient się rozłączył). Rozpoczętego nie przerywa."""
+        with self._condition:
+            if request in self._pending:
+                self._pending.remove(request)
+                self.metrics["cancelled"] += 1
+                return True
+        return False
+
+    def _next_batch(self):
+        """Wybiera kolejne zlecenie; wykrywanie języka zbiera w partię z innymi dla tego samego modelu"""
+        while True:
+            while not self._pending:
+                self._condition.wait()
+            first = min(self._pending, key=lambda request: (request.priority, request.id))
+            if first.op != "detect_language":
+                batch = [first]
+                break
+            batch = sorted((request for request in self._pending
+                            if request.op == first.op and request.model == first.model),
+                           key=lambda request: request.id)[:MODEL_SERVER_BATCH_SIZE]
+            remaining = first.enqueued_at + MODEL_SERVER_BATCH_WAIT_SECONDS - time.monotonic()
+            if len(batch) >= MODEL_SERVER_BATCH_SIZE or remaining <= 0:
+                break
+            self._condition.wait(remaining)
+        now = time.monotonic()
+        for request in batch:
+            self._pending.remove(request)
+            self._running[request.id] = request
+            self.metrics["total_wait_seconds"] += now - request.enqueued_at
+        if len(batch) > 1:
+            self.metrics["batches"] += 1
+            self.metrics["batched_requests"] += len(batch)
+        return batch
+
+    def _model(self, models, name):
+        import whisper
+
+        if name in models:
+            models.move_to_end(name)
+            return models[name]
+        while len(models) >= self.max_models:
+            models.popitem(last=False)
+            if self.device == "cuda":
+                import torch
+
+                torch.cuda.empty_cache()
+        print(f"Loading Whisper model {name} on {self.device}...")
+        models[name] = whisper.load_model(name, device=self.device)
+        return models[name]
+
+    def _work(self, models):
+        while True:
+            with self._condition:
+                batch = self._next_batch()
+            start = time.monotonic()
+            try:
+                model = self._model(models, batch[0].model)
+                if batch[0].op == "detect_language":
+                    results = self._detect_language(model, batch)
+                else:
+                    results = [self._transcribe(model, batch[0])]
+                errors = [None] * len(batch)
+            except Exception as e:
+                print(f"Model server error ({batch[0].op}, {batch[0].model}): {e}")
+                results, errors = [None] * len(batch), [str(e)] * len(batch)
+            with self._condition:
+                self.metrics["total_run_seconds"] += time.monotonic() - start
+                for request, result, error in zip(batch, results, errors):
+                    self._running.pop(request.id, None)
+                    request.result, request.error = result, error
+                    self.metrics["errors" if error else "completed"] += 1
+                    request.done.set()
+
+    def _detect_language(self, model, batch):
+        import torch
+        import whisper
+
+        mel = torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(np.asarray(request.audio, dtype=np.float32)),
+                                        n_mels=model.dims.n_mels)
+            for request in batch
+        ]).to(model.device)
+        _, probabilities = model.detect_language(mel)
+        return probabilities
+
+    def _transcribe(self, model, request):
+        audio = request.audio
+        if isinstance(audio, str) and audio.endswith(PCM_SUFFIX):
+            audio = load_pcm(audio)
+        result = model.transcribe(audio, fp16=self.device == "cuda", **request.options)
+        # Tokeny segmentów nie są potrzebne aplikacji, a zwiększają odpowiedź kilkukrotnie
+        segments = [{key: value for key, value in segment.items() if key != "tokens"} for segment in result.get("segments", [])]
+        return {"text": result.get("text", ""), "segments": segments, "language": result.get("language")}
+
+    def stats(self):
+        with self._condition:
+            queued = {}
+            for request in self._pending:
+                key = f"{request.op}:{request.model}"
+                queued[key] = queued.get(key, 0) + 1
+            finished = self.metrics["completed"] + self.metrics["errors"]
+            return {
+                "device": self.device,
+                "workers": len(self._workers),
+                "queue_depth": len(self._pending),
+                "queued": queued,
+                "running": len(self._running),
+                "oldest_wait_seconds": round(time.monotonic() - min(r.enqueued_at for r in self._pending), 1) if self._pending else 0.0,
+                "avg_wait_seconds": round(self.metrics["total_wait_seconds"] / finished, 2) if finished else None,
+                "uptime_seconds": round(time.time() - self._started),
+                **{key: round(value, 1) if isinstance(value, float) else value for key, value in self.metrics.items()},
+            }
+
+    def _audio_error(self, audio):
+        """Powód odrzucenia ścieżki audio od klienta albo None. Tablice próbek przyjmujemy bez sprawdzania."""
+        if not isinstance(audio, str):
+            return None
+        path = os.path.realpath(audio)
+        if not path.endswith(PCM_SUFFIX) or os.path.commonpath([path, self.audio_root]) != self.audio_root:
+            return f"Audio path must be a {PCM_SUFFIX} file inside {self.audio_root}"
+        return None
+
+    def _handle(self, conn):
+        """Obsługuje połączenie klienta: zlecenie -> odpowiedź, aż klient się rozłączy"""
+        try:
+            while True:
+                message = conn.recv()
+                if message["op"] == "stats":
+                    conn.send({"ok": True, "result": self.stats()})
+                    continue
+                error = self._audio_error(message["audio"])
+                if error:
+                    conn.send({"ok": False, "error": error})
+                    continue
+                priority = PRIORITY_INTERACTIVE if message.get("interactive") else PRIORITY_JOB
+                request = self.submit(message["op"], message["model"], message["audio"], message.get("options"), priority)
+                while not request.done.wait(MODEL_SERVER_POLL_SECONDS):
+                    # Klient nie wysyła nic w trakcie czekania - dane na gnieździe oznaczają rozłączenie
+                    if conn.poll():
+                        self.cancel(request)
+                        return
+                if request.error:
+                    conn.send({"ok": False, "error": request.error})
+                else:
+                    conn.send({"ok": True, "result": request.result})
+        except (EOFError, ConnectionError):
+            pass
+        except Exception as e:
+            print(f"Model server connection error: {e}")
+        finally:
+            conn.close()
+
+    def serve(self, address=MODEL_SERVER_SOCKET, authkey=MODEL_SERVER_AUTHKEY):
+        if not authkey:
+            raise ModelServerError("MODEL_SERVER_AUTHKEY is not set")
+        if os.path.exists(address):
+            os.unlink(address)  # Gniazdo po poprzednim procesie
+        with Listener(address, family="AF_UNIX", authkey=authkey) as listener:
+            os.chmod(address, 0o660)
+            print(f"Model server listening on {address} ({self.device}, {len(self._workers)} worker(s))")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    # Np. klient z błędnym kluczem - nie zatrzymujemy serwera
+                    print(f"Model server rejected connection: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True, name="model-client").start()
+
+class ModelClient:
+    """Klient serwera modeli. Każde wywołanie używa osobnego połączenia, więc klient jest bezpieczny dla wątków."""
+
+    def __init__(self, address=MODEL_SERVER_SOCKET, authkey=MODEL_SERVER_AUTHKEY):
+        self.address = address
+        self.authkey = authkey
+
+    def _call(self, message):
+        if not self.authkey:
+            raise ModelServerUnavailable("MODEL_SERVER_AUTHKEY is not set")
+        try:
+            conn = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+        except (OSError, EOFError, AuthenticationError) as e:
+            raise ModelServerUnavailable(f"Model server at {self.address} is not available: {e}")
+        try:
+            conn.send(message)
+            reply = conn.recv()
+        except (EOFError, OSError) as e:
+            raise ModelServerUnavailable(f"Model server connection lost: {e}")
+        finally:
+            conn.close()
+        if not reply["ok"]:
+            raise ModelServerError(reply["error"])
+        return reply["result"]
+
+    @staticmethod
+    def _audio(audio):
+        # Ścieżkę wysyłamy bez zmian (serwer czyta ten sam plik), tablice - w tym fragmenty mapy PCM - jako dane
+        return audio if isinstance(audio, str) else np.asarray(audio, dtype=np.float32)
+
+    def transcribe(self, model, audio, interactive=False, **options):
+        """Jak whisper model.transcribe: zwraca {"text", "segments", "language"}"""
+        return self._call({"op": "transcribe", "model": model, "audio": self._audio(audio),
+                           "options": options, "interactive": interactive})
+
+    def detect_language(self, model, audio):
+        """Prawdopodobieństwa języków dla pierwszych 30 s audio"""
+        return self._call({"op": "detect_language", "model": model, "audio": self._audio(audio), "interactive": True})
+
+    def stats(self):
+        return self._call({"op": "stats"})
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared Whisper model server for app processes on this node")
+    parser.add_argument("--socket", default=MODEL_SERVER_SOCKET, help="Unix socket path (default: MODEL_SERVER_SOCKET)")
+    parser.add_argument("--device", help="cuda or cpu (default: cuda when available)")
+    parser.add_argument("--workers", type=int, default=MODEL_SERVER_WORKERS)
+    parser.add_argument("--preload", nargs="*", default=[], help="Models to load before accepting requests")
+    parser.add_argument("--audio-root", default=MODEL_SERVER_AUDIO_ROOT,
+                        help="Only audio files inside this directory are accepted (default: the app scratch directory)")
+    args = parser.parse_args()
+    if not args.socket:
+        parser.error("--socket or MODEL_SERVER_SOCKET is required")
+    if not MODEL_SERVER_AUTHKEY:
+        parser.error("MODEL_SERVER_AUTHKEY must be set to a secret shared with the app processes")
+
+    server = ModelServer(args.device, args.workers, audio_root=args.audio_root)
+    # Każdy worker ładuje modele dla siebie - rozgrzewamy je krótkim zleceniem
+    silence = np.zeros(PCM_SAMPLE_RATE, dtype=np.float32)
+    for model in args.preload:
+        for request in [server.submit("transcribe", model, silence) for _ in range(args.workers)]:
+            request.done.wait()
+    server.serve(args.socket)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import argparse
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import stripe
+from database import get_payment, record_payment
+
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
+STRIPE_WEBHOOK_PORT = int(os.getenv("STRIPE_WEBHOOK_PORT", 8502))
+STRIPE_WEBHOOK_PATH = "/stripe/webhook"
+# Uzgadnianie: opłacone sesje z ostatnich godzin, których nikt nie zaksięgował (użytkownik zamknął
+# kartę przed powrotem, webhook nie dotarł). Księgowanie jest idempotentne, więc może działać
+# w każdym procesie aplikacji równolegle z webhookiem.
+PAYMENT_RECONCILE_INTERVAL_SECONDS = int(os.getenv("PAYMENT_RECONCILE_INTERVAL_SECONDS", 300))
+PAYMENT_RECONCILE_HOURS = int(os.getenv("PAYMENT_RECONCILE_HOURS", 24))
+
+_reconciler = None
+_reconciler_lock = threading.Lock()
+
+def process_checkout_session(session, expected_user_id=None):
+    """Księguje opłaconą sesję checkout. Zwraca True jeśli kredyty są zaksięgowane (teraz lub wcześniej)."""
+    # Sesja może być obiektem Stripe albo zwykłym słownikiem (webhook, stub w testach)
+    if session.get("payment_status") != "paid":
+        return False
+
+    client_reference_id = session.get("client_reference_id")
+    if not client_reference_id:
+        return False
+    user_id = int(client_reference_id)
+    if expected_user_id is not None and user_id != int(expected_user_id):
+        return False
+
+    metadata = session.get("metadata") or {}
+    credits_to_add = int(metadata.get("credits", 30))  # Domyślnie 30 jeśli nie znaleziono
+    if not record_payment(session["id"], user_id, credits_to_add):
+        print(f"Payment {session['id']} already processed")
+    return True
+
+def confirm_payment(session_id, user_id):
+    """Potwierdza płatność po powrocie z checkout. Znane sesje są obsługiwane bez zapytania do Stripe."""
+    payment = get_payment(session_id)
+    if payment:
+        return payment[1] == int(user_id)
+
+    session = stripe.checkout.Session.retrieve(session_id)
+    return process_checkout_session(session, expected_user_id=user_id)
+
+def handle_stripe_event(event):
+    """Obsługuje zdarzenie Stripe. Zwraca True jeśli zdarzenie zostało zaksięgowane."""
+    if event["type"] not in ("checkout.session.completed", "checkout.session.async_payment_succeeded"):
+        return False
+    return process_checkout_session(event["data"]["object"])
+
+def handle_stripe_webhook(payload, sig_header, webhook_secret=None):
+    """Weryfikuje podpis webhooka Stripe i przetwarza zdarzenie"""
+    event = stripe.Webhook.construct_event(payload, sig_header, webhook_secret or STRIPE_WEBHOOK_SECRET)
+    return handle_stripe_event(event)
+
+def reconcile_checkout_sessions(hours=PAYMENT_RECONCILE_HOURS):
+    """Księguje opłacone sesje checkout z ostatnich `hours` godzin, których nie ma w tabeli payments.
+    Zwraca liczbę nowo zaksięgowanych sesji."""
+    since = int(time.time() - hours * 3600)
+    credited = 0
+    sessions = stripe.checkout.Session.list(created={"gte": since}, status="complete", limit=100)
+    for session in sessions.auto_paging_iter():
+        if session.get("payment_status") != "paid" or get_payment(session["id"]):
+            continue
+        if process_checkout_session(session):
+            print(f"Reconciled payment {session['id']}")
+            credited += 1
+    return credited
+
+def start_reconciler(interval=PAYMENT_RECONCILE_INTERVAL_SECONDS):
+    """Uruchamia (raz na proces) wątek okresowo uzgadniający płatności ze Stripe"""
+    global _reconciler
+    if not stripe.api_key or interval <= 0:
+        return
+    with _reconciler_lock:
+        if _reconciler and _reconciler.is_alive():
+            return
+        _reconciler = threading.Thread(target=_reconcile_loop, args=(interval,), daemon=True, name="payment-reconciler")
+        _reconciler.start()
+
+def _reconcile_loop(interval):
+    while True:
+        try:
+            reconcile_checkout_sessions()
+        except Exception as e:
+            print(f"Payment reconciliation error: {e}")
+        time.sleep(interval)
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path.split("?")[0] != STRIPE_WEBHOOK_PATH:
+            self._reply(404)
+            return
+        payload = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        try:
+            handle_stripe_webhook(payload, self.headers.get("Stripe-Signature"))
+        except (ValueError, stripe.SignatureVerificationError) as e:
+            print(f"Rejected Stripe webhook: {e}")
+            self._reply(400)
+            return
+        except Exception as e:
+            # 500 - Stripe ponowi zdarzenie później
+            print(f"Error handling Stripe webhook: {e}")
+            self._reply(500)
+            return
+        self._reply(200)
+
+    def _reply(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+def main():
+    parser = argparse.ArgumentParser(description="Stripe webhook endpoint crediting paid checkout sessions")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=STRIPE_WEBHOOK_PORT)
+    args = parser.parse_args()
+    if not STRIPE_WEBHOOK_SECRET:
+        parser.error("STRIPE_WEBHOOK_SECRET must be set to the endpoint's signing secret")
+    server = ThreadingHTTPServer((args.host, args.port), _WebhookHandler)
+    print(f"Stripe webhook listening on {args.host}:{args.port}{STRIPE_WEBHOOK_PATH}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import contextmanager, nullcontext
+
+# Profile zadań (cProfile, ślady torch, czasy zapytań) zapisujemy poza katalogiem zadania,
+# żeby były dostępne do pobrania także po jego usunięciu
+PROFILE_ROOT = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "transcription_app", "profiles"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", 50))  # Ile ostatnich profili trzymamy na dysku
+PROFILE_TOP_FUNCTIONS = 40
+
+_enabled = os.getenv("PROFILING", "").lower() in ("1", "true", "yes")
+_local = threading.local()
+_lock = threading.Lock()
+# W procesie działa naraz tylko jeden cProfile (od Pythona 3.12 drugi rzuca "Another profiling tool
+# is already active"). Etapy innych zadań lub zagnieżdżone etapy, które go nie dostaną, są tylko mierzone.
+_profiler_lock = threading.Lock()
+_function_stats = {}
+
+def is_enabled():
+    return _enabled
+
+def set_enabled(enabled):
+    """Włącza/wyłącza profilowanie w działającym procesie (przełącznik w panelu admina)"""
+    global _enabled
+    _enabled = bool(enabled)
+
+class JobProfile:
+    """Profil jednego zadania: etapy pod cProfile, ślady torch i czasy funkcji bazy danych"""
+
+    def __init__(self, job_id, user_id=None):
+        self.id = job_id
+        self.user_id = user_id
+        self.dir = os.path.join(PROFILE_ROOT, job_id)
+        self.started = time.time()
+        self.stages = {}
+        self.calls = {}
+        self.skipped = []  # Etapy tylko zmierzone (cProfile zajęty przez inne zadanie)
+        os.makedirs(self.dir, exist_ok=True)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        profiler = self._start_profiler()
+        try:
+            yield
+        finally:
+            self.stages[name] = round(time.perf_counter() - start, 4)
+            if profiler:
+                profiler.disable()
+                _profiler_lock.release()
+                self._save_stage(name, profiler)
+            else:
+                self.skipped.append(name)
+
+    def _save_stage(self, name, profiler):
+        try:
+            profiler.dump_stats(os.path.join(self.dir, f"{name}.prof"))
+            with open(os.path.join(self.dir, f"{name}.txt"), "w") as f:
+                pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+        except Exception as e:
+            print(f"Error saving profile for stage {name}: {e}")
+
+    @staticmethod
+    def _start_profiler():
+        """Włączony cProfile albo None, gdy w procesie działa już inny profiler"""
+        if not _profiler_lock.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # Profiler spoza tego modułu (np. debugger, sys.monitoring)
+            _profiler_lock.release()
+            print(f"Profiling unavailable: {e}")
+            return None
+        return profiler
+
+    @contextmanager
+    def torch_trace(self, name):
+        try:
+            import torch
+            from torch.profiler import profile, ProfilerActivity
+        except ImportError:
+            yield
+            return
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        with profile(activities=activities) as trace:
+            yield
+        try:
+            trace.export_chrome_trace(os.path.join(self.dir, f"{name}.trace.json"))
+            with open(os.path.join(self.dir, f"{name}.torch.txt"), "w") as f:
+                f.write(trace.key_averages().table(sort_by="self_cpu_time_total", row_limit=30))
+        except Exception as e:
+            print(f"Error saving torch trace for {name}: {e}")
+
+    def record_call(self, name, seconds):
+        count, total = self.calls.get(name, (0, 0.0))
+        self.calls[name] = (count + 1, total + seconds)
+
+    def finish(self):
+        if getattr(_local, "profile", None) is self:
+            _local.profile = None
+        summary = {
+            "job_id": self.id,
+            "user_id": self.user_id,
+            "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+            "stages": self.stages,
+            "unprofiled_stages": self.skipped,
+            "db_calls": {name: {"count": count, "seconds": round(total, 4)} for name, (count, total) in self.calls.items()},
+        }
+        with open(os.path.join(self.dir, "summary.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+        _prune_profiles()
+
+class _DisabledProfile:
+    """Profil-atrapa: przy wyłączonym profilowaniu każdy hook to pusty context manager"""
+    id = None
+
+    def stage(self, name):
+        return nullcontext()
+
+    def torch_trace(self, name):
+        return nullcontext()
+
+    def record_call(self, name, seconds):
+        pass
+
+    def finish(self):
+        pass
+
+DISABLED_PROFILE = _DisabledProfile()
+
+def start_job_profile(job_id, user_id=None):
+    """Rozpoczyna profil zadania w bieżącym wątku (albo zwraca atrapę, gdy profilowanie jest wyłączone)"""
+    if not _enabled:
+        return DISABLED_PROFILE
+    profile = JobProfile(job_id, user_id)
+    _local.profile = profile
+    return profile
+
+def current_profile():
+    return getattr(_local, "profile", None) or DISABLED_PROFILE
+
+def profiled(fn):
+    """Mierzy czas funkcji (np. zapytań do bazy), gdy profilowanie jest włączone"""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return fn(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            current_profile().record_call(name, seconds)
+            with _lock:
+                count, total, worst = _function_stats.get(name, (0, 0.0, 0.0))
+                _function_stats[name] = (count + 1, total + seconds, max(worst, seconds))
+    return wrapper
+
+def function_stats():
+    """Czasy profilowanych funkcji od włączenia profilowania, od najdłuższego łącznego czasu"""
+    with _lock:
+        items = sorted(_function_stats.items(), key=lambda item: item[1][1], reverse=True)
+    return [
+        {"function": name, "calls": count, "total_ms": round(total * 1000, 1),
+         "avg_ms": round(total / count * 1000, 2), "max_ms": round(worst * 1000, 1)}
+        for name, (count, total, worst) in items
+    ]
+
+def list_profiles():
+    """Zapisane profile zadań, od najnowszego: (job_id, podsumowanie)"""
+    if not os.path.isdir(PROFILE_ROOT):
+        return []
+    profiles = []
+    for entry in sorted(os.scandir(PROFILE_ROOT), key=lambda entry: entry.stat().st_mtime, reverse=True):
+        try:
+            with open(os.path.join(entry.path, "summary.json")) as f:
+                profiles.append((entry.name, json.load(f)))
+        except (FileNotFoundError, NotADirectoryError, ValueError):
+            continue
+    return profiles
+
+def profile_archive(job_id):
+    """Pakuje pliki profilu zadania do archiwum zip w pamięci"""
+    directory = os.path.join(PROFILE_ROOT, os.path.basename(job_id))
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name in sorted(os.listdir(directory)):
+            archive.write(os.path.join(directory, name), arcname=f"{job_id}/{name}")
+    return output.getvalue()
+
+def _prune_profiles():
+    entries = [entry for entry in os.scandir(PROFILE_ROOT) if entry.is_dir(follow_symlinks=False)]
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[PROFILE_KEEP:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
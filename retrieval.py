@@ -0,0 +1,84 @@
+import os
+import numpy as np
+import openai
+from database import get_transcription_embeddings, save_transcription_embeddings
+
+# Konfiguracja wyszukiwania semantycznego we fragmentach transkrypcji
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_BATCH_SIZE = 256  # Liczba fragmentów w jednym zapytaniu do API
+CHUNK_WORDS = 200
+CHUNK_OVERLAP = 40
+RETRIEVAL_MIN_WORDS = int(os.getenv("RETRIEVAL_MIN_WORDS", 3000))  # Krótsze transkrypcje wysyłamy w całości
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 8))
+
+def chunk_transcript(transcription, chunk_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    """Dzieli transkrypcję na zachodzące na siebie fragmenty po chunk_words słów"""
+    words = transcription.split()
+    if not words:
+        return []
+    step = chunk_words - overlap
+    return [" ".join(words[i:i + chunk_words]) for i in range(0, max(len(words) - overlap, 1), step)]
+
+def openai_embedder(texts):
+    """Zwraca macierz embeddingów (float32) dla listy tekstów, wysyłając je paczkami"""
+    client = openai.OpenAI()
+    vectors = []
+    for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        response = client.embeddings.create(model=EMBEDDING_MODEL, input=texts[start:start + EMBEDDING_BATCH_SIZE])
+        vectors.extend(item.embedding for item in response.data)
+    return np.asarray(vectors, dtype=np.float32)
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def build_index(chunks, embed_fn=openai_embedder):
+    """Buduje znormalizowaną macierz embeddingów fragmentów w formacie float16"""
+    vectors = np.asarray(embed_fn(chunks), dtype=np.float32)
+    return _normalize(vectors).astype(np.float16)
+
+def top_k(vectors, query_vector, k=RETRIEVAL_TOP_K):
+    """Zwraca indeksy k fragmentów najbardziej podobnych (cosinus) do zapytania, od najlepszego"""
+    query = _normalize(np.asarray(query_vector, dtype=np.float32))
+    scores = vectors.astype(np.float32) @ query
+    k = min(k, len(scores))
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best])]
+
+def index_transcription(trans_id, transcription, embed_fn=openai_embedder):
+    """Buduje i zapisuje indeks fragmentów dla długiej transkrypcji. Zwraca macierz lub None."""
+    chunks = chunk_transcript(transcription)
+    if len(transcription.split()) < RETRIEVAL_MIN_WORDS or not chunks:
+        return None
+    vectors = build_index(chunks, embed_fn)
+    save_transcription_embeddings(trans_id, EMBEDDING_MODEL, vectors.shape[1], CHUNK_WORDS, CHUNK_OVERLAP, vectors.tobytes())
+    return vectors
+
+def load_index(trans_id, user_id):
+    """Wczytuje zapisany indeks fragmentów (None jeśli brak lub zbudowany innymi parametrami)"""
+    row = get_transcription_embeddings(trans_id, user_id)
+    if not row:
+        return None
+    model, dim, chunk_words, chunk_overlap, blob = row
+    if model != EMBEDDING_MODEL or chunk_words != CHUNK_WORDS or chunk_overlap != CHUNK_OVERLAP:
+        return None
+    return np.frombuffer(bytes(blob), dtype=np.float16).reshape(-1, dim)
+
+def relevant_context(transcription, query, trans_id=None, user_id=None, embed_fn=openai_embedder, k=RETRIEVAL_TOP_K):
+    """Zwraca fragmenty transkrypcji istotne dla pytania albo całą transkrypcję, jeśli jest krótka"""
+    if len(transcription.split()) < RETRIEVAL_MIN_WORDS:
+        return transcription
+
+    chunks = chunk_transcript(transcription)
+    vectors = load_index(trans_id, user_id) if trans_id else None
+    if vectors is None or len(vectors) != len(chunks):
+        if trans_id:
+            vectors = index_transcription(trans_id, transcription, embed_fn)
+        else:
+            vectors = build_index(chunks, embed_fn)
+
+    query_vector = np.asarray(embed_fn([query]), dtype=np.float32)[0]
+    # Fragmenty w kolejności chronologicznej, aby model widział przebieg rozmowy
+    selected = sorted(top_k(vectors, query_vector, k))
+    return "\n[...]\n".join(chunks[i] for i in selected)
@@ -0,0 +1,194 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+
+# Wspólny katalog roboczy dla plików zadań (pobrane media, PCM, podsumowania)
+SCRATCH_ROOT = os.getenv("SCRATCH_DIR", os.path.join(tempfile.gettempdir(), "transcription_app", "jobs"))
+SCRATCH_QUOTA_MB = int(os.getenv("SCRATCH_QUOTA_MB", 10 * 1024))
+SCRATCH_ORPHAN_SECONDS = int(os.getenv("SCRATCH_ORPHAN_SECONDS", 6 * 60 * 60))  # Brak heartbeat dłużej = sierota
+SCRATCH_JANITOR_INTERVAL_SECONDS = int(os.getenv("SCRATCH_JANITOR_INTERVAL_SECONDS", 300))
+SCRATCH_WAIT_SECONDS = 120  # Jak długo nowe zadanie czeka na miejsce na dysku
+
+OWNER_FILE = ".owner"
+
+class ScratchQuotaExceeded(Exception):
+    pass
+
+def _dir_size(path):
+    total = 0
+    for entry in os.scandir(path):
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                total += _dir_size(entry.path)
+            else:
+                total += entry.stat(follow_symlinks=False).st_size
+        except FileNotFoundError:
+            pass
+    return total
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class ScratchJob:
+    """Katalog roboczy jednego zadania"""
+
+    def __init__(self, manager, job_id, path):
+        self.manager = manager
+        self.id = job_id
+        self.dir = path
+
+    def touch(self):
+        """Odświeża heartbeat, aby janitor nie uznał katalogu za porzucony"""
+        try:
+            os.utime(os.path.join(self.dir, OWNER_FILE))
+        except FileNotFoundError:
+            pass
+
+    def release(self):
+        self.manager.release(self.id)
+
+class ScratchManager:
+    """Zarządza katalogami zadań: limit miejsca z oczekiwaniem, sprzątanie sierot i metryki"""
+
+    def __init__(self, root=SCRATCH_ROOT, quota_bytes=SCRATCH_QUOTA_MB * 1024 * 1024,
+                 orphan_seconds=SCRATCH_ORPHAN_SECONDS):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.orphan_seconds = orphan_seconds
+        self._condition = threading.Condition()
+        self._jobs = {}
+        self._janitor = None
+        self.metrics = {
+            "jobs_created": 0,
+            "jobs_released": 0,
+            "orphans_removed": 0,
+            "bytes_removed": 0,
+            "quota_waits": 0,
+            "quota_rejections": 0,
+        }
+        os.makedirs(self.root, exist_ok=True)
+
+    def usage_bytes(self):
+        return _dir_size(self.root)
+
+    def create_job(self, timeout=SCRATCH_WAIT_SECONDS, on_wait=None):
+        """Tworzy katalog zadania. Gdy limit miejsca jest przekroczony, czeka aż inne zadania zwolnią miejsce."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            waited = False
+            while self.usage_bytes() >= self.quota_bytes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.metrics["quota_rejections"] += 1
+                    raise ScratchQuotaExceeded("Scratch disk quota exceeded")
+                if not waited:
+                    waited = True
+                    self.metrics["quota_waits"] += 1
+                    if on_wait:
+                        on_wait()
+                # Budzi nas release(); co kilka sekund sprawdzamy też zadania innych procesów
+                self._condition.wait(min(remaining, 5))
+
+            job_id = uuid.uuid4().hex
+            path = os.path.join(self.root, job_id)
+            os.makedirs(path)
+            with open(os.path.join(path, OWNER_FILE), "w") as f:
+                f.write(f"{socket.gethostname()} {os.getpid()}")
+            self._jobs[job_id] = path
+            self.metrics["jobs_created"] += 1
+        return ScratchJob(self, job_id, path)
+
+    def get_job(self, job_id):
+        if not job_id:
+            return None
+        path = os.path.join(self.root, job_id)
+        if not os.path.isdir(path):
+            return None
+        return ScratchJob(self, job_id, path)
+
+    def release(self, job_id):
+        """Usuwa katalog zadania wraz z zawartością"""
+        path = os.path.join(self.root, job_id)
+        size = _dir_size(path) if os.path.isdir(path) else 0
+        shutil.rmtree(path, ignore_errors=True)
+        with self._condition:
+            self._jobs.pop(job_id, None)
+            self.metrics["jobs_released"] += 1
+            self.metrics["bytes_removed"] += size
+            self._condition.notify_all()
+
+    def _is_orphan(self, path, now):
+        owner_path = os.path.join(path, OWNER_FILE)
+        try:
+            with open(owner_path) as f:
+                hostname, pid = f.read().split()
+            heartbeat = os.path.getmtime(owner_path)
+        except (FileNotFoundError, ValueError):
+            # Katalog bez właściciela - sprawdzamy tylko wiek
+            return now - os.path.getmtime(path) > self.orphan_seconds
+        if hostname == socket.gethostname() and not _pid_alive(int(pid)):
+            return True  # Proces właściciela nie żyje (np. crash przed blokiem finally)
+        return now - heartbeat > self.orphan_seconds
+
+    def sweep(self):
+        """Usuwa katalogi porzucone przez zakończone procesy lub bez heartbeat. Zwraca liczbę usuniętych."""
+        removed = 0
+        now = time.time()
+        for entry in os.scandir(self.root):
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            try:
+                if self._is_orphan(entry.path, now):
+                    size = _dir_size(entry.path)
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    removed += 1
+                    with self._condition:
+                        self._jobs.pop(entry.name, None)
+                        self.metrics["orphans_removed"] += 1
+                        self.metrics["bytes_removed"] += size
+            except FileNotFoundError:
+                continue
+        if removed:
+            with self._condition:
+                self._condition.notify_all()
+            print(f"Scratch janitor removed {removed} orphaned job directories")
+        return removed
+
+    def start_janitor(self, interval=SCRATCH_JANITOR_INTERVAL_SECONDS):
+        """Uruchamia (raz na proces) wątek okresowo sprzątający porzucone katalogi"""
+        with self._condition:
+            if self._janitor and self._janitor.is_alive():
+                return
+            self._janitor = threading.Thread(target=self._janitor_loop, args=(interval,), daemon=True, name="scratch-janitor")
+            self._janitor.start()
+
+    def _janitor_loop(self, interval):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Scratch janitor error: {e}")
+            time.sleep(interval)
+
+    def stats(self):
+        usage = self.usage_bytes()
+        with self._condition:
+            return {
+                "usage_bytes": usage,
+                "quota_bytes": self.quota_bytes,
+                "usage_ratio": round(usage / self.quota_bytes, 4) if self.quota_bytes else None,
+                "active_jobs": len(self._jobs),
+                **self.metrics,
+            }
+
+scratch_manager = ScratchManager()
@@ -0,0 +1,227 @@
+import json
+import struct
+import numpy as np
+
+# Format binarny: nagłówek (magic, liczba segmentów), kolumny float32
+# start/end/avg_logprob/no_speech_prob, mówca int16 (-1 = nieznany, wyrównany do 4 bajtów),
+# przesunięcia tekstu uint32 (n + 1) i tekst UTF-8. SEG1 to starszy format bez kolumny mówcy.
+SEGMENTS_MAGIC = b"SEG2"
+SEGMENTS_MAGIC_V1 = b"SEG1"
+_HEADER = struct.Struct("<4sI")
+_FLOAT_COLUMNS = ("start", "end", "avg_logprob", "no_speech_prob")
+NO_SPEAKER = -1
+
+class SegmentTable:
+    """Kolumnowa tabela segmentów transkrypcji z czasami i pewnością rozpoznania"""
+
+    def __init__(self, start, end, avg_logprob, no_speech_prob, offsets, text_blob, speaker=None):
+        self.start = start
+        self.end = end
+        self.avg_logprob = avg_logprob
+        self.no_speech_prob = no_speech_prob
+        self.offsets = offsets
+        self.text_blob = text_blob
+        self.speaker = speaker if speaker is not None else np.full(len(start), NO_SPEAKER, dtype=np.int16)
+
+    @classmethod
+    def from_whisper(cls, segments):
+        """Tworzy tabelę z listy segmentów zwróconej przez whisper (result['segments'])"""
+        encoded = [segment["text"].strip().encode("utf-8") for segment in segments]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+        np.cumsum([len(text) for text in encoded], out=offsets[1:])
+        return cls(
+            np.array([segment["start"] for segment in segments], dtype=np.float32),
+            np.array([segment["end"] for segment in segments], dtype=np.float32),
+            np.array([segment.get("avg_logprob", 0.0) for segment in segments], dtype=np.float32),
+            np.array([segment.get("no_speech_prob", 0.0) for segment in segments], dtype=np.float32),
+            offsets,
+            b"".join(encoded),
+            np.array([segment.get("speaker", NO_SPEAKER) for segment in segments], dtype=np.int16),
+        )
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        magic, count = _HEADER.unpack_from(data)
+        if magic not in (SEGMENTS_MAGIC, SEGMENTS_MAGIC_V1):
+            raise ValueError("Unsupported segments format")
+        position = _HEADER.size
+        columns = []
+        for _ in _FLOAT_COLUMNS:
+            columns.append(np.frombuffer(data, dtype=np.float32, count=count, offset=position))
+            position += 4 * count
+        speaker = None
+        if magic == SEGMENTS_MAGIC:
+            speaker = np.frombuffer(data, dtype=np.int16, count=count, offset=position)
+            position += _speaker_column_size(count)
+        offsets = np.frombuffer(data, dtype=np.uint32, count=count + 1, offset=position)
+        position += 4 * (count + 1)
+        return cls(*columns, offsets, data[position:], speaker)
+
+    def to_bytes(self):
+        parts = [_HEADER.pack(SEGMENTS_MAGIC, len(self))]
+        parts.extend(getattr(self, name).astype(np.float32).tobytes() for name in _FLOAT_COLUMNS)
+        speaker = self.speaker.astype(np.int16).tobytes()
+        parts.append(speaker + b"\0" * (_speaker_column_size(len(self)) - len(speaker)))
+        parts.append(self.offsets.astype(np.uint32).tobytes())
+        parts.append(self.text_blob)
+        return b"".join(parts)
+
+    def __len__(self):
+        return len(self.start)
+
+    def text(self, i):
+        return self.text_blob[self.offsets[i]:self.offsets[i + 1]].decode("utf-8")
+
+    def has_speakers(self):
+        return bool((self.speaker != NO_SPEAKER).any())
+
+    def full_text(self):
+        """Tekst transkrypcji; po diaryzacji każda wypowiedź w osobnej linii z etykietą mówcy"""
+        if not self.has_speakers():
+            return " ".join(self.text(i) for i in range(len(self)))
+        turns = []
+        for i in range(len(self)):
+            speaker = int(self.speaker[i])
+            if turns and turns[-1][0] == speaker:
+                turns[-1][1].append(self.text(i))
+            else:
+                turns.append((speaker, [self.text(i)]))
+        return "\n".join(f"{speaker_label(speaker)}: {' '.join(texts)}" for speaker, texts in turns)
+
+    def take(self, indices):
+        """Zwraca nową tabelę z wybranymi segmentami (w podanej kolejności)"""
+        indices = np.asarray(indices, dtype=np.intp)
+        encoded = [self.text_blob[self.offsets[i]:self.offsets[i + 1]] for i in indices]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+        np.cumsum([len(text) for text in encoded], out=offsets[1:])
+        return SegmentTable(
+            self.start[indices], self.end[indices], self.avg_logprob[indices],
+            self.no_speech_prob[indices], offsets, b"".join(encoded), self.speaker[indices],
+        )
+
+    def between(self, start, end):
+        """Segmenty nachodzące na przedział czasu [start, end) w sekundach"""
+        return self.take(np.flatnonzero((self.end > start) & (self.start < end)))
+
+    def to_dicts(self):
+        return [
+            {
+                "start": float(self.start[i]),
+                "end": float(self.end[i]),
+                "text": self.text(i),
+                "avg_logprob": float(self.avg_logprob[i]),
+                "no_speech_prob": float(self.no_speech_prob[i]),
+                "speaker": int(self.speaker[i]),
+            }
+            for i in range(len(self))
+        ]
+
+def _speaker_column_size(count):
+    # Kolumna int16 dopełniona do wielokrotności 4 bajtów, żeby przesunięcia uint32 były wyrównane
+    return (2 * count + 3) // 4 * 4
+
+def speaker_label(speaker):
+    return f"Speaker {speaker + 1}"
+
+def assign_speakers(table, turns, only_unknown=False):
+    """Przypisuje segmentom mówcę z tur diaryzacji [(start, end, mówca)] o największym wspólnym czasie.
+    Z only_unknown=True uzupełnia tylko segmenty bez mówcy."""
+    if not len(table) or not turns:
+        return table
+    bounds = np.asarray(turns, dtype=np.float32)
+    speakers = bounds[:, 2].astype(np.int16)
+    # Macierz segmenty x tury: czas nakładania się, potem suma po mówcach
+    overlap = np.clip(
+        np.minimum(table.end[:, None], bounds[None, :, 1]) - np.maximum(table.start[:, None], bounds[None, :, 0]), 0, None
+    )
+    per_speaker = np.zeros((len(table), int(speakers.max()) + 1), dtype=np.float32)
+    np.add.at(per_speaker.T, speakers, overlap.T)
+    best = np.where(per_speaker.max(axis=1) > 0, per_speaker.argmax(axis=1), NO_SPEAKER).astype(np.int16)
+    if only_unknown:
+        best = np.where(table.speaker == NO_SPEAKER, best, table.speaker).astype(np.int16)
+    return SegmentTable(table.start, table.end, table.avg_logprob, table.no_speech_prob, table.offsets, table.text_blob, best)
+
+def speaker_turns(table):
+    """Segmenty z przypisanym mówcą jako tury [(start, end, mówca)]"""
+    known = np.flatnonzero(table.speaker != NO_SPEAKER)
+    return [(float(table.start[i]), float(table.end[i]), int(table.speaker[i])) for i in known]
+
+def low_confidence_windows(table, logprob_threshold=-1.0, no_speech_threshold=0.6, merge_gap=2.0):
+    """Zwraca posortowane przedziały czasu (start, end) obejmujące segmenty o niskiej pewności"""
+    # Słaby segment: niski avg_logprob albo oznaczenie jako prawdopodobna cisza.
+    # Sąsiednie słabe segmenty bliżej niż merge_gap sekund łączymy w jedno okno.
+    weak = np.flatnonzero((table.avg_logprob < logprob_threshold) | (table.no_speech_prob > no_speech_threshold))
+    windows = []
+    for i in weak:
+        start, end = float(table.start[i]), float(table.end[i])
+        if windows and start - windows[-1][1] < merge_gap:
+            windows[-1][1] = max(windows[-1][1], end)
+        else:
+            windows.append([start, end])
+    return [(start, end) for start, end in windows]
+
+def splice_segments(table, windows, replacements):
+    """Zastępuje segmenty z okien nowymi segmentami. replacements to listy segmentów (czasy bezwzględne) dla kolejnych okien."""
+    if not windows:
+        return table
+    bounds = np.asarray(windows, dtype=np.float32)
+    middle = (table.start + table.end) / 2
+    inside = ((middle[:, None] >= bounds[:, 0]) & (middle[:, None] <= bounds[:, 1])).any(axis=1)
+
+    merged = [segment for keep, segment in zip(~inside, table.to_dicts()) if keep]
+    for (start, end), segments in zip(windows, replacements):
+        # Okno dekodujemy z marginesem - zostawiamy tylko segmenty, których środek leży w oknie
+        merged.extend(s for s in segments if start <= (s["start"] + s["end"]) / 2 <= end)
+    merged.sort(key=lambda segment: segment["start"])
+    # Nowe segmenty dostają mówcę z zastępowanych fragmentów
+    return assign_speakers(SegmentTable.from_whisper(merged), speaker_turns(table), only_unknown=True)
+
+def _timestamp(seconds, separator):
+    milliseconds = int(round(float(seconds) * 1000))
+    hours, milliseconds = divmod(milliseconds, 3_600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{milliseconds:03d}"
+
+def iter_srt(table):
+    for i in range(len(table)):
+        text = table.text(i)
+        if table.speaker[i] != NO_SPEAKER:
+            text = f"{speaker_label(int(table.speaker[i]))}: {text}"
+        yield f"{i + 1}\n{_timestamp(table.start[i], ',')} --> {_timestamp(table.end[i], ',')}\n{text}\n\n"
+
+def iter_vtt(table):
+    yield "WEBVTT\n\n"
+    for i in range(len(table)):
+        text = table.text(i)
+        if table.speaker[i] != NO_SPEAKER:
+            text = f"<v {speaker_label(int(table.speaker[i]))}>{text}"
+        yield f"{_timestamp(table.start[i], '.')} --> {_timestamp(table.end[i], '.')}\n{text}\n\n"
+
+def iter_json(table):
+    yield "["
+    for i in range(len(table)):
+        segment = {
+            "start": round(float(table.start[i]), 3),
+            "end": round(float(table.end[i]), 3),
+            "text": table.text(i),
+            "avg_logprob": round(float(table.avg_logprob[i]), 4),
+        }
+        if table.speaker[i] != NO_SPEAKER:
+            segment["speaker"] = speaker_label(int(table.speaker[i]))
+        yield ("," if i else "") + json.dumps(segment, ensure_ascii=False)
+    yield "]"
+
+SEGMENT_EXPORTS = {
+    "srt": (iter_srt, "application/x-subrip"),
+    "vtt": (iter_vtt, "text/vtt"),
+    "json": (iter_json, "application/json"),
+}
+
+def write_segments(output, data, fmt):
+    """Zapisuje eksport segmentów (srt/vtt/json) z binarnej tabeli segmentów do obiektu plikowego. Zwraca typ MIME."""
+    iterator, mime = SEGMENT_EXPORTS[fmt]
+    for part in iterator(SegmentTable.from_bytes(data)):
+        output.write(part.encode("utf-8"))
+    return mime
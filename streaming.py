@@ -0,0 +1,210 @@
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from audio import PCM_SAMPLE_RATE, PCM_DTYPE
+
+# Transkrypcja na żywo: ffmpeg dekoduje strumień (URL na żywo albo rosnący plik) do PCM na stdout,
+# a ciepły model transkrybuje kolejne okna. Okno kończymy w najcichszym miejscu przy jego końcu,
+# żeby nie ciąć słów. Gdy transkrypcja nie nadąża, najstarsze nieprzetworzone audio jest pomijane,
+# więc opóźnienie tekstu względem strumienia pozostaje ograniczone.
+STREAM_WINDOW_SECONDS = float(os.getenv("STREAM_WINDOW_SECONDS", 8))
+STREAM_MAX_LAG_SECONDS = float(os.getenv("STREAM_MAX_LAG_SECONDS", 30))
+STREAM_SECTION_SECONDS = float(os.getenv("STREAM_SECTION_SECONDS", 300))  # Notatki cząstkowe co tyle sekund nagrania
+STREAM_MAX_SECONDS = float(os.getenv("STREAM_MAX_SECONDS", 3600))  # Limit długości jednej sesji na żywo
+STREAM_IDLE_TIMEOUT_SECONDS = float(os.getenv("STREAM_IDLE_TIMEOUT_SECONDS", 15))  # Brak nowych danych = koniec strumienia
+STREAM_READ_SECONDS = 0.5
+STREAM_CUT_SEARCH_SECONDS = 2.0
+STREAM_MIN_WINDOW_SECONDS = 1.0
+STREAM_SILENCE_DB = -50.0  # Okna ciszy pomijamy - whisper dopowiada w nich zmyślone zdania
+STREAM_PROMPT_CHARS = 200  # Końcówka dotychczasowego tekstu jako kontekst dla kolejnego okna
+STREAM_URL_SCHEMES = ("http", "https", "rtmp", "rtmps", "rtsp", "srt")
+GAP_MARKER = "[...]"
+
+class PcmStream:
+    """Strumień PCM float32 16 kHz mono z procesu ffmpeg, czytany w tle kawałkami po 0.5 s"""
+
+    def __init__(self, command):
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL)
+        self.ended = False
+        self._chunks = deque()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._reader = threading.Thread(target=self._read, daemon=True, name="stream-reader")
+        self._reader.start()
+
+    def _read(self):
+        chunk_bytes = int(STREAM_READ_SECONDS * PCM_SAMPLE_RATE) * np.dtype(PCM_DTYPE).itemsize
+        try:
+            while data := self.process.stdout.read(chunk_bytes):
+                usable = len(data) - len(data) % np.dtype(PCM_DTYPE).itemsize
+                with self._lock:
+                    self._chunks.append((time.monotonic(), np.frombuffer(data[:usable], dtype=PCM_DTYPE)))
+                self._ready.set()
+        finally:
+            self.ended = True
+            self._ready.set()
+
+    def take(self, timeout=STREAM_READ_SECONDS):
+        """Zwraca (całe audio odebrane od poprzedniego wywołania, czas odebrania ostatniego kawałka)"""
+        self._ready.wait(timeout)
+        with self._lock:
+            chunks = list(self._chunks)
+            self._chunks.clear()
+            if not self.ended:
+                self._ready.clear()
+        if not chunks:
+            return np.zeros(0, dtype=PCM_DTYPE), None
+        return np.concatenate([chunk for _, chunk in chunks]), chunks[-1][0]
+
+    def finished(self):
+        with self._lock:
+            return self.ended and not self._chunks
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process.stdout.close()
+
+def open_stream(source, idle_timeout=STREAM_IDLE_TIMEOUT_SECONDS):
+    """Otwiera strumień z URL (HLS, RTMP, Icecast...) albo z lokalnego pliku, który wciąż rośnie"""
+    timeout = ["-rw_timeout", str(int(idle_timeout * 1_000_000))]
+    if os.path.exists(source):
+        # Protokół file z follow=1 czeka na dopisywane dane zamiast kończyć na obecnym końcu pliku
+        source_args = ["-follow", "1", *timeout, "-i", f"file:{os.path.abspath(source)}"]
+    else:
+        source_args = [*timeout, "-i", source]
+    return PcmStream([
+        "ffmpeg", "-nostdin", "-v", "error", *source_args,
+        "-vn", "-ac", "1", "-ar", str(PCM_SAMPLE_RATE), "-f", "f32le", "pipe:1",
+    ])
+
+def _cut_point(audio):
+    """Indeks próbki w najcichszej ramce 100 ms w końcówce okna (granica bez ucinania słów)"""
+    frame = PCM_SAMPLE_RATE // 10
+    search = min(len(audio), int(STREAM_CUT_SEARCH_SECONDS * PCM_SAMPLE_RATE)) // frame * frame
+    if search < frame:
+        return len(audio)
+    tail = np.asarray(audio[len(audio) - search:]).reshape(-1, frame)
+    quietest = int(np.argmin(np.einsum("ij,ij->i", tail, tail)))
+    return len(audio) - search + quietest * frame + frame // 2
+
+def _is_silence(audio):
+    return 10 * np.log10(float(np.mean(np.square(audio))) + 1e-10) < STREAM_SILENCE_DB
+
+class LiveTranscriber:
+    """Transkrybuje strumień oknami i zwraca zdarzenia dla interfejsu:
+    {"type": "partial", ...} po każdym oknie, {"type": "section", ...} po notatkach cząstkowych
+    i {"type": "done", ...} na końcu.
+
+    transcribe_window(audio, prompt, language) -> (segmenty whispera z czasami względem okna, język)
+    summarize_section(tekst) -> notatki; wywoływane w tle, nie blokuje transkrypcji.
+    """
+
+    def __init__(self, transcribe_window, summarize_section=None, language=None,
+                 window_seconds=STREAM_WINDOW_SECONDS, max_lag_seconds=STREAM_MAX_LAG_SECONDS,
+                 section_seconds=STREAM_SECTION_SECONDS, max_seconds=STREAM_MAX_SECONDS):
+        self.transcribe_window = transcribe_window
+        self.summarize_section = summarize_section
+        self.language = language
+        self.window_seconds = window_seconds
+        self.max_lag_seconds = max(max_lag_seconds, window_seconds + STREAM_CUT_SEARCH_SECONDS)
+        self.section_seconds = section_seconds
+        self.max_seconds = max_seconds
+        self.segments = []
+        self.texts = []
+        self.lags = []
+        self.dropped_seconds = 0.0
+        self.section_notes = []
+
+    @property
+    def text(self):
+        return " ".join(self.texts)
+
+    def _transcribe(self, audio, offset):
+        if _is_silence(audio):
+            return
+        prompt = self.text[-STREAM_PROMPT_CHARS:] or None
+        segments, language = self.transcribe_window(audio, prompt, self.language)
+        # Język wykryty w pierwszym oknie z mową obowiązuje do końca strumienia
+        self.language = self.language or language
+        for segment in segments:
+            if segment.get("no_speech_prob", 0.0) > 0.6 and segment.get("avg_logprob", 0.0) < -1.0:
+                continue
+            text = segment["text"].strip()
+            if not text:
+                continue
+            self.segments.append({**segment, "start": segment["start"] + offset, "end": segment["end"] + offset, "text": text})
+            self.texts.append(text)
+
+    def _stats(self, audio_seconds):
+        return {
+            "audio_seconds": round(audio_seconds, 1),
+            "lag_seconds": round(self.lags[-1], 2) if self.lags else None,
+            "max_lag_seconds": round(max(self.lags), 2) if self.lags else None,
+            "dropped_seconds": round(self.dropped_seconds, 1),
+        }
+
+    def run(self, stream):
+        buffer = np.zeros(0, dtype=PCM_DTYPE)
+        buffer_start = 0.0  # Czas (s) pierwszej próbki bufora liczony od początku strumienia
+        last_arrival = None
+        section_text_start, section_index = 0, 0
+        pending = deque()
+        window = int(self.window_seconds * PCM_SAMPLE_RATE)
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stream-notes") if self.summarize_section else None
+        try:
+            while True:
+                audio, arrival = stream.take()
+                if len(audio):
+                    buffer = np.concatenate([buffer, audio])
+                    last_arrival = arrival
+                final = stream.finished() or buffer_start + len(buffer) / PCM_SAMPLE_RATE >= self.max_seconds
+
+                # Transkrypcja nie nadąża - pomijamy najstarszą część zaległości
+                if len(buffer) > self.max_lag_seconds * PCM_SAMPLE_RATE:
+                    drop = len(buffer) - window
+                    buffer = buffer[drop:]
+                    buffer_start += drop / PCM_SAMPLE_RATE
+                    self.dropped_seconds += drop / PCM_SAMPLE_RATE
+                    self.texts.append(GAP_MARKER)
+
+                if len(buffer) >= window or (final and len(buffer) >= STREAM_MIN_WINDOW_SECONDS * PCM_SAMPLE_RATE):
+                    cut = len(buffer) if final else _cut_point(buffer)
+                    self._transcribe(buffer[:cut], buffer_start)
+                    buffer = buffer[cut:]
+                    buffer_start += cut / PCM_SAMPLE_RATE
+                    self.lags.append(time.monotonic() - last_arrival)
+                    yield {"type": "partial", "text": self.text, **self._stats(buffer_start)}
+
+                    # Notatki cząstkowe dla zakończonego odcinka liczą się w tle
+                    if executor and buffer_start >= (section_index + 1) * self.section_seconds:
+                        section_text = " ".join(self.texts[section_text_start:])
+                        section_text_start = len(self.texts)
+                        section_index += 1
+                        if section_text.strip():
+                            pending.append((section_index, executor.submit(self.summarize_section, section_text)))
+
+                while pending and (final or pending[0][1].done()):
+                    index, future = pending.popleft()
+                    try:
+                        notes = future.result()
+                    except Exception as e:
+                        notes = f"Error generating section notes: {e}"
+                    self.section_notes.append(notes)
+                    yield {"type": "section", "index": index, "notes": notes}
+
+                if final:
+                    break
+        finally:
+            stream.close()
+            if executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+        yield {"type": "done", "text": self.text, "segments": self.segments, **self._stats(buffer_start)}
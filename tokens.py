@@ -0,0 +1,127 @@
+import functools
+import hashlib
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+
+# Dokładne liczenie tokenów wymaga tiktoken; bez niego używamy przybliżenia ~4 znaki na token
+try:
+    import tiktoken
+    HAS_TIKTOKEN = True
+except ImportError:
+    HAS_TIKTOKEN = False
+
+# Budżet tokenów promptu na jedno wywołanie (gpt-4o-mini ma okno 128k - zostawiamy miejsce na odpowiedź)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 100000))
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 3  # Narzut formatu czatu na każdą wiadomość
+
+FILLER_WORDS = (
+    "um", "umm", "uh", "uhh", "uhm", "erm", "hmm", "mhm",  # en
+    "yyy", "yy", "eee", "ee", "ymm",  # pl
+    "äh", "ähm", "öh",  # de
+    "euh", "heu",  # fr
+)
+_FILLER = re.compile(r"(?<!\w)(?:" + "|".join(FILLER_WORDS) + r")(?!\w)[,.]?\s*", re.IGNORECASE)
+_REPEATED_WORD = re.compile(r"\b(\w+)(?:[\s,]+\1\b)+", re.IGNORECASE)
+_SENTENCE_END = re.compile(r"(?<=[.!?…])(\s+)")
+_WHITESPACE = re.compile(r"[ \t]+")
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+TRUNCATION_MARKER = "\n[...]\n"
+
+@functools.lru_cache(maxsize=8)
+def _encoding(model):
+    """Kodowanie tiktoken dla modelu albo None (brak biblioteki lub plików kodowania, np. offline)"""
+    if not HAS_TIKTOKEN:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print(f"Error loading tokenizer, using estimates: {e}")
+        return None
+
+def count_tokens(text, model="gpt-4o-mini"):
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def count_message_tokens(messages, model="gpt-4o-mini"):
+    """Szacuje liczbę tokenów promptu czatu przed wysłaniem"""
+    return sum(count_tokens(message["content"], model) + MESSAGE_OVERHEAD_TOKENS for message in messages) + MESSAGE_OVERHEAD_TOKENS
+
+def compact_whitespace(text):
+    """Usuwa wcięcia i nadmiarowe spacje z szablonów promptów (każda spacja to płatny token)"""
+    lines = [_WHITESPACE.sub(" ", line).strip() for line in text.splitlines()]
+    return _BLANK_LINES.sub("\n\n", "\n".join(lines)).strip()
+
+def dedupe_segments(text):
+    """Usuwa powtórzone zdania następujące po sobie (typowe pętle whispera)"""
+    kept = []
+    previous = None
+    # Zachowujemy oryginalne odstępy - podziały linii oddzielają tury mówców
+    parts = _SENTENCE_END.split(text)
+    for sentence, separator in zip(parts[0::2], parts[1::2] + [""]):
+        key = sentence.strip().lower()
+        if key and key == previous:
+            continue
+        kept.append(sentence + separator)
+        previous = key
+    return "".join(kept).strip()
+
+def strip_fillers(text):
+    """Wycina wtrącenia (um, yyy, äh...) i jąkanie ("we we" -> "we")"""
+    return _REPEATED_WORD.sub(r"\1", _WHITESPACE.sub(" ", _FILLER.sub("", text)).strip())
+
+def truncate_to_budget(text, budget_tokens, model="gpt-4o-mini"):
+    """Skraca tekst do budżetu, zostawiając początek (2/3) i koniec (1/3) rozmowy"""
+    budget_tokens = max(0, budget_tokens)
+    if count_tokens(text, model) <= budget_tokens:
+        return text
+    if not budget_tokens:
+        return ""
+    head_budget = budget_tokens * 2 // 3
+    tail_budget = budget_tokens - head_budget
+    encoding = _encoding(model)
+    if encoding:
+        tokens = encoding.encode(text, disallowed_special=())
+        return encoding.decode(tokens[:head_budget]) + TRUNCATION_MARKER + encoding.decode(tokens[-tail_budget:])
+    return text[:head_budget * CHARS_PER_TOKEN] + TRUNCATION_MARKER + text[-tail_budget * CHARS_PER_TOKEN:]
+
+# Wyniki fit_transcript dla równoległych wywołań na tej samej transkrypcji (np. notatki w kilku
+# językach). Kluczem jest hash tekstu, więc cache nie trzyma pełnych transkrypcji, a wynik
+# ma najwyżej budget_tokens tokenów.
+FIT_CACHE_ENTRIES = 4
+_fit_cache = OrderedDict()
+_fit_lock = threading.Lock()
+
+def fit_transcript(transcript, budget_tokens=PROMPT_TOKEN_BUDGET, model="gpt-4o-mini"):
+    """Przygotowuje transkrypcję do promptu: zawsze usuwa powtórzenia, a przy przekroczonym
+    budżecie kolejno wycina wtrącenia i skraca środek. Wynik jest deterministyczny, więc kilka
+    wywołań dla tej samej transkrypcji dostaje identyczny tekst (wspólny prefiks dla cache promptu).
+    Zwraca (tekst, czy_skrócono_ponad_usunięcie_powtórzeń)."""
+    key = (hashlib.sha256((transcript or "").encode("utf-8")).digest(), budget_tokens, model)
+    with _fit_lock:
+        if key in _fit_cache:
+            _fit_cache.move_to_end(key)
+            return _fit_cache[key]
+    result = _fit_transcript(transcript, budget_tokens, model)
+    with _fit_lock:
+        _fit_cache[key] = result
+        while len(_fit_cache) > FIT_CACHE_ENTRIES:
+            _fit_cache.popitem(last=False)
+    return result
+
+def _fit_transcript(transcript, budget_tokens, model):
+    text = dedupe_segments(compact_whitespace(transcript or ""))
+    if count_tokens(text, model) <= budget_tokens:
+        return text, False
+    text = strip_fillers(text)
+    return truncate_to_budget(text, budget_tokens, model), True